@@ -0,0 +1,141 @@
+"""
+Content-addressed attachment storage
+
+Attachment payloads are written once to MAIL_ATTACHMENT_DIR under their
+SHA-256 (``ab/cd/abcd…``), so the same file mailed to many users or synced
+from several accounts takes disk space only once. email_attachments rows
+point at a blob by hash; downloads are served straight from the blob file
+with FileResponse, which handles Range requests and sendfile.
+
+Blobs are never deleted along with their rows (emails and their attachment
+rows go by FK cascade). collect_garbage() sweeps blobs no row refers to
+any more; the mail poller runs it periodically. Blobs touched within
+ORPHAN_GRACE_SECONDS are kept, since a sync may have written one whose row
+is not committed yet; put() refreshes the mtime of a blob it reuses.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from email import policy
+from email.parser import BytesParser
+from typing import Iterable, Iterator, List, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from config import settings
+import models
+
+_message_parser = BytesParser(policy=policy.default)
+
+ORPHAN_GRACE_SECONDS = 3600
+GC_CHUNK = 500   # hashes looked up per query while sweeping
+
+
+class BlobStore:
+    """Immutable blobs on disk, addressed by the SHA-256 of their content"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path(sha256))
+
+    def put(self, data: bytes) -> str:
+        """Store ``data`` unless an identical blob exists; returns its hash"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path(sha256)
+        try:
+            os.utime(path)   # reused: keep it out of collect_garbage()'s reach until its row commits
+            return sha256
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)   # concurrent writers of the same blob write identical bytes
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return sha256
+
+    def entries(self) -> Iterator[os.DirEntry]:
+        """Every file under the root: blobs and leftover .tmp files"""
+        if not os.path.isdir(self.root):
+            return
+        for first in os.scandir(self.root):
+            if not first.is_dir():
+                continue
+            for second in os.scandir(first.path):
+                if second.is_dir():
+                    yield from (entry for entry in os.scandir(second.path) if entry.is_file())
+
+
+blob_store = BlobStore(settings.MAIL_ATTACHMENT_DIR)
+
+
+def iter_attachments(raw: bytes) -> Iterator[Tuple[str, str, bytes]]:
+    """(filename, content type, decoded payload) for every attachment in an RFC 822 message"""
+    message = _message_parser.parsebytes(raw)
+    for index, part in enumerate(message.iter_attachments(), 1):
+        if part.is_multipart():
+            continue
+        payload = part.get_payload(decode=True)
+        if payload is None:
+            continue
+        filename = part.get_filename() or f"attachment-{index}"
+        yield filename[:255], part.get_content_type(), payload
+
+
+def store_attachments(db: Session, messages: Iterable[Tuple[int, bytes]]) -> int:
+    """Extract and store the attachments of (email_id, raw message) pairs; returns how many rows were added.
+
+    ``messages`` is consumed one pair at a time, so a generator keeps only
+    one raw message in memory; the rows are inserted together at the end.
+    """
+    rows: List[dict] = []
+    for email_id, raw in messages:
+        for filename, content_type, payload in iter_attachments(raw):
+            rows.append({
+                "email_id": email_id,
+                "filename": filename,
+                "content_type": content_type[:255],
+                "size": len(payload),
+                "sha256": blob_store.put(payload),
+            })
+    if rows:
+        db.execute(insert(models.EmailAttachment), rows)
+    return len(rows)
+
+
+def collect_garbage(db: Session, grace_seconds: int = ORPHAN_GRACE_SECONDS) -> int:
+    """Delete blobs (and abandoned .tmp files) that no attachment row refers to; returns how many were removed"""
+    cutoff = time.time() - grace_seconds
+    candidates = {}
+    for entry in blob_store.entries():
+        if entry.stat().st_mtime < cutoff:
+            candidates.setdefault(entry.name, entry.path)
+    names = list(candidates)
+    A = models.EmailAttachment
+    for i in range(0, len(names), GC_CHUNK):
+        chunk = names[i:i + GC_CHUNK]
+        for sha256 in db.scalars(select(A.sha256).where(A.sha256.in_(chunk)).distinct()):
+            del candidates[sha256]
+    removed = 0
+    for path in candidates.values():
+        try:
+            if os.stat(path).st_mtime < cutoff:   # not reused by a sync since the listing
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
@@ -0,0 +1,140 @@
+"""
+List serialization benchmark
+
+Compares the two ways a page of transactions/events/emails can be turned
+into a JSON body:
+
+- "orm": ORM objects validated through the response_model schema with
+  from_attributes and dumped by Pydantic (what FastAPI does when a route
+  returns ORM rows),
+- "fast": column tuples turned into dicts and encoded with orjson
+  (fast_json.py, what the list routes do now).
+
+Both include the query. The target database is dropped and recreated, so it
+is taken from BENCH_DATABASE_URL and never from the app's DATABASE_URL.
+
+    python benchmarks/bench_serialization.py [rows] [repeats]
+"""
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import List
+
+os.environ["DATABASE_URL"] = os.environ.get("BENCH_DATABASE_URL", "sqlite:////tmp/prohub_bench.db")
+os.environ.setdefault("SECRET_KEY", "serialization-bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import TypeAdapter
+from sqlalchemy.orm import joinedload
+
+from database import engine, Base, SessionLocal
+import fast_json
+import models
+import schemas
+from routers.finance import _CATEGORY_FIELDS, _transaction_item
+
+
+def seed(db, rows: int) -> models.User:
+    user = models.User(username="bench", hashed_password="x")
+    db.add(user)
+    db.flush()
+    categories = [models.Category(user_id=user.id, name=f"c{i}") for i in range(10)]
+    account = models.MailAccount(
+        user_id=user.id, email_address="bench@example.com", provider="custom",
+        imap_server="imap.example.com", smtp_server="smtp.example.com", password="x",
+    )
+    db.add_all(categories + [account])
+    db.flush()
+    for i in range(rows):
+        day = date(2026, 1, 1) + timedelta(days=i % 365)
+        db.add(models.Transaction(
+            user_id=user.id, category_id=categories[i % 10].id if i % 3 else None, title=f"Transaction {i}",
+            amount=Decimal("12.50") + i, type="expense", date=day, notes="note" if i % 2 else None,
+        ))
+        db.add(models.CalendarEvent(user_id=user.id, title=f"Event {i}", description="x" * 40, date=day, caldav_uid=f"uid-{i}"))
+        db.add(models.Email(
+            account_id=account.id, message_id=f"<{i}@example.com>", subject=f"Subject {i}",
+            sender="a@example.com", recipients="b@example.com", date=datetime.combine(day, datetime.min.time()),
+        ))
+    db.commit()
+    return user
+
+
+def orm_path(db, model, schema, order, options=(), **filters) -> bytes:
+    adapter = TypeAdapter(List[schema])
+    rows = db.query(model).options(*options).filter_by(**filters).order_by(order).all()
+    return adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+
+
+def fast_path(db, model, schema, order, **filters) -> bytes:
+    rows = db.query(*fast_json.columns(model, schema)).filter_by(**filters).order_by(order).all()
+    return fast_json.dumps([row._asdict() for row in rows])
+
+
+def fast_transactions(db, user_id: int) -> bytes:
+    """get_transactions' query and row shaping"""
+    T, C = models.Transaction, models.Category
+    rows = (
+        db.query(*fast_json.columns(T, schemas.TransactionResponse, exclude=("category",)),
+                 *[getattr(C, name).label(f"category__{name}") for name in _CATEGORY_FIELDS])
+        .outerjoin(C, C.id == T.category_id)
+        .filter(T.user_id == user_id)
+        .order_by(T.date.desc())
+        .all()
+    )
+    return fast_json.dumps([_transaction_item(row) for row in rows])
+
+
+def timed(fn, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = seed(db, rows)
+        account_id = db.query(models.MailAccount.id).filter_by(user_id=user.id).scalar()
+        T, E, M = models.Transaction, models.CalendarEvent, models.Email
+        cases = [
+            # The ORM side gets its category eagerly joined, i.e. its best case rather than a lazy load per row
+            ("transactions",
+             lambda: orm_path(db, T, schemas.TransactionResponse, T.date.desc(), options=[joinedload(T.category)], user_id=user.id),
+             lambda: fast_transactions(db, user.id)),
+            ("events",
+             lambda: orm_path(db, E, schemas.CalendarEventResponse, E.date.asc(), user_id=user.id),
+             lambda: fast_path(db, E, schemas.CalendarEventResponse, E.date.asc(), user_id=user.id)),
+            ("emails",
+             lambda: orm_path(db, M, schemas.EmailResponse, M.date.desc(), account_id=account_id),
+             lambda: fast_path(db, M, schemas.EmailResponse, M.date.desc(), account_id=account_id)),
+        ]
+        print(f"{rows} rows, best of {repeats}")
+        for name, orm_fn, fast_fn in cases:
+            if orm_fn() != fast_fn():
+                print(f"{name}: bodies differ")
+                return 1
+
+            def run_orm():
+                db.expire_all()
+                orm_fn()
+
+            orm, fast = timed(run_orm, repeats), timed(fast_fn, repeats)
+            print(f"{name:<13} orm {orm * 1e3:8.2f} ms ({orm / rows * 1e6:6.1f} us/row)   "
+                  f"fast {fast * 1e3:8.2f} ms ({fast / rows * 1e6:6.1f} us/row)   x{orm / fast:.1f}")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
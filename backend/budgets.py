@@ -0,0 +1,118 @@
+"""
+Budget evaluation
+
+Each budget covers a repeating window anchored at its ``start_date``
+(weekly, monthly, quarterly or yearly; anything else spans start_date to
+end_date). The current window of every budget is computed in Python, then
+all of them are sent to the database as one UNION ALL derived table and
+joined to the expense transactions, so a user's whole budget list costs one
+grouped query regardless of how many budgets there are.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import List, Tuple
+
+from sqlalchemy import Date, Integer, and_, func, or_, select
+from sqlalchemy.orm import Session, joinedload
+
+import models
+from finance_util import add_months, literal_table
+
+# period -> (unit, step)
+PERIODS = {
+    "weekly": ("D", 7),
+    "biweekly": ("D", 14),
+    "monthly": ("M", 1),
+    "quarterly": ("M", 3),
+    "yearly": ("M", 12),
+}
+
+
+def period_window(budget: models.Budget, today: date) -> Tuple[date, date]:
+    """Inclusive [start, end] of the budget period containing ``today``.
+
+    Before ``start_date`` this is the first period; after ``end_date`` the
+    last one. Windows never extend past ``end_date``.
+    """
+    anchor = budget.start_date
+    day = min(max(today, anchor), budget.end_date) if budget.end_date else max(today, anchor)
+    unit, step = PERIODS.get((budget.period or "").lower(), (None, None))
+    if unit == "D":
+        k = (day - anchor).days // step
+        start, end = anchor + timedelta(days=k * step), anchor + timedelta(days=(k + 1) * step - 1)
+    elif unit == "M":
+        k = ((day.year - anchor.year) * 12 + day.month - anchor.month) // step
+        start = add_months(anchor, k * step)
+        if start > day:
+            k -= 1
+            start = add_months(anchor, k * step)
+        end = add_months(anchor, (k + 1) * step) - timedelta(days=1)
+    else:
+        start, end = anchor, budget.end_date or day
+    if budget.end_date and end > budget.end_date:
+        end = budget.end_date
+    return start, end
+
+
+WINDOW_COLUMNS = [("budget_id", Integer), ("category_id", Integer), ("window_start", Date), ("window_end", Date)]
+
+
+def budget_status(db: Session, user_id: int, today: date = None) -> dict:
+    """Every budget of ``user_id`` with spent/remaining/percentage for its current window"""
+    today = today or date.today()
+    budgets = (
+        db.query(models.Budget)
+        .options(joinedload(models.Budget.category))
+        .filter(models.Budget.user_id == user_id)
+        .order_by(models.Budget.id)
+        .all()
+    )
+    if not budgets:
+        return {"budgets": [], "alerts": []}
+
+    windows = {b.id: period_window(b, today) for b in budgets}
+    w = literal_table("budget_windows", WINDOW_COLUMNS, [(b.id, b.category_id, *windows[b.id]) for b in budgets])
+    T = models.Transaction
+    spent_rows = db.execute(
+        select(w.c.budget_id, func.coalesce(func.sum(T.amount), 0))
+        .select_from(w)
+        .join(T, and_(
+            T.user_id == user_id,
+            T.type == "expense",
+            T.date >= w.c.window_start,
+            T.date <= w.c.window_end,
+            or_(w.c.category_id.is_(None), T.category_id == w.c.category_id),
+        ))
+        .group_by(w.c.budget_id)
+    ).all()
+    spent_by_budget = {budget_id: Decimal(str(total)) for budget_id, total in spent_rows}
+
+    statuses, alerts = [], []
+    for b in budgets:
+        spent = spent_by_budget.get(b.id, Decimal("0")).quantize(Decimal("0.01"))
+        amount = b.amount or Decimal("0")
+        percentage = int(spent * 100 / amount) if amount > 0 else (100 if spent > 0 else 0)
+        threshold = b.alert_threshold if b.alert_threshold is not None else 80
+        status = {
+            "id": b.id,
+            "user_id": b.user_id,
+            "name": b.name,
+            "amount": amount,
+            "period": b.period,
+            "start_date": b.start_date,
+            "end_date": b.end_date,
+            "category_id": b.category_id,
+            "alert_threshold": threshold,
+            "created_at": b.created_at,
+            "category": b.category,
+            "spent": spent,
+            "remaining": amount - spent,
+            "percentage": percentage,
+            "period_start": windows[b.id][0],
+            "period_end": windows[b.id][1],
+            "alert": percentage >= threshold,
+        }
+        statuses.append(status)
+        if status["alert"]:
+            alerts.append(status)
+    return {"budgets": statuses, "alerts": alerts}
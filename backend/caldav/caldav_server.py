@@ -1,45 +1,378 @@
+"""
+CalDAV server for the user's ProHub calendar
+
+Layout (relative to /caldav):
+
+    /                     principal and calendar home
+    /calendar/            the calendar collection
+    /calendar/{uid}.ics   one event
+
+Clients poll cheaply: a Depth 0 PROPFIND on the collection returns its CTag
+and sync-token from a single counter lookup, and RFC 6578 sync-collection
+returns only the events changed or deleted since the client's token (see
+calendar_sync.py). calendar-multiget and calendar-query (with time-range) are
+supported for clients that fetch by href or date window instead.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import quote, unquote
+import xml.etree.ElementTree as ET
 from fastapi import APIRouter, Depends, Request, Response
-from sqlalchemy.orm import Session
-import uuid, models
-from database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import uuid, models, ics, versions, calendar_sync, radicale
+from database import get_async_db
 from dependencies import get_current_user
 
 router = APIRouter()
 
+DAV = "DAV:"
+CALDAV = "urn:ietf:params:xml:ns:caldav"
+CS = "http://calendarserver.org/ns/"
+for _prefix, _ns in (("D", DAV), ("C", CALDAV), ("CS", CS)):
+    ET.register_namespace(_prefix, _ns)
+
+ROOT_HREF = "/caldav/"
+COLLECTION_HREF = "/caldav/calendar/"
+ICS_CONTENT_TYPE = "text/calendar; charset=utf-8; component=VEVENT"
+
+
+def _t(ns: str, name: str) -> str:
+    return f"{{{ns}}}{name}"
+
+
+# ─── XML helpers ─────────────────────────────────────────────────────────────
+
+def _parse_body(body: bytes) -> Optional[ET.Element]:
+    if not body.strip():
+        return None
+    try:
+        return ET.fromstring(body)
+    except ET.ParseError:
+        return None
+
+
+def _requested_props(root: Optional[ET.Element]) -> Optional[List[str]]:
+    """Tags listed in <D:prop>, or None for allprop / an empty body"""
+    if root is None:
+        return None
+    prop = root.find(_t(DAV, "prop"))
+    if prop is None:
+        return None
+    return [child.tag for child in prop]
+
+
+def _href(parent: ET.Element, href: str) -> None:
+    ET.SubElement(parent, _t(DAV, "href")).text = href
+
+
+def _add_response(multistatus: ET.Element, href: str, props: Dict[str, object], requested: Optional[List[str]], status: Optional[str] = None) -> None:
+    """Append a <D:response>; ``props`` maps tag -> text or a callable filling the element"""
+    response = ET.SubElement(multistatus, _t(DAV, "response"))
+    _href(response, href)
+    if status:
+        ET.SubElement(response, _t(DAV, "status")).text = status
+        return
+    wanted = list(props) if requested is None else requested
+    found = [tag for tag in wanted if tag in props]
+    missing = [tag for tag in wanted if tag not in props]
+    for tags, code in ((found, "200 OK"), (missing, "404 Not Found")):
+        if not tags:
+            continue
+        propstat = ET.SubElement(response, _t(DAV, "propstat"))
+        prop = ET.SubElement(propstat, _t(DAV, "prop"))
+        for tag in tags:
+            elem = ET.SubElement(prop, tag)
+            value = props.get(tag)
+            if callable(value):
+                value(elem)
+            elif value is not None:
+                elem.text = str(value)
+        ET.SubElement(propstat, _t(DAV, "status")).text = f"HTTP/1.1 {code}"
+
+
+def _xml_response(root: ET.Element, status_code: int = 207) -> Response:
+    return Response(
+        content=ET.tostring(root, encoding="utf-8", xml_declaration=True),
+        media_type="application/xml; charset=utf-8",
+        status_code=status_code,
+    )
+
+
+def _children(*tags: str):
+    def fill(elem: ET.Element) -> None:
+        for tag in tags:
+            ET.SubElement(elem, tag)
+    return fill
+
+
+def _href_value(href: str):
+    return lambda elem: _href(elem, href)
+
+
+def _supported_reports(elem: ET.Element) -> None:
+    for ns, name in ((DAV, "sync-collection"), (CALDAV, "calendar-multiget"), (CALDAV, "calendar-query")):
+        report = ET.SubElement(ET.SubElement(elem, _t(DAV, "supported-report")), _t(DAV, "report"))
+        ET.SubElement(report, _t(ns, name))
+
+
+def _supported_components(elem: ET.Element) -> None:
+    ET.SubElement(elem, _t(CALDAV, "comp"), name="VEVENT")
+
+
+# ─── Properties ──────────────────────────────────────────────────────────────
+
+def _root_props() -> dict:
+    return {
+        _t(DAV, "resourcetype"): _children(_t(DAV, "collection")),
+        _t(DAV, "current-user-principal"): _href_value(ROOT_HREF),
+        _t(CALDAV, "calendar-home-set"): _href_value(ROOT_HREF),
+    }
+
+
+def _collection_props(version: int) -> dict:
+    return {
+        _t(DAV, "resourcetype"): _children(_t(DAV, "collection"), _t(CALDAV, "calendar")),
+        _t(DAV, "displayname"): "PolyHub",
+        _t(DAV, "current-user-principal"): _href_value(ROOT_HREF),
+        _t(CS, "getctag"): str(version),
+        _t(DAV, "sync-token"): calendar_sync.sync_token(version),
+        _t(DAV, "supported-report-set"): _supported_reports,
+        _t(CALDAV, "supported-calendar-component-set"): _supported_components,
+    }
+
+
+def _event_href(uid: str) -> str:
+    return f"{COLLECTION_HREF}{quote(uid)}.ics"
+
+
+def _event_props(event, with_data: bool) -> dict:
+    props = {
+        _t(DAV, "resourcetype"): None,
+        _t(DAV, "getetag"): calendar_sync.event_etag(event.id, event.sync_revision),
+        _t(DAV, "getcontenttype"): ICS_CONTENT_TYPE,
+    }
+    if with_data:
+        props[_t(CALDAV, "calendar-data")] = ics.calendar_object(event.caldav_uid, event.date, event.title, event.description)
+    return props
+
+
+def _wants_data(requested: Optional[List[str]]) -> bool:
+    return requested is not None and _t(CALDAV, "calendar-data") in requested
+
+
+# ─── Queries ─────────────────────────────────────────────────────────────────
+
+def _event_columns(with_data: bool):
+    E = models.CalendarEvent
+    columns = [E.id, E.caldav_uid, E.sync_revision]
+    if with_data:
+        columns += [E.date, E.title, E.description]
+    return columns
+
+
+async def _current_version(db: AsyncSession, user_id: int) -> int:
+    return await db.scalar(versions.version_query(user_id, calendar_sync.RESOURCE)) or 0
+
+
+async def _assign_missing_uids(db: AsyncSession, user_id: int) -> bool:
+    """Give events created without a UID a permanent one, so their hrefs stay stable"""
+    E = models.CalendarEvent
+    events = (await db.scalars(select(E).where(E.user_id == user_id, E.caldav_uid.is_(None)))).all()
+    for event in events:
+        event.caldav_uid = str(uuid.uuid4())
+    if events:
+        await db.commit()
+    return bool(events)
+
+
+def _uid_from_href(href: str) -> Optional[str]:
+    name = unquote(href.rstrip("/").rsplit("/", 1)[-1])
+    return name[:-4] if name.endswith(".ics") else None
+
+
+def _parse_utc(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S")
+    except ValueError:
+        return None
+
+
+def _date_bounds(time_range: Optional[ET.Element]):
+    """All-day event dates overlapping a CalDAV time-range, as (first, last) inclusive dates"""
+    if time_range is None:
+        return None, None
+    start, end = _parse_utc(time_range.get("start")), _parse_utc(time_range.get("end"))
+    first = start.date() if start else None
+    last = None
+    if end:
+        last = end.date() if end.time() != datetime.min.time() else end.date() - timedelta(days=1)
+    return first, last
+
+
+# ─── Endpoints ───────────────────────────────────────────────────────────────
+
 @router.options("/{path:path}")
 async def caldav_options(path: str):
-    return Response(headers={"DAV": "1, calendar-access", "Allow": "OPTIONS, GET, PUT, DELETE, PROPFIND"})
+    return Response(headers={"DAV": "1, 3, calendar-access", "Allow": "OPTIONS, GET, PUT, DELETE, PROPFIND, REPORT"})
 
 @router.api_route("/{path:path}", methods=["PROPFIND"])
-async def caldav_propfind(request: Request, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
-    events = db.query(models.CalendarEvent).filter(models.CalendarEvent.user_id == cu.id).all()
-    xml = '<?xml version="1.0"?><D:multistatus xmlns:D="DAV:">'
-    for e in events:
-        uid = e.caldav_uid or str(uuid.uuid4())
-        xml += f'<D:response><D:href>/caldav/calendar/{uid}.ics</D:href><D:propstat><D:status>HTTP/1.1 200 OK</D:status></D:propstat></D:response>'
-    xml += '</D:multistatus>'
-    return Response(content=xml, media_type="application/xml", status_code=207)
+async def caldav_propfind(path: str, request: Request, db: AsyncSession = Depends(get_async_db), cu: models.User = Depends(get_current_user)):
+    requested = _requested_props(_parse_body(await request.body()))
+    depth = request.headers.get("depth", "1")
+    target = path.strip("/")
+    multistatus = ET.Element(_t(DAV, "multistatus"))
+
+    if target == "":
+        _add_response(multistatus, ROOT_HREF, _root_props(), requested)
+        if depth != "0":
+            _add_response(multistatus, COLLECTION_HREF, _collection_props(await _current_version(db, cu.id)), requested)
+        return _xml_response(multistatus)
+
+    if target == "calendar":
+        if depth != "0":
+            await _assign_missing_uids(db, cu.id)
+        _add_response(multistatus, COLLECTION_HREF, _collection_props(await _current_version(db, cu.id)), requested)
+        if depth != "0":
+            with_data = _wants_data(requested)
+            E = models.CalendarEvent
+            rows = await db.execute(select(*_event_columns(with_data)).where(E.user_id == cu.id).order_by(E.id))
+            for event in rows:
+                _add_response(multistatus, _event_href(event.caldav_uid), _event_props(event, with_data), requested)
+        return _xml_response(multistatus)
+
+    uid = _uid_from_href(target) if target.startswith("calendar/") else None
+    if uid is None:
+        return Response(status_code=404)
+    E = models.CalendarEvent
+    with_data = _wants_data(requested)
+    event = (await db.execute(select(*_event_columns(with_data)).where(E.user_id == cu.id, E.caldav_uid == uid))).first()
+    if event is None:
+        return Response(status_code=404)
+    _add_response(multistatus, _event_href(uid), _event_props(event, with_data), requested)
+    return _xml_response(multistatus)
+
+@router.api_route("/{path:path}", methods=["REPORT"])
+async def caldav_report(path: str, request: Request, db: AsyncSession = Depends(get_async_db), cu: models.User = Depends(get_current_user)):
+    root = _parse_body(await request.body())
+    if root is None or path.strip("/") != "calendar":
+        return Response(status_code=400 if root is None else 404)
+    requested = _requested_props(root)
+    with_data = _wants_data(requested)
+    E = models.CalendarEvent
+    multistatus = ET.Element(_t(DAV, "multistatus"))
+
+    if root.tag == _t(DAV, "sync-collection"):
+        token_text = (root.findtext(_t(DAV, "sync-token")) or "").strip()
+        await _assign_missing_uids(db, cu.id)
+        version = await _current_version(db, cu.id)
+        since = calendar_sync.parse_sync_token(token_text) if token_text else 0
+        if since is None or since > version:
+            error = ET.Element(_t(DAV, "error"))
+            ET.SubElement(error, _t(DAV, "valid-sync-token"))
+            return _xml_response(error, status_code=403)
+
+        query = select(*_event_columns(with_data)).where(E.user_id == cu.id)
+        if token_text:
+            query = query.where(E.sync_revision > since)
+        changed = (await db.execute(query.order_by(E.id))).all()
+        for event in changed:
+            _add_response(multistatus, _event_href(event.caldav_uid), _event_props(event, with_data), requested)
+        if token_text:
+            T = models.CalendarTombstone
+            gone = set(await db.scalars(select(T.caldav_uid).where(T.user_id == cu.id, T.revision > since)))
+            if gone:
+                # A UID can be deleted and then re-created; those are reported as changed, not gone
+                gone -= set(await db.scalars(select(E.caldav_uid).where(E.user_id == cu.id, E.caldav_uid.in_(gone))))
+            for uid in sorted(gone):
+                _add_response(multistatus, _event_href(uid), {}, None, status="HTTP/1.1 404 Not Found")
+        ET.SubElement(multistatus, _t(DAV, "sync-token")).text = calendar_sync.sync_token(version)
+        return _xml_response(multistatus)
+
+    if root.tag == _t(CALDAV, "calendar-multiget"):
+        hrefs = [h.text.strip() for h in root.findall(_t(DAV, "href")) if h.text]
+        uids = [uid for uid in map(_uid_from_href, hrefs) if uid]
+        rows = (await db.execute(select(*_event_columns(with_data)).where(E.user_id == cu.id, E.caldav_uid.in_(uids)))).all() if uids else []
+        found = {event.caldav_uid: event for event in rows}
+        for href in hrefs:
+            uid = _uid_from_href(href)
+            if uid in found:
+                _add_response(multistatus, href, _event_props(found[uid], with_data), requested)
+            else:
+                _add_response(multistatus, href, {}, None, status="HTTP/1.1 404 Not Found")
+        return _xml_response(multistatus)
+
+    if root.tag == _t(CALDAV, "calendar-query"):
+        component = root.find(f"{_t(CALDAV, 'filter')}/{_t(CALDAV, 'comp-filter')}/{_t(CALDAV, 'comp-filter')}")
+        if component is not None and component.get("name", "").upper() != "VEVENT":
+            return _xml_response(multistatus)   # only VEVENTs live here
+        first, last = _date_bounds(root.find(f".//{_t(CALDAV, 'time-range')}"))
+        await _assign_missing_uids(db, cu.id)
+        query = select(*_event_columns(with_data)).where(E.user_id == cu.id)
+        if first:
+            query = query.where(E.date >= first)
+        if last:
+            query = query.where(E.date <= last)
+        for event in await db.execute(query.order_by(E.date, E.id)):
+            _add_response(multistatus, _event_href(event.caldav_uid), _event_props(event, with_data), requested)
+        return _xml_response(multistatus)
+
+    return Response(status_code=400)
 
 @router.get("/calendar/{uid}.ics")
-async def get_event(uid: str, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
-    event = db.query(models.CalendarEvent).filter(models.CalendarEvent.caldav_uid == uid, models.CalendarEvent.user_id == cu.id).first()
+async def get_event(uid: str, request: Request, db: AsyncSession = Depends(get_async_db), cu: models.User = Depends(get_current_user)):
+    event = await db.scalar(select(models.CalendarEvent).where(models.CalendarEvent.caldav_uid == uid, models.CalendarEvent.user_id == cu.id))
     if not event:
         return Response(status_code=404)
-    ics = f"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nBEGIN:VEVENT\r\nUID:{uid}\r\nDTSTART;VALUE=DATE:{event.date.strftime('%Y%m%d')}\r\nSUMMARY:{event.title}\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n"
-    return Response(content=ics, media_type="text/calendar")
+    etag = calendar_sync.event_etag(event.id, event.sync_revision)
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=ics.calendar_object(uid, event.date, event.title, event.description), media_type="text/calendar", headers={"ETag": etag})
 
 @router.put("/calendar/{uid}.ics")
-async def create_event(uid: str, request: Request, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
-    body = await request.body()
-    event = models.CalendarEvent(user_id=cu.id, caldav_uid=uid, title="Imported Event", date=models.date.today(), priority="medium")
-    db.add(event)
-    db.commit()
-    return Response(status_code=201)
+async def put_event(uid: str, request: Request, db: AsyncSession = Depends(get_async_db), cu: models.User = Depends(get_current_user)):
+    parser = ics.VEventParser()
+    parsed = None
+    async for chunk in request.stream():
+        events = parser.feed(chunk)
+        parsed = parsed or (events[0] if events else None)
+    events = parser.close()
+    parsed = parsed or (events[0] if events else None)
+    if parsed is None or parsed.date is None:
+        return Response(status_code=400, content="Expected a VEVENT with a DTSTART")
+
+    event = await db.scalar(select(models.CalendarEvent).where(models.CalendarEvent.caldav_uid == uid))
+    if event is not None and event.user_id != cu.id:
+        return Response(status_code=409)
+    if_match = request.headers.get("if-match")
+    if_none_match = request.headers.get("if-none-match")
+    if event is None and if_match:
+        return Response(status_code=412)
+    if event is not None and (if_none_match == "*" or (if_match and if_match != "*" and calendar_sync.event_etag(event.id, event.sync_revision) not in if_match)):
+        return Response(status_code=412)
+
+    created = event is None
+    if created:
+        event = models.CalendarEvent(user_id=cu.id, caldav_uid=uid)
+        db.add(event)
+    event.title = parsed.title
+    event.description = parsed.description
+    event.date = parsed.date
+    event.priority = parsed.priority
+    content = ics.calendar_object(uid, parsed.date, parsed.title, parsed.description)
+    await db.run_sync(lambda session: radicale.enqueue_put(session, cu.username, uid, content))
+    await db.commit()
+    radicale.wake()
+    return Response(status_code=201 if created else 204, headers={"ETag": calendar_sync.event_etag(event.id, event.sync_revision)})
 
 @router.delete("/calendar/{uid}.ics")
-async def delete_event(uid: str, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
-    event = db.query(models.CalendarEvent).filter(models.CalendarEvent.caldav_uid == uid, models.CalendarEvent.user_id == cu.id).first()
+async def delete_event(uid: str, db: AsyncSession = Depends(get_async_db), cu: models.User = Depends(get_current_user)):
+    event = await db.scalar(select(models.CalendarEvent).where(models.CalendarEvent.caldav_uid == uid, models.CalendarEvent.user_id == cu.id))
     if event:
-        db.delete(event)
-        db.commit()
+        await db.delete(event)
+        await db.run_sync(lambda session: radicale.enqueue_delete(session, cu.username, uid))
+        await db.commit()
+        radicale.wake()
     return Response(status_code=204)
@@ -8,11 +8,47 @@ from typing import Optional
 class Settings(BaseSettings):
     # Database
     DATABASE_URL: str
+    ASYNC_DATABASE_URL: Optional[str] = None   # default: DATABASE_URL with asyncpg/aiosqlite
+    THREADPOOL_SIZE: int = 30                  # threads for sync routes; matches the sync DB pool
     
     # JWT Settings
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 10080  # 7 days
+
+    # Authenticated user cache (see user_cache.py)
+    USER_CACHE_TTL_SECONDS: int = 60
+    USER_CACHE_MAX_SIZE: int = 4096
+
+    # Password hashing processes (see password_pool.py)
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 32       # queued + running hashes per API process before 503
+
+    # Background mail polling (see mail_poller.py)
+    MAIL_POLLER_ENABLED: bool = True
+    MAIL_POLLER_LOCK_FILE: str = "/tmp/prohub-mail-poller.lock"
+    MAIL_POLL_INTERVAL_SECONDS: int = 120
+    MAIL_SYNC_CONCURRENCY: int = 8
+    MAIL_IDLE_ACCOUNTS: int = 50
+    MAIL_IMAP_IDLE_CONNECTION_SECONDS: int = 600
+    MAIL_IMAP_MAX_IDLE_CONNECTIONS: int = 100   # open but unused IMAP connections per process, IDLE watchers included
+    SMTP_IDLE_SECONDS: int = 120
+
+    # Lazily fetched email bodies (see mail_bodies.py)
+    MAIL_BODY_CACHE_DIR: str = "/tmp/prohub-mail-bodies"
+    MAIL_BODY_CACHE_MAX_MB: int = 512
+
+    # Content-addressed attachment blobs (see attachment_store.py)
+    MAIL_ATTACHMENT_DIR: str = "data/attachments"
+    MAIL_ATTACHMENT_MAX_MESSAGE_MB: int = 50
+    
+    # Slow-query log and repeated-statement detector (see query_audit.py)
+    SLOW_QUERY_MS: int = 500
+    REPEATED_QUERY_LIMIT: int = 25      # runs of one statement shape per request before it is flagged
+    QUERY_AUDIT_STRICT: bool = False    # raise instead of logging; implied by DEBUG, set it in tests
+
+    # Prometheus metrics shared by all uvicorn workers (see metrics.py)
+    METRICS_DIR: str = "/tmp/prohub-metrics"
     
     # App Settings
     APP_NAME: str = "ProHub"
@@ -1,22 +1,52 @@
 """
 Database configuration and session management
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import settings
+import metrics
+import query_audit
 
 # Create SQLAlchemy engine
 engine = create_engine(
     settings.DATABASE_URL,
+    poolclass=metrics.TimedQueuePool,
     pool_pre_ping=True,
     pool_size=10,
     max_overflow=20
 )
+metrics.instrument_engine(engine, "sync")
+query_audit.instrument_engine(engine)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async drivers for the same database, used by the async def routes
+_ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_database_url(url: str) -> str:
+    """DATABASE_URL with its driver swapped for the matching async one (asyncpg / aiosqlite)"""
+    parsed = make_url(url)
+    return parsed.set(drivername=_ASYNC_DRIVERS.get(parsed.get_backend_name(), parsed.drivername)).render_as_string(hide_password=False)
+
+
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL or async_database_url(settings.DATABASE_URL),
+    poolclass=metrics.TimedAsyncQueuePool,
+    pool_pre_ping=True,
+    pool_size=10,
+    max_overflow=20
+)
+metrics.instrument_engine(async_engine.sync_engine, "async")
+query_audit.instrument_engine(async_engine.sync_engine)
+
+# Async sessions don't expire on commit: attribute access after commit can't lazy-load
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 # Create Base class for models
 Base = declarative_base()
 
@@ -28,3 +58,49 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Dependency to get an async DB session (for async def routes)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Index names per table straight from the catalog: the inspector leaves out
+# expression indexes on SQLite, so checkfirst would try to create them again
+_INDEX_NAMES = {
+    "sqlite": "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table",
+    "postgresql": "SELECT indexname FROM pg_indexes WHERE tablename = :table",
+}
+
+
+def _index_names(conn, table_name: str) -> set:
+    query = _INDEX_NAMES.get(conn.dialect.name)
+    if query is None:
+        return {index["name"] for index in inspect(conn).get_indexes(table_name)}
+    return set(conn.execute(text(query), {"table": table_name}).scalars())
+
+
+def ensure_schema():
+    """Create tables, then add columns and indexes that create_all skips on existing tables.
+
+    Only nullable columns are added, so existing rows stay valid without a backfill.
+    """
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+        # Rollups written before their unique key existed may repeat a key. They
+        # are derived data: clear them and backfill_rollups() rebuilds them at startup.
+        if "uq_transaction_rollups_key" not in _index_names(conn, "transaction_rollups"):
+            conn.execute(text("DELETE FROM transaction_rollups"))
+        for table in Base.metadata.sorted_tables:
+            names = _index_names(conn, table.name)
+            for index in table.indexes:
+                if index.name not in names:
+                    index.create(bind=conn)
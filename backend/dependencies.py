@@ -7,6 +7,7 @@ from sqlalchemy.orm import Session
 
 from database import get_db
 from auth import decode_access_token
+from user_cache import user_cache
 import models
 
 security = HTTPBearer()
@@ -19,6 +20,10 @@ def get_current_user(
 
     token = credentials.credentials
 
+    user = user_cache.get(token)
+    if user is not None:
+        return user
+
     payload = decode_access_token(token)
 
     if payload is None:
@@ -55,4 +60,5 @@ def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    user_cache.put(token, user, payload.get("exp"))
     return user
@@ -0,0 +1,48 @@
+"""
+Fast path for large list responses
+
+Returning ORM objects from a route makes FastAPI validate every row through
+the ``response_model`` schema (``from_attributes``) and then serialize the
+validated models, although the values come straight from our own tables.
+The hot list endpoints instead select plain column tuples in the schema's
+field order, turn them into dicts and encode them with orjson. The route
+keeps its ``response_model`` for the OpenAPI docs; FastAPI skips it for a
+returned Response.
+
+The output matches what the schemas produce: Decimal as a string, dates and
+datetimes in ISO 8601 with a "Z" suffix for UTC.
+"""
+from decimal import Decimal
+from typing import Iterable, List
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z)
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def columns(model, schema: type[BaseModel], exclude: Iterable[str] = ()) -> list:
+    """The ``model`` columns behind ``schema``'s fields, in the schema's field order"""
+    return [getattr(model, name) for name in schema.model_fields if name not in exclude]
+
+
+def list_response(items: List[dict], response: Response) -> FastJSONResponse:
+    """``items`` as JSON, carrying the headers (ETag, cursor) already set on the injected ``response``"""
+    headers = {k: v for k, v in response.headers.items() if k not in ("content-length", "content-type")}
+    return FastJSONResponse(items, headers=headers)
@@ -0,0 +1,44 @@
+"""
+Date arithmetic and SQL helpers shared by the finance modules
+
+Month arithmetic for rollups (routers/finance.py), budget windows
+(budgets.py) and forecast horizons (forecast.py), and a builder for small
+derived tables of literal rows that a query can join against.
+"""
+from datetime import date, timedelta
+from typing import Iterable, List, Sequence, Tuple
+
+from sqlalchemy import cast, literal, select, union_all
+
+
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def is_month_end(d: date) -> bool:
+    return (d + timedelta(days=1)).day == 1
+
+
+def add_months(d: date, months: int) -> date:
+    """``d`` moved by ``months``, clamped to the last day of the target month"""
+    month_index = d.year * 12 + d.month - 1 + months
+    year, month = divmod(month_index, 12)
+    last_day = (date(year + (month + 1) // 12, (month + 1) % 12 + 1, 1) - timedelta(days=1)).day
+    return date(year, month + 1, min(d.day, last_day))
+
+
+def literal_table(name: str, columns: Sequence[Tuple[str, object]], rows: Iterable[tuple]):
+    """Derived table ``name`` of literal ``rows``, as a UNION ALL of one-row SELECTs.
+
+    ``columns`` is a list of (name, SQL type). NULLs are cast to their column
+    type so every SELECT of the union has the same column types. Keep it to a
+    few hundred rows: SQLite allows at most 500 SELECTs in one compound.
+    """
+    selects: List = [
+        select(*(
+            (cast(literal(None), sql_type) if value is None else literal(value, sql_type)).label(column)
+            for (column, sql_type), value in zip(columns, row)
+        ))
+        for row in rows
+    ]
+    return (union_all(*selects) if len(selects) > 1 else selects[0]).subquery(name)
@@ -0,0 +1,183 @@
+"""
+Cash-flow forecast from recurring transactions
+
+Every recurring transaction is expanded over the horizon in one shot with
+NumPy: the occurrences of all series with the same kind of interval form an
+(items x periods) datetime64 matrix, and the daily net flow is a single
+weighted bincount over the occurrence day offsets. Balances are the running
+sum of that flow on top of today's balance.
+
+Results are memoized per user and keyed by the user's "transactions"
+version (versions.py), which every transaction write bumps, so a cached
+forecast is reused until something changes, in any worker process.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import List, Tuple
+
+import numpy as np
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+import models
+import versions
+from finance_util import add_months
+
+RESOURCE = "transactions"
+CACHE_SIZE = 256
+
+# interval -> (unit, step); unknown intervals are treated as monthly
+INTERVALS = {
+    "daily": ("D", 1),
+    "weekly": ("D", 7),
+    "biweekly": ("D", 14),
+    "monthly": ("M", 1),
+    "quarterly": ("M", 3),
+    "yearly": ("M", 12),
+}
+
+
+def _signed(amount, kind: str) -> float:
+    return float(amount) if kind == "income" else -float(amount)
+
+
+def _day_occurrences(anchors: np.ndarray, steps: np.ndarray, start: np.datetime64, end: np.datetime64) -> np.ndarray:
+    """(items x periods) dates for day-based series; out-of-range cells are NaT"""
+    first_k = np.maximum(np.ceil((start - anchors).astype(np.int64) / steps), 0).astype(np.int64)
+    periods = int(((end - start).astype(np.int64) // steps.min()) + 2)
+    k = first_k[:, None] + np.arange(periods)[None, :]
+    dates = anchors[:, None] + (k * steps[:, None]).astype("timedelta64[D]")
+    return np.where((dates >= start) & (dates <= end), dates, np.datetime64("NaT"))
+
+
+def _month_occurrences(anchors: np.ndarray, steps: np.ndarray, start: np.datetime64, end: np.datetime64) -> np.ndarray:
+    """(items x periods) dates for month-based series, clamping day 29-31 to the month's last day"""
+    anchor_months = anchors.astype("datetime64[M]")
+    anchor_day = (anchors - anchor_months.astype("datetime64[D]")).astype(np.int64)
+    start_month = start.astype("datetime64[M]")
+    months_to_start = (start_month - anchor_months).astype(np.int64)
+    first_k = np.maximum(np.floor(months_to_start / steps), 0).astype(np.int64)
+    periods = int(((end.astype("datetime64[M]") - start_month).astype(np.int64) // steps.min()) + 2)
+    k = first_k[:, None] + np.arange(periods)[None, :]
+    months = anchor_months[:, None] + (k * steps[:, None]).astype("timedelta64[M]")
+    month_days = ((months + 1).astype("datetime64[D]") - months.astype("datetime64[D]")).astype(np.int64)
+    dates = months.astype("datetime64[D]") + np.minimum(anchor_day[:, None], month_days - 1).astype("timedelta64[D]")
+    return np.where((dates >= start) & (dates <= end), dates, np.datetime64("NaT"))
+
+
+def project(series: List[Tuple[date, float, str]], one_offs: List[Tuple[date, float]], start_balance: float, start: date, end: date) -> dict:
+    """Daily and monthly balances over [start, end].
+
+    ``series`` are (anchor date, signed amount, interval) recurring items;
+    ``one_offs`` are (date, signed amount) scheduled single transactions.
+    """
+    start64, end64 = np.datetime64(start, "D"), np.datetime64(end, "D")
+    days = int((end64 - start64).astype(np.int64)) + 1
+    flow = np.zeros(days)
+    income = np.zeros(days)
+
+    if one_offs:
+        offsets = (np.array([d for d, _ in one_offs], dtype="datetime64[D]") - start64).astype(np.int64)
+        amounts = np.array([a for _, a in one_offs])
+        inside = (offsets >= 0) & (offsets < days)
+        flow += np.bincount(offsets[inside], weights=amounts[inside], minlength=days)
+        income += np.bincount(offsets[inside], weights=np.clip(amounts[inside], 0, None), minlength=days)
+
+    for unit, expand in (("D", _day_occurrences), ("M", _month_occurrences)):
+        picked = [(anchor, amount, INTERVALS.get(interval, INTERVALS["monthly"])[1])
+                  for anchor, amount, interval in series
+                  if INTERVALS.get(interval, INTERVALS["monthly"])[0] == unit]
+        if not picked:
+            continue
+        anchors = np.array([p[0] for p in picked], dtype="datetime64[D]")
+        amounts = np.array([p[1] for p in picked])
+        steps = np.array([p[2] for p in picked], dtype=np.int64)
+        dates = expand(anchors, steps, start64, end64)
+        valid = ~np.isnat(dates)
+        offsets = (dates[valid] - start64).astype(np.int64)
+        weights = np.broadcast_to(amounts[:, None], dates.shape)[valid]
+        flow += np.bincount(offsets, weights=weights, minlength=days)
+        income += np.bincount(offsets, weights=np.clip(weights, 0, None), minlength=days)
+
+    balance = start_balance + np.cumsum(flow)
+    day_dates = start64 + np.arange(days).astype("timedelta64[D]")
+    month_of_day = day_dates.astype("datetime64[M]")
+    month_keys, month_index = np.unique(month_of_day, return_inverse=True)
+    month_flow = np.bincount(month_index, weights=flow)
+    month_income = np.bincount(month_index, weights=income)
+    last_day = np.r_[np.flatnonzero(np.diff(month_index)), days - 1]
+
+    return {
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "start_balance": round(start_balance, 2),
+        "end_balance": round(float(balance[-1]), 2) if days else round(start_balance, 2),
+        "monthly": [
+            {
+                "month": str(month),
+                "income": round(float(inc), 2),
+                "expense": round(float(inc - net), 2),
+                "net": round(float(net), 2),
+                "balance": round(float(balance[last]), 2),
+            }
+            for month, inc, net, last in zip(month_keys, month_income, month_flow, last_day)
+        ],
+        "daily": [{"date": str(d), "balance": round(float(b), 2)} for d, b in zip(day_dates, balance)],
+    }
+
+
+class ForecastCache:
+    """Small LRU of (user, version, horizon, day) -> forecast"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: tuple, value: dict) -> None:
+        with self._lock:
+            # Older versions for this user can never be hit again
+            for stale in [k for k in self._entries if k[0] == key[0] and k[1] != key[1]]:
+                del self._entries[stale]
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+forecast_cache = ForecastCache(CACHE_SIZE)
+
+
+def forecast(db: Session, user_id: int, months: int, today: date = None) -> dict:
+    """Projected balances for the next ``months`` months, from tomorrow on"""
+    today = today or date.today()
+    key = (user_id, versions.current(db, user_id, RESOURCE), months, today)
+    cached = forecast_cache.get(key)
+    if cached is not None:
+        return cached
+
+    T = models.Transaction
+    signed = case((T.type == "income", T.amount), else_=-T.amount)
+    start_balance = db.query(func.coalesce(func.sum(signed), 0)).filter(T.user_id == user_id, T.date <= today).scalar()
+    series = [
+        (anchor, _signed(amount, kind), interval or "monthly")
+        for anchor, amount, kind, interval in db.query(T.date, T.amount, T.type, T.recurring_interval)
+        .filter(T.user_id == user_id, T.is_recurring.is_(True))
+    ]
+    one_offs = [
+        (day, _signed(amount, kind))
+        for day, amount, kind in db.query(T.date, T.amount, T.type)
+        .filter(T.user_id == user_id, T.date > today, T.is_recurring.isnot(True))
+    ]
+    result = project(series, one_offs, float(start_balance or Decimal(0)), today + timedelta(days=1), add_months(today, months))
+    result["recurring_count"] = len(series)
+    forecast_cache.put(key, result)
+    return result
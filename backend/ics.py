@@ -0,0 +1,204 @@
+"""
+iCalendar (RFC 5545) helpers shared by the calendar export, Radicale push and CalDAV server
+
+Writing: ``vevent``/``calendar_object`` build all-day events.
+
+Reading: ``VEventParser`` is fed raw bytes in arbitrary chunks and returns
+each VEVENT as soon as its END line arrives. It keeps only the current
+(unfolded) line and the current event in memory, so multi-megabyte
+calendars are parsed in constant memory.
+"""
+from dataclasses import dataclass
+from datetime import date as date_type, datetime
+from typing import Dict, List, Optional, Tuple
+
+PRODID = "-//PolyHub//Calendar//EN"
+
+CALENDAR_HEADER = (
+    "BEGIN:VCALENDAR\r\n"
+    "VERSION:2.0\r\n"
+    f"PRODID:{PRODID}\r\n"
+    "CALSCALE:GREGORIAN\r\n"
+)
+CALENDAR_FOOTER = "END:VCALENDAR\r\n"
+
+
+def escape_text(value: str) -> str:
+    """Escape a TEXT property value (backslash, semicolon, comma, newline)"""
+    return (
+        value.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def vevent(uid: str, day: date_type, title: str, description: Optional[str] = None) -> str:
+    """One all-day VEVENT component"""
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}",
+        f"DTSTART;VALUE=DATE:{day.strftime('%Y%m%d')}",
+        f"SUMMARY:{escape_text(title)}",
+    ]
+    if description:
+        lines.append(f"DESCRIPTION:{escape_text(description)}")
+    lines.append("END:VEVENT")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def calendar_object(uid: str, day: date_type, title: str, description: Optional[str] = None) -> str:
+    """A complete VCALENDAR holding a single event, as stored per CalDAV resource"""
+    return CALENDAR_HEADER + vevent(uid, day, title, description) + CALENDAR_FOOTER
+
+
+# ─── Parsing ─────────────────────────────────────────────────────────────────
+
+@dataclass
+class ParsedEvent:
+    uid: Optional[str]
+    date: Optional[date_type]
+    title: str
+    description: Optional[str]
+    priority: str
+
+
+def unescape_text(value: str) -> str:
+    out, i = [], 0
+    while i < len(value):
+        ch = value[i]
+        if ch == "\\" and i + 1 < len(value):
+            nxt = value[i + 1]
+            out.append("\n" if nxt in "nN" else nxt)
+            i += 2
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out)
+
+
+def parse_property(line: str) -> Tuple[str, Dict[str, str], str]:
+    """Split a content line into (NAME, {PARAM: value}, value); quoted params may contain : and ;"""
+    in_quotes, split_at = False, None
+    for i, ch in enumerate(line):
+        if ch == '"':
+            in_quotes = not in_quotes
+        elif ch == ":" and not in_quotes:
+            split_at = i
+            break
+    if split_at is None:
+        return line.upper(), {}, ""
+    head, value = line[:split_at], line[split_at + 1:]
+    parts, current, in_quotes = [], [], False
+    for ch in head:
+        if ch == '"':
+            in_quotes = not in_quotes
+        if ch == ";" and not in_quotes:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+    parts.append("".join(current))
+    params = {}
+    for part in parts[1:]:
+        key, _, val = part.partition("=")
+        params[key.upper()] = val.strip('"')
+    return parts[0].upper(), params, value
+
+
+def parse_date(value: str) -> Optional[date_type]:
+    """Calendar date of a DATE or DATE-TIME value (floating/TZID times keep their local date)"""
+    value = value.strip()
+    try:
+        if "T" in value:
+            return datetime.strptime(value[:15], "%Y%m%dT%H%M%S").date()
+        return datetime.strptime(value[:8], "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def _priority(value: str) -> str:
+    # RFC 5545: 1-4 high, 5 medium, 6-9 low, 0 undefined
+    try:
+        level = int(value)
+    except ValueError:
+        return "medium"
+    if 1 <= level <= 4:
+        return "high"
+    if level >= 6:
+        return "low"
+    return "medium"
+
+
+class VEventParser:
+    """Incremental VEVENT reader: ``feed`` bytes, collect the events each call completes"""
+
+    MAX_LINE_BYTES = 1 << 20   # longer logical lines are truncated, keeping memory bounded
+
+    def __init__(self, encoding: str = "utf-8"):
+        self.encoding = encoding
+        self._partial = b""          # bytes after the last newline
+        self._line: Optional[bytes] = None   # current logical line, still open to continuations
+        self._depth = 0              # nesting below VEVENT (VALARM etc.)
+        self._event: Optional[dict] = None
+
+    def feed(self, data: bytes) -> List[ParsedEvent]:
+        events: List[ParsedEvent] = []
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()[:self.MAX_LINE_BYTES]
+        for raw in lines:
+            self._physical_line(raw.rstrip(b"\r"), events)
+        return events
+
+    def close(self) -> List[ParsedEvent]:
+        events: List[ParsedEvent] = []
+        if self._partial:
+            self._physical_line(self._partial.rstrip(b"\r"), events)
+            self._partial = b""
+        if self._line is not None:
+            self._logical_line(self._line, events)
+            self._line = None
+        return events
+
+    def _physical_line(self, raw: bytes, events: List[ParsedEvent]) -> None:
+        # Unfold (RFC 5545 3.1) before decoding: folds may split a multi-byte character
+        if raw[:1] in (b" ", b"\t") and self._line is not None:
+            if len(self._line) < self.MAX_LINE_BYTES:
+                self._line += raw[1:]
+            return
+        if self._line is not None:
+            self._logical_line(self._line, events)
+        self._line = raw if raw else None
+
+    def _logical_line(self, line: bytes, events: List[ParsedEvent]) -> None:
+        name, _, value = parse_property(line.decode(self.encoding, errors="replace"))
+        if name == "BEGIN":
+            if self._event is not None:
+                self._depth += 1
+            elif value.strip().upper() == "VEVENT":
+                self._event = {}
+            return
+        if name == "END":
+            if self._event is None:
+                return
+            if self._depth:
+                self._depth -= 1
+                return
+            events.append(self._finish(self._event))
+            self._event = None
+            return
+        if self._event is None or self._depth:
+            return
+        if name in ("UID", "SUMMARY", "DESCRIPTION", "DTSTART", "PRIORITY") and name not in self._event:
+            self._event[name] = value
+
+    @staticmethod
+    def _finish(props: dict) -> ParsedEvent:
+        return ParsedEvent(
+            uid=props.get("UID", "").strip() or None,
+            date=parse_date(props["DTSTART"]) if "DTSTART" in props else None,
+            title=(unescape_text(props.get("SUMMARY", "")).strip() or "Untitled")[:255],
+            description=unescape_text(props["DESCRIPTION"]) if props.get("DESCRIPTION") else None,
+            priority=_priority(props.get("PRIORITY", "0")),
+        )
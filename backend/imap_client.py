@@ -0,0 +1,56 @@
+"""
+IMAP connections and command helpers shared by mail sync, the poller and
+the lazy body loader
+
+open_imap() returns a logged-in connection whose commands are all timed in
+metrics (imaplib sends every command through _simple_command). check()
+turns a non-OK response into MailSyncError, and quote() makes a mailbox
+name or search key safe to send as an IMAP quoted string.
+"""
+import imaplib
+
+import metrics
+import models
+
+
+class MailSyncError(Exception):
+    """Raised when the IMAP server rejects a command"""
+
+
+class _TimedCommands:
+    """Records every IMAP command in metrics; imaplib sends them all through _simple_command"""
+
+    def _simple_command(self, name, *args):
+        operation = f"{name} {args[0]}" if name == "UID" and args else name
+        with metrics.external_call("imap", operation.lower()) as call:
+            typ, data = super()._simple_command(name, *args)
+            call.ok = typ == "OK"
+        return typ, data
+
+
+class _IMAP4(_TimedCommands, imaplib.IMAP4):
+    pass
+
+
+class _IMAP4_SSL(_TimedCommands, imaplib.IMAP4_SSL):
+    pass
+
+
+def open_imap(acc: models.MailAccount) -> imaplib.IMAP4:
+    """Connect and log in to the account's IMAP server"""
+    with metrics.external_call("imap", "connect"):
+        conn = _IMAP4_SSL(acc.imap_server, acc.imap_port) if acc.imap_use_ssl else _IMAP4(acc.imap_server, acc.imap_port)
+    conn.login(acc.email_address, acc.password)
+    return conn
+
+
+def quote(value: str) -> str:
+    """``value`` as an IMAP quoted string (mailbox names, search keys)"""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def check(typ: str, data, command: str):
+    """``data`` of an OK response; MailSyncError for anything else"""
+    if typ != "OK":
+        raise MailSyncError(f"IMAP {command} failed: {data!r}")
+    return data
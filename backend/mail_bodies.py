@@ -0,0 +1,208 @@
+"""
+Lazily loaded email bodies with a compressed on-disk cache
+
+Sync only imports headers, so the emails table holds list metadata. The
+first time a message is opened its body is fetched with
+``UID FETCH <uid> BODY.PEEK[]`` (PEEK leaves the \\Seen flag alone), split
+into text/plain and text/html parts and written zlib-compressed to
+MAIL_BODY_CACHE_DIR, keyed by a hash of the Message-ID. Later opens are
+served from disk. When the cache grows past MAIL_BODY_CACHE_MAX_MB the least
+recently opened bodies are evicted; they are simply fetched again if needed.
+
+Rows imported before lazy loading still carry body_text/body_html; those are
+moved into the cache on first open and cleared from the row.
+"""
+import hashlib
+import imaplib
+import json
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from email import policy
+from email.parser import BytesParser
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from config import settings
+from imap_client import check, quote
+import models
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_LEVEL = 6
+EVICT_TO_RATIO = 0.9     # evict down to 90% of the limit so every put doesn't rescan
+
+_message_parser = BytesParser(policy=policy.default)
+
+
+class BodyCache:
+    """Size-bounded directory of zlib-compressed JSON body blobs, evicted least recently used first"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None   # estimate for this process; resynced from disk on eviction
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + ".z")
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+            os.utime(path)   # mtime doubles as last-access time for eviction
+            return json.loads(zlib.decompress(blob))
+        except FileNotFoundError:
+            return None
+        except (OSError, zlib.error, ValueError) as e:
+            logger.warning(f"Dropping unreadable mail body cache entry {path}: {e}")
+            self._remove(path)
+            return None
+
+    def put(self, key: str, body: dict) -> None:
+        path = self._path(key)
+        blob = zlib.compress(json.dumps(body).encode("utf-8"), COMPRESSION_LEVEL)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, path)
+        except OSError:
+            self._remove(tmp)
+            raise
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(blob)
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _entries(self):
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".z"):
+                        yield entry
+
+    def _scan_size(self) -> int:
+        try:
+            return sum(entry.stat().st_size for entry in self._entries())
+        except FileNotFoundError:
+            return 0
+
+    def evict(self) -> int:
+        """Remove least recently opened entries until the cache is under its target size"""
+        with self._lock:
+            entries = []
+            try:
+                for entry in self._entries():
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+            except FileNotFoundError:
+                pass
+            entries.sort()
+            size = sum(s for _, s, _ in entries)
+            target = int(self.max_bytes * EVICT_TO_RATIO)
+            removed = 0
+            for _, entry_size, path in entries:
+                if size <= target:
+                    break
+                if self._remove(path):
+                    size -= entry_size
+                    removed += 1
+            self._size = size
+            return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            return {"bytes": self._size, "max_bytes": self.max_bytes}
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+body_cache = BodyCache(settings.MAIL_BODY_CACHE_DIR, settings.MAIL_BODY_CACHE_MAX_MB * 1024 * 1024)
+
+
+def _part_content(part) -> Optional[str]:
+    if part is None:
+        return None
+    try:
+        return part.get_content()
+    except (LookupError, ValueError):
+        payload = part.get_payload(decode=True) or b""
+        return payload.decode("utf-8", errors="replace")
+
+
+def parse_body(raw: bytes) -> dict:
+    """The text/plain and text/html bodies of an RFC 822 message"""
+    message = _message_parser.parsebytes(raw)
+    return {
+        "text": _part_content(message.get_body(preferencelist=("plain",))),
+        "html": _part_content(message.get_body(preferencelist=("html",))),
+    }
+
+
+def _find_uid(conn: imaplib.IMAP4, message_id: str) -> Optional[int]:
+    data = check(*conn.uid("SEARCH", "HEADER", "Message-ID", quote(message_id)), "SEARCH")
+    uids = b" ".join(d for d in data if d).split()
+    return int(uids[-1]) if uids else None
+
+
+def fetch_raw(conn: imaplib.IMAP4, email: models.Email) -> Optional[bytes]:
+    """Download the full message for ``email`` without marking it \\Seen"""
+    check(*conn.select(quote(email.folder or "INBOX"), readonly=True), "SELECT")
+    uid = email.imap_uid or _find_uid(conn, email.message_id)
+    if uid is None:
+        return None
+    data = check(*conn.uid("FETCH", str(uid), "(BODY.PEEK[])"), "FETCH")
+    for part in data:
+        if isinstance(part, tuple):
+            return part[1]
+    return None
+
+
+def load_body(db: Session, email: models.Email, pool) -> Optional[dict]:
+    """Body of ``email`` from the cache, a legacy row, or IMAP (in that order); None if unavailable"""
+    body = body_cache.get(email.message_id)
+    if body is not None:
+        return body
+
+    # Legacy bodies are read and cleared with their own statements, so the
+    # deferred body columns are never loaded onto ``email``
+    E = models.Email
+    legacy_text, legacy_html = db.query(E.body_text, E.body_html).filter(E.id == email.id).one()
+    if legacy_text is not None or legacy_html is not None:
+        body = {"text": legacy_text, "html": legacy_html}
+        body_cache.put(email.message_id, body)
+        db.query(E).filter(E.id == email.id).update({E.body_text: None, E.body_html: None}, synchronize_session=False)
+        db.commit()
+        return body
+
+    acc = email.account
+    if acc is None or not acc.is_active:
+        return None
+    with pool.connection(acc) as conn:
+        raw = fetch_raw(conn, email)
+    if raw is None:
+        return None
+    body = parse_body(raw)
+    body_cache.put(email.message_id, body)
+    return body
+
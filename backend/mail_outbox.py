@@ -0,0 +1,289 @@
+"""
+Outbound mail queue with pooled SMTP connections
+
+send_email only renders the MIME message and inserts an outgoing_emails row.
+A background worker claims due rows and delivers them over SmtpPool, which
+keeps one authenticated (STARTTLS'd) connection per account open between
+messages and drops it after SMTP_IDLE_SECONDS. Transient failures are retried
+with exponential backoff; permanent ones (5xx, bad credentials) fail at once.
+Clients poll GET /api/mail/outbox/{id} for the delivery status.
+
+Rows are claimed one at a time, each under a fresh claim token and a lease
+long enough for every SMTP step of one delivery to time out. The claim is a
+compare-and-set on the row's status, so two workers (one per uvicorn worker
+process) never claim the same row, and the final sent/retry/failed update
+only applies while the row still carries the worker's token: a row whose
+lease ran out and was requeued by requeue_stale_sending is not overwritten
+by the worker that lost it.
+"""
+import json
+import logging
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+import metrics
+import models
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE    = 20
+POLL_INTERVAL = 2.0
+SMTP_TIMEOUT  = 30
+LEASE         = timedelta(seconds=SMTP_TIMEOUT * 10)   # connect, STARTTLS, login, NOOP and the send may each time out
+BACKOFF_BASE  = 30
+BACKOFF_MAX   = 3600
+MAX_ATTEMPTS  = 6
+
+
+def _fingerprint(acc: models.MailAccount) -> tuple:
+    return (acc.smtp_server, acc.smtp_port, acc.smtp_use_tls, acc.email_address, acc.password)
+
+
+def _safe_quit(conn: smtplib.SMTP) -> None:
+    try:
+        conn.quit()
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class SmtpPool:
+    """One logged-in SMTP connection per account, reused until idle for too long"""
+
+    def __init__(self, max_idle_seconds: int):
+        self.max_idle_seconds = max_idle_seconds
+        self._idle: Dict[int, tuple] = {}   # account_id -> (conn, fingerprint, last_used)
+        self._lock = threading.Lock()
+
+    def _open(self, acc: models.MailAccount) -> smtplib.SMTP:
+        with metrics.external_call("smtp", "connect"):
+            conn = smtplib.SMTP(acc.smtp_server, acc.smtp_port, timeout=SMTP_TIMEOUT)
+            if acc.smtp_use_tls:
+                conn.starttls()
+            conn.login(acc.email_address, acc.password)
+        return conn
+
+    def acquire(self, acc: models.MailAccount) -> smtplib.SMTP:
+        with self._lock:
+            entry = self._idle.pop(acc.id, None)
+        if entry is not None:
+            conn, fingerprint, last_used = entry
+            if fingerprint == _fingerprint(acc) and time.monotonic() - last_used <= self.max_idle_seconds:
+                try:
+                    with metrics.external_call("smtp", "noop") as call:
+                        call.ok = conn.noop()[0] == 250
+                    if call.ok:
+                        return conn
+                except (smtplib.SMTPException, OSError):
+                    pass
+            _safe_quit(conn)
+        return self._open(acc)
+
+    def release(self, acc: models.MailAccount, conn: smtplib.SMTP) -> None:
+        with self._lock:
+            previous = self._idle.pop(acc.id, None)
+            self._idle[acc.id] = (conn, _fingerprint(acc), time.monotonic())
+        if previous is not None and previous[0] is not conn:
+            _safe_quit(previous[0])
+
+    def prune(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            stale = [aid for aid, (_, _, used) in self._idle.items() if now - used > self.max_idle_seconds]
+            conns = [self._idle.pop(aid)[0] for aid in stale]
+        for conn in conns:
+            _safe_quit(conn)
+
+    def close_all(self) -> None:
+        with self._lock:
+            conns = [entry[0] for entry in self._idle.values()]
+            self._idle.clear()
+        for conn in conns:
+            _safe_quit(conn)
+
+
+smtp_pool = SmtpPool(settings.SMTP_IDLE_SECONDS)
+
+
+def enqueue(db: Session, acc: models.MailAccount, recipients: List[str], subject: str, message: str) -> models.OutgoingEmail:
+    """Queue a rendered message; the caller commits, then calls wake()"""
+    row = models.OutgoingEmail(
+        account_id=acc.id,
+        recipients=json.dumps(recipients),
+        subject=subject[:500],
+        message=message,
+        status="queued",
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(row)
+    return row
+
+
+def _is_permanent(error: Exception) -> bool:
+    if isinstance(error, (smtplib.SMTPAuthenticationError, smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_BASE * 2 ** max(attempts - 1, 0), BACKOFF_MAX))
+
+
+def _deliver(acc: models.MailAccount, recipients: List[str], message: str) -> dict:
+    """Send ``message``; returns the recipients the server refused while accepting the rest"""
+    conn = smtp_pool.acquire(acc)
+    try:
+        with metrics.external_call("smtp", "send"):
+            refused = conn.sendmail(acc.email_address, recipients, message)
+    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+        # sendmail has already RSET the session, so it stays usable
+        smtp_pool.release(acc, conn)
+        raise
+    except Exception:
+        _safe_quit(conn)
+        raise
+    smtp_pool.release(acc, conn)
+    return refused
+
+
+def _refused_error(refused: dict) -> Optional[str]:
+    if not refused:
+        return None
+    parts = []
+    for recipient, (code, reply) in refused.items():
+        reply = reply.decode(errors="replace") if isinstance(reply, bytes) else str(reply)
+        parts.append(f"{recipient}: {code} {reply}")
+    return ("Refused recipients: " + "; ".join(parts))[:1000]
+
+
+def _claim_next(db: Session) -> Optional[tuple]:
+    """Claim the oldest due row for this worker: (row id, claim token), or None if nothing is due"""
+    O = models.OutgoingEmail
+    while True:
+        now = datetime.utcnow()
+        due = (O.status.in_(("queued", "retrying")), O.next_attempt_at <= now)
+        row_id = db.query(O.id).filter(*due).order_by(O.id).limit(1).with_for_update(skip_locked=True).scalar()
+        if row_id is None:
+            db.commit()
+            return None
+        token = uuid.uuid4().hex
+        claimed = db.query(O).filter(O.id == row_id, *due).update({
+            O.status: "sending", O.next_attempt_at: now + LEASE, O.claim_token: token, O.attempts: O.attempts + 1,
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return row_id, token
+        # another worker claimed it between the SELECT and the UPDATE; take the next one
+
+
+def _finish(db: Session, row_id: int, token: str, values: dict) -> bool:
+    """Record the outcome of a delivery, unless the row was reclaimed since; returns whether it applied"""
+    O = models.OutgoingEmail
+    updated = db.query(O).filter(O.id == row_id, O.claim_token == token).update(
+        {**values, O.claim_token: None}, synchronize_session=False
+    )
+    db.commit()
+    return bool(updated)
+
+
+def process_due(limit: int = BATCH_SIZE) -> int:
+    """Deliver up to ``limit`` due messages, claiming one at a time. Returns how many were attempted."""
+    O = models.OutgoingEmail
+    db = SessionLocal()
+    try:
+        accounts = {}
+        attempted = 0
+        while attempted < limit:
+            claim = _claim_next(db)
+            if claim is None:
+                break
+            row_id, token = claim
+            attempted += 1
+            row = db.get(O, row_id)
+            acc = accounts.get(row.account_id) or db.get(models.MailAccount, row.account_id)
+            accounts[row.account_id] = acc
+            try:
+                if acc is None:
+                    raise smtplib.SMTPException("Mail account no longer exists")
+                refused = _deliver(acc, json.loads(row.recipients), row.message)
+            except Exception as e:
+                permanent = acc is None or _is_permanent(e) or row.attempts >= MAX_ATTEMPTS
+                outcome = {
+                    O.status: "failed" if permanent else "retrying",
+                    O.next_attempt_at: datetime.utcnow() + _backoff(row.attempts),
+                    O.last_error: str(e)[:1000],
+                }
+                logger.warning(f"SMTP delivery of outgoing mail {row_id} failed ({outcome[O.status]}): {e}")
+            else:
+                outcome = {O.status: "sent", O.sent_at: datetime.now(timezone.utc), O.last_error: _refused_error(refused)}
+            if not _finish(db, row_id, token, outcome):
+                logger.warning(f"Outgoing mail {row_id} was reclaimed after its lease ran out; outcome not recorded")
+        return attempted
+    finally:
+        db.close()
+
+
+def requeue_stale_sending(db: Session) -> int:
+    """Return rows stuck in 'sending' past their lease (e.g. after a crash) to the queue"""
+    O = models.OutgoingEmail
+    count = db.query(O).filter(O.status == "sending", O.next_attempt_at <= datetime.utcnow()).update(
+        {O.status: "retrying", O.claim_token: None}, synchronize_session=False
+    )
+    db.commit()
+    return count
+
+
+# ─── Background worker ──────────────────────────────────────────────────────
+
+_wake = threading.Event()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def wake() -> None:
+    _wake.set()
+
+
+def _run() -> None:
+    while not _stop.is_set():
+        try:
+            db = SessionLocal()
+            try:
+                requeue_stale_sending(db)
+            finally:
+                db.close()
+            attempted = process_due()
+            smtp_pool.prune()
+        except Exception:
+            logger.exception("Outgoing mail worker failed")
+            attempted = 0
+        if attempted < BATCH_SIZE:
+            _wake.wait(POLL_INTERVAL)
+            _wake.clear()
+
+
+def start_worker() -> None:
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="mail-outbox", daemon=True)
+    _thread.start()
+
+
+def stop_worker(timeout: float = 5.0) -> None:
+    _stop.set()
+    _wake.set()
+    if _thread is not None:
+        _thread.join(timeout)
+    smtp_pool.close_all()
@@ -0,0 +1,377 @@
+"""
+Background mail polling with a bounded IMAP connection pool
+
+ImapPool keeps one authenticated connection per account between syncs and
+caps how many connections are in use at once. MailPoller syncs every active
+MailAccount on an interval through that pool. For servers that advertise
+IDLE, it also holds a dedicated IDLE connection (up to MAIL_IDLE_ACCOUNTS),
+so new mail triggers a sync within seconds instead of at the next poll.
+
+Connections that are open but not syncing (cached ones and IDLE watchers)
+share one cap, MAIL_IMAP_MAX_IDLE_CONNECTIONS; caching past it logs out the
+least recently used cached connection, and IDLE watchers only start while
+the cap leaves room. Syncs of one account, by the poller or the manual
+/sync route, are serialized with ImapPool.sync_lock().
+
+The poller also sweeps unreferenced attachment blobs every
+ATTACHMENT_GC_SECONDS (attachment_store.collect_garbage()).
+
+Only one uvicorn worker per host runs the poller; the others skip it
+(see start()).
+"""
+import imaplib
+import logging
+import select
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Optional, Set
+
+from attachment_store import collect_garbage
+from config import settings
+from database import SessionLocal
+from imap_client import MailSyncError, open_imap
+from mail_sync import sync_folder
+import models
+
+logger = logging.getLogger(__name__)
+
+IDLE_RENEW_SECONDS = 25 * 60     # RFC 2177: re-issue IDLE at least every 29 minutes
+IDLE_RETRY_SECONDS = 60
+CHECKOUT_TIMEOUT = 30
+ATTACHMENT_GC_SECONDS = 6 * 3600
+
+
+def _fingerprint(acc: models.MailAccount) -> tuple:
+    return (acc.imap_server, acc.imap_port, acc.imap_use_ssl, acc.email_address, acc.password)
+
+
+def _safe_logout(conn: imaplib.IMAP4) -> None:
+    try:
+        conn.logout()
+    except Exception:
+        pass
+
+
+class ImapPool:
+    """Authenticated IMAP connections reused across syncs, with global in-use and idle caps"""
+
+    def __init__(self, max_in_use: int, max_idle: int, max_idle_seconds: int):
+        self.max_idle = max_idle
+        self.max_idle_seconds = max_idle_seconds
+        self._slots = threading.BoundedSemaphore(max_in_use)
+        self._idle: Dict[int, tuple] = OrderedDict()   # account_id -> (conn, fingerprint, last_used), least recently used first
+        self._watchers = 0   # IDLE connections held by MailPoller, counted against max_idle
+        self._sync_locks: Dict[int, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def sync_lock(self, account_id: int) -> threading.Lock:
+        """The lock every sync of ``account_id`` holds, so two never insert the same messages"""
+        with self._lock:
+            return self._sync_locks.setdefault(account_id, threading.Lock())
+
+    def _evict_locked(self) -> list:
+        """Pop least recently used cached connections until the idle cap holds; caller logs them out"""
+        evicted = []
+        while self._idle and len(self._idle) + self._watchers > self.max_idle:
+            evicted.append(self._idle.popitem(last=False)[1][0])
+        return evicted
+
+    def reserve_watcher(self) -> bool:
+        """Count one IDLE connection against the idle cap; False if the cap is taken by watchers already"""
+        with self._lock:
+            if self._watchers >= self.max_idle:
+                return False
+            self._watchers += 1
+            evicted = self._evict_locked()
+        for conn in evicted:
+            _safe_logout(conn)
+        return True
+
+    def release_watcher(self) -> None:
+        with self._lock:
+            self._watchers -= 1
+
+    def _take(self, acc: models.MailAccount) -> Optional[imaplib.IMAP4]:
+        with self._lock:
+            entry = self._idle.pop(acc.id, None)
+        if entry is None:
+            return None
+        conn, fingerprint, last_used = entry
+        if fingerprint != _fingerprint(acc) or time.monotonic() - last_used > self.max_idle_seconds:
+            _safe_logout(conn)
+            return None
+        try:
+            conn.noop()
+        except Exception:
+            _safe_logout(conn)
+            return None
+        return conn
+
+    def _give(self, acc: models.MailAccount, conn: imaplib.IMAP4) -> None:
+        if conn.state == "SELECTED":
+            conn.close()   # mailboxes are EXAMINEd, so CLOSE never expunges
+        with self._lock:
+            previous = self._idle.pop(acc.id, None)
+            self._idle[acc.id] = (conn, _fingerprint(acc), time.monotonic())
+            evicted = self._evict_locked()
+        if previous is not None:
+            evicted.append(previous[0])
+        for old in evicted:
+            _safe_logout(old)
+
+    @contextmanager
+    def connection(self, acc: models.MailAccount):
+        """Check out a logged-in connection for ``acc``; waits for a free slot"""
+        if not self._slots.acquire(timeout=CHECKOUT_TIMEOUT):
+            raise MailSyncError("IMAP connection pool is saturated")
+        try:
+            conn = self._take(acc) or open_imap(acc)
+            try:
+                yield conn
+            except Exception:
+                _safe_logout(conn)
+                raise
+            try:
+                self._give(acc, conn)
+            except Exception:
+                _safe_logout(conn)
+        finally:
+            self._slots.release()
+
+    def prune(self) -> None:
+        """Log out connections idle for longer than max_idle_seconds"""
+        now = time.monotonic()
+        with self._lock:
+            stale = [aid for aid, (_, _, used) in self._idle.items() if now - used > self.max_idle_seconds]
+            conns = [self._idle.pop(aid)[0] for aid in stale]
+        for conn in conns:
+            _safe_logout(conn)
+
+    def close_all(self) -> None:
+        with self._lock:
+            conns = [entry[0] for entry in self._idle.values()]
+            self._idle.clear()
+        for conn in conns:
+            _safe_logout(conn)
+
+
+def _readable(conn: imaplib.IMAP4) -> bool:
+    """True if a response is buffered or waiting on the socket, without blocking.
+
+    imaplib reads through a buffered file, so lines can already sit in its
+    buffer where select() on the socket would never see them.
+    """
+    sock = conn.socket()
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return bool(conn.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+def _idle_once(conn: imaplib.IMAP4, timeout: float, stop: threading.Event) -> bool:
+    """Run one IDLE cycle; True if the server reported a mailbox change"""
+    tag = conn._new_tag()
+    conn.send(tag + b" IDLE\r\n")
+    if not conn.readline().startswith(b"+"):
+        raise MailSyncError("Server refused IDLE")
+
+    changed = False
+    deadline = time.monotonic() + timeout
+    while not changed and not stop.is_set() and time.monotonic() < deadline:
+        if not _readable(conn):
+            select.select([conn.socket()], [], [], 1.0)
+            continue
+        line = conn.readline()
+        if not line:
+            raise MailSyncError("IMAP connection closed during IDLE")
+        changed = line.startswith(b"*") and any(word in line for word in (b"EXISTS", b"EXPUNGE", b"FETCH"))
+
+    conn.send(b"DONE\r\n")
+    while True:
+        line = conn.readline()
+        if not line:
+            raise MailSyncError("IMAP connection closed during IDLE")
+        if line.startswith(tag):
+            return changed
+
+
+class MailPoller:
+    """Keeps every active MailAccount's INBOX in sync in the background"""
+
+    def __init__(self, pool: ImapPool, concurrency: int, interval: int, max_idle_accounts: int):
+        self.pool = pool
+        self.interval = interval
+        self.max_idle_accounts = max_idle_accounts
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="mail-sync")
+        self._inflight: Set[int] = set()
+        self._idle_watchers: Dict[int, threading.Thread] = {}
+        self._no_idle: Set[int] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def request_sync(self, account_id: int) -> bool:
+        """Schedule a sync unless one is already queued or running for this account"""
+        with self._lock:
+            if account_id in self._inflight or self._stop.is_set():
+                return False
+            self._inflight.add(account_id)
+        self._executor.submit(self._sync_account, account_id)
+        return True
+
+    def _sync_account(self, account_id: int) -> None:
+        lock = self.pool.sync_lock(account_id)
+        if not lock.acquire(blocking=False):
+            # A manual sync is running; it picks up whatever this one would have
+            with self._lock:
+                self._inflight.discard(account_id)
+            return
+        db = SessionLocal()
+        try:
+            acc = db.get(models.MailAccount, account_id)
+            if acc is None or not acc.is_active:
+                return
+            with self.pool.connection(acc) as conn:
+                added = sync_folder(db, acc, conn, "INBOX")
+            if added:
+                logger.info(f"Mail sync: account {account_id} +{added}")
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Mail sync failed for account {account_id}: {e}")
+        finally:
+            db.close()
+            lock.release()
+            with self._lock:
+                self._inflight.discard(account_id)
+
+    def _watch_idle(self, account_id: int) -> None:
+        try:
+            self._watch_idle_loop(account_id)
+        finally:
+            self.pool.release_watcher()
+
+    def _watch_idle_loop(self, account_id: int) -> None:
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                acc = db.get(models.MailAccount, account_id)
+                if acc is None or not acc.is_active:
+                    return
+                conn = open_imap(acc)
+            except Exception as e:
+                logger.warning(f"IDLE connect failed for account {account_id}: {e}")
+                self._stop.wait(IDLE_RETRY_SECONDS)
+                continue
+            finally:
+                db.close()
+
+            try:
+                if "IDLE" not in conn.capabilities:
+                    with self._lock:
+                        self._no_idle.add(account_id)
+                    return
+                conn.select("INBOX", readonly=True)
+                while not self._stop.is_set():
+                    if _idle_once(conn, IDLE_RENEW_SECONDS, self._stop):
+                        self.request_sync(account_id)
+            except Exception as e:
+                logger.warning(f"IDLE failed for account {account_id}: {e}")
+                self._stop.wait(IDLE_RETRY_SECONDS)
+            finally:
+                _safe_logout(conn)
+
+    def _ensure_idle_watchers(self, account_ids) -> None:
+        with self._lock:
+            for aid, thread in list(self._idle_watchers.items()):
+                if not thread.is_alive():
+                    del self._idle_watchers[aid]
+            for aid in account_ids:
+                if len(self._idle_watchers) >= self.max_idle_accounts:
+                    break
+                if aid in self._idle_watchers or aid in self._no_idle:
+                    continue
+                if not self.pool.reserve_watcher():
+                    break
+                thread = threading.Thread(target=self._watch_idle, args=(aid,), name=f"mail-idle-{aid}", daemon=True)
+                self._idle_watchers[aid] = thread
+                thread.start()
+
+    def _collect_garbage(self) -> None:
+        db = SessionLocal()
+        try:
+            removed = collect_garbage(db)
+            if removed:
+                logger.info(f"Removed {removed} unreferenced attachment blobs")
+        finally:
+            db.close()
+
+    def _run(self) -> None:
+        next_gc = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                db = SessionLocal()
+                try:
+                    account_ids = [aid for (aid,) in db.query(models.MailAccount.id).filter(models.MailAccount.is_active.is_(True))]
+                finally:
+                    db.close()
+                for aid in account_ids:
+                    self.request_sync(aid)
+                self._ensure_idle_watchers(account_ids)
+                self.pool.prune()
+                if time.monotonic() >= next_gc:
+                    next_gc = time.monotonic() + ATTACHMENT_GC_SECONDS
+                    self._collect_garbage()
+            except Exception:
+                logger.exception("Mail poller iteration failed")
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="mail-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.pool.close_all()
+
+
+imap_pool = ImapPool(settings.MAIL_SYNC_CONCURRENCY, settings.MAIL_IMAP_MAX_IDLE_CONNECTIONS, settings.MAIL_IMAP_IDLE_CONNECTION_SECONDS)
+poller = MailPoller(imap_pool, settings.MAIL_SYNC_CONCURRENCY, settings.MAIL_POLL_INTERVAL_SECONDS, settings.MAIL_IDLE_ACCOUNTS)
+
+_leader_lock = None
+
+
+def start() -> bool:
+    """Start the poller if enabled and no other worker process on this host runs it"""
+    global _leader_lock
+    if not settings.MAIL_POLLER_ENABLED:
+        return False
+    try:
+        import fcntl
+        _leader_lock = open(settings.MAIL_POLLER_LOCK_FILE, "w")
+        fcntl.flock(_leader_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except ImportError:
+        pass   # no flock (e.g. Windows dev box): single-process use assumed
+    except OSError:
+        _leader_lock.close()
+        _leader_lock = None
+        return False
+    poller.start()
+    return True
+
+
+def stop() -> None:
+    poller.stop()
@@ -0,0 +1,247 @@
+"""
+Incremental IMAP sync engine
+
+Each (account, folder) remembers its UIDVALIDITY, UIDNEXT and the highest UID
+already imported. A sync starts with a single STATUS command; if UIDNEXT and
+UIDVALIDITY are unchanged there is nothing to do. Otherwise only UIDs above
+the last seen one are fetched, in batched UID FETCH ranges that pull headers
+and BODYSTRUCTURE (never full bodies). New messages are deduplicated against
+the emails table with one set-based query per batch and bulk-inserted.
+Only new messages whose BODYSTRUCTURE names a file part are then downloaded
+in full, one message per FETCH so at most one raw message is held in memory,
+and their attachments go to the blob store (attachment_store.py). An email's
+has_attachments and attachment_count are set from the parts actually stored,
+so they always match the attachment list it is served with.
+"""
+import imaplib
+import re
+from datetime import datetime, timezone
+from email import policy
+from email.parser import BytesParser
+from email.utils import parsedate_to_datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+
+from attachment_store import store_attachments
+from config import settings
+from imap_client import check, quote
+import models
+
+HEADER_FIELDS = "MESSAGE-ID SUBJECT FROM TO CC DATE"
+FETCH_ITEMS = f"(UID FLAGS INTERNALDATE RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])"
+FETCH_BATCH = 200
+
+_MESSAGE_START = re.compile(rb"^\d+ \(")
+_UID = re.compile(rb"UID (\d+)")
+_FLAGS = re.compile(rb"FLAGS \(([^)]*)\)")
+_INTERNALDATE = re.compile(rb'INTERNALDATE "([^"]+)"')
+_SIZE = re.compile(rb"RFC822\.SIZE (\d+)")
+_STATUS_ITEM = re.compile(rb"(UIDVALIDITY|UIDNEXT) (\d+)")
+# A disposition or file name anywhere in the BODYSTRUCTURE: worth downloading
+_FILE_PART = re.compile(rb'"(?:ATTACHMENT|FILENAME|NAME)"', re.IGNORECASE)
+
+_header_parser = BytesParser(policy=policy.default)
+
+
+def folder_status(conn: imaplib.IMAP4, folder: str) -> dict:
+    """UIDVALIDITY/UIDNEXT for ``folder`` via a single STATUS round-trip"""
+    data = check(*conn.status(quote(folder), "(UIDVALIDITY UIDNEXT)"), "STATUS")
+    return {key.decode(): int(value) for key, value in _STATUS_ITEM.findall(b" ".join(d for d in data if isinstance(d, bytes)))}
+
+
+def _uid_set(uids: List[int]) -> str:
+    """Compact IMAP sequence set, e.g. [1,2,3,7] -> '1:3,7'"""
+    ranges, start, prev = [], uids[0], uids[0]
+    for uid in uids[1:]:
+        if uid != prev + 1:
+            ranges.append(f"{start}:{prev}" if start != prev else str(start))
+            start = uid
+        prev = uid
+    ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+
+def _split_fetch(data) -> List[dict]:
+    """Group imaplib FETCH output into per-message {meta, header} dicts"""
+    messages, current = [], None
+    for part in data:
+        if isinstance(part, tuple):
+            meta, literal = part
+            if current is None or _MESSAGE_START.match(meta):
+                current = {"meta": b"", "header": b""}
+                messages.append(current)
+            current["meta"] += meta
+            if b"HEADER.FIELDS" in meta.upper():
+                current["header"] = literal
+            else:
+                current["meta"] += b'"' + literal + b'"'
+        elif isinstance(part, bytes):
+            if _MESSAGE_START.match(part):
+                current = {"meta": b"", "header": b""}
+                messages.append(current)
+            if current is not None:
+                current["meta"] += part
+    return messages
+
+
+def _message_date(headers, meta: bytes) -> datetime:
+    if headers["Date"]:
+        try:
+            return parsedate_to_datetime(str(headers["Date"]))
+        except (TypeError, ValueError):
+            pass
+    match = _INTERNALDATE.search(meta)
+    if match:
+        parsed = imaplib.Internaldate2tuple(b'INTERNALDATE "' + match.group(1) + b'"')
+        if parsed:
+            return datetime(*parsed[:6], tzinfo=timezone.utc)
+    return datetime.now(timezone.utc)
+
+
+def _to_row(acc: models.MailAccount, folder: str, uidvalidity: int, message: dict) -> Optional[dict]:
+    meta = message["meta"]
+    uid_match = _UID.search(meta)
+    if not uid_match:
+        return None
+    uid = int(uid_match.group(1))
+    headers = _header_parser.parsebytes(message["header"], headersonly=True)
+    flags = _FLAGS.search(meta)
+    message_id = str(headers["Message-ID"] or "").strip() or f"<{uidvalidity}.{uid}.{acc.id}@prohub.local>"
+    return {
+        "account_id": acc.id,
+        "message_id": message_id[:255],
+        "subject": str(headers["Subject"] or "")[:500],
+        "sender": str(headers["From"] or "")[:255],
+        "recipients": str(headers["To"] or ""),
+        "cc": str(headers["Cc"] or "") or None,
+        "date": _message_date(headers, meta),
+        "is_read": bool(flags and b"\\Seen" in flags.group(1)),
+        "folder": folder,
+        "imap_uid": uid,
+        "has_attachments": False,   # set by _fetch_attachments() from what is stored
+        "attachment_count": 0,
+    }
+
+
+def _store(db: Session, acc: models.MailAccount, rows: Iterable[dict]) -> List[dict]:
+    """Insert rows whose Message-ID is new; re-point this account's existing copies at their new UID.
+
+    Returns the inserted rows.
+    """
+    rows = {row["message_id"]: row for row in rows}
+    if not rows:
+        return []
+    E = models.Email
+    existing = db.query(E.id, E.message_id, E.account_id, E.imap_uid).filter(E.message_id.in_(list(rows))).all()
+    moved = [
+        {"id": e.id, "imap_uid": rows[e.message_id]["imap_uid"]}
+        for e in existing
+        if e.account_id == acc.id and e.imap_uid != rows[e.message_id]["imap_uid"]
+    ]
+    if moved:
+        db.execute(update(E), moved)
+    known = {e.message_id for e in existing}
+    new_rows = [row for mid, row in rows.items() if mid not in known]
+    if new_rows:
+        db.execute(insert(E), new_rows)
+    return new_rows
+
+
+def _fetch_messages(conn: imaplib.IMAP4, email_ids: dict) -> Iterator[Tuple[int, bytes]]:
+    """(email id, raw message) for {uid: email id}, one UID FETCH per message"""
+    for uid, email_id in sorted(email_ids.items()):
+        data = check(*conn.uid("FETCH", str(uid), "(UID BODY.PEEK[])"), "FETCH")
+        # The UID item may come before or after the literal, and the server may
+        # add unsolicited FETCH responses, so match each literal by its UID.
+        fetched = []
+        for part in data:
+            if isinstance(part, tuple):
+                fetched.append([part[0], part[1]])
+            elif isinstance(part, bytes) and fetched:
+                fetched[-1][0] += part
+        for meta, raw in fetched:
+            match = _UID.search(meta)
+            if match and int(match.group(1)) == uid:
+                yield email_id, raw
+                break
+
+
+def _fetch_attachments(db: Session, conn: imaplib.IMAP4, rows: List[dict]) -> int:
+    """Download the full messages for ``rows``, store their attachments and count them on the emails"""
+    if not rows:
+        return 0
+    E, A = models.Email, models.EmailAttachment
+    ids = dict(db.query(E.message_id, E.id).filter(E.message_id.in_([r["message_id"] for r in rows])).all())
+    email_ids = {r["imap_uid"]: ids[r["message_id"]] for r in rows if r["message_id"] in ids}
+    stored = store_attachments(db, _fetch_messages(conn, email_ids))
+    count = select(func.count(A.id)).where(A.email_id == E.id).scalar_subquery()
+    db.execute(
+        update(E)
+        .where(E.id.in_(list(email_ids.values())))
+        .values(attachment_count=count, has_attachments=count > 0)
+        .execution_options(synchronize_session=False)
+    )
+    return stored
+
+
+def sync_folder(db: Session, acc: models.MailAccount, conn: imaplib.IMAP4, folder: str = "INBOX", initial_limit: int = 50) -> int:
+    """Import new messages from one folder; returns how many emails were added.
+
+    The first sync of a folder imports only the newest ``initial_limit``
+    messages. Later syncs import every UID above the last one seen.
+    """
+    state = db.query(models.MailFolderState).filter(
+        models.MailFolderState.account_id == acc.id,
+        models.MailFolderState.folder == folder,
+    ).first()
+    if state is None:
+        state = models.MailFolderState(account_id=acc.id, folder=folder, last_seen_uid=0)
+        db.add(state)
+
+    status = folder_status(conn, folder)
+    uidvalidity, uidnext = status.get("UIDVALIDITY"), status.get("UIDNEXT")
+    if state.uidvalidity is not None and uidvalidity != state.uidvalidity:
+        # Mailbox was rebuilt: every stored UID is meaningless now.
+        db.query(models.Email).filter(models.Email.account_id == acc.id, models.Email.folder == folder).update(
+            {models.Email.imap_uid: None}, synchronize_session=False
+        )
+        state.last_seen_uid = 0
+        state.uidnext = None
+    elif state.uidvalidity is not None and uidnext is not None and uidnext == state.uidnext:
+        acc.last_sync = datetime.utcnow()
+        db.commit()
+        return 0
+
+    check(*conn.select(quote(folder), readonly=True), "SELECT")
+    first_sync = not state.last_seen_uid
+    data = check(*conn.uid("SEARCH", f"UID {state.last_seen_uid + 1}:*"), "SEARCH")
+    uids = sorted(uid for uid in map(int, b" ".join(d for d in data if d).split()) if uid > state.last_seen_uid)
+    if first_sync and initial_limit:
+        uids = uids[-initial_limit:]
+
+    state.uidvalidity = uidvalidity
+    max_size = settings.MAIL_ATTACHMENT_MAX_MESSAGE_MB * 1024 * 1024
+    added = 0
+    for i in range(0, len(uids), FETCH_BATCH):
+        batch = uids[i:i + FETCH_BATCH]
+        data = check(*conn.uid("FETCH", _uid_set(batch), FETCH_ITEMS), "FETCH")
+        rows, wanted = [], set()
+        for message in _split_fetch(data):
+            row = _to_row(acc, folder, uidvalidity, message)
+            if row:
+                rows.append(row)
+                size = _SIZE.search(message["meta"])
+                if _FILE_PART.search(message["meta"]) and (int(size.group(1)) if size else 0) <= max_size:
+                    wanted.add(row["imap_uid"])
+        new_rows = _store(db, acc, rows)
+        added += len(new_rows)
+        _fetch_attachments(db, conn, [r for r in new_rows if r["imap_uid"] in wanted])
+        state.last_seen_uid = max(batch)
+        db.commit()
+
+    state.uidnext = uidnext if uidnext is not None else (max(uids) + 1 if uids else state.uidnext)
+    acc.last_sync = datetime.utcnow()
+    db.commit()
+    return added
@@ -4,13 +4,27 @@ ProHub FastAPI Backend v2.0 - Main Application
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+import anyio.to_thread
 import uvicorn
 
-from database import engine, Base
+from config import settings
+from database import SessionLocal, async_engine, ensure_schema
+import models  # registers all tables on Base before create_all
+import calendar_sync  # stamps CalDAV sync revisions on every calendar write
+import versions  # bumps per-user resource versions on every tracked write
+from user_cache import user_cache
+from password_pool import password_pool
+import radicale
+import mail_poller
+import mail_outbox
+import search
+import metrics
+import query_audit
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+# Create database tables (and columns/indexes added since they were created)
+ensure_schema()
+search.setup_search()
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -28,29 +42,99 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# Per-route latency and SQL work (served at /metrics)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Slow-query log and repeated-statement detector
+app.add_middleware(query_audit.QueryAuditMiddleware)
+
 # Import and include routers
 try:
     from routers import auth, notes, calendar, finance, mail
     from caldav import caldav_server
     from routers import savings
 
-    app.include_router(savings.router, prefix="/api/finance/savings", tags=["savings"])
-    app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
-    app.include_router(notes.router, prefix="/api/notes", tags=["Notes"])
-    app.include_router(calendar.router, prefix="/api/calendar", tags=["Calendar"])
-    app.include_router(finance.router, prefix="/api/finance", tags=["Finance"])
-    app.include_router(mail.router, prefix="/api/mail", tags=["Mail"])
-    app.include_router(caldav_server.router, prefix="/caldav", tags=["CalDAV"])
+    for router, prefix, tags in (
+        (savings.router, "/api/finance/savings", ["savings"]),
+        (auth.router, "/api/auth", ["Authentication"]),
+        (notes.router, "/api/notes", ["Notes"]),
+        (calendar.router, "/api/calendar", ["Calendar"]),
+        (finance.router, "/api/finance", ["Finance"]),
+        (mail.router, "/api/mail", ["Mail"]),
+        (caldav_server.router, "/caldav", ["CalDAV"]),
+    ):
+        app.include_router(router, prefix=prefix, tags=tags)
 except ImportError as e:
     print(f"Warning: Could not import routers: {e}")
 
-# Mount static files
-try:
-    app.mount("/", StaticFiles(directory="../frontend", html=True), name="frontend")
-except RuntimeError:
-    pass
+
+@app.on_event("startup")
+async def size_threadpool():
+    # Sync routes run here; sized to the sync DB pool so threads don't queue on connections
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
+
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await async_engine.dispose()
+
+
+@app.on_event("startup")
+def start_password_pool():
+    password_pool.start()
+
+
+@app.on_event("shutdown")
+def stop_password_pool():
+    password_pool.shutdown()
+
+
+@app.on_event("startup")
+def start_radicale_outbox():
+    radicale.start_worker()
+
+
+@app.on_event("shutdown")
+def stop_radicale_outbox():
+    radicale.stop_worker()
+
+
+@app.on_event("startup")
+def start_mail_poller():
+    mail_poller.start()
+
+
+@app.on_event("shutdown")
+def stop_mail_poller():
+    mail_poller.stop()
+
+
+@app.on_event("startup")
+def start_mail_outbox():
+    mail_outbox.start_worker()
+
+
+@app.on_event("shutdown")
+def stop_mail_outbox():
+    mail_outbox.stop_worker()
+
+
+@app.on_event("shutdown")
+def release_worker_metrics():
+    metrics.mark_process_dead()
+
+
+@app.on_event("startup")
+def backfill_finance_rollups():
+    from routers.finance import backfill_rollups
+    db = SessionLocal()
+    try:
+        backfill_rollups(db)
+    finally:
+        db.close()
 
 # Health check
 @app.get("/api/health")
@@ -64,10 +148,18 @@ async def health_check():
             "Calendar with Apple CalDAV sync",
             "Finance with categories, budgets & savings",
             "Mail client (IMAP/SMTP)"
-        ]
+        ],
+        "user_cache": user_cache.stats(),
+        "password_pool": password_pool.stats()
     }
 
 
+# Prometheus scrape target, merged across all uvicorn workers
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 # Root
 @app.get("/api")
 async def root():
@@ -78,6 +170,12 @@ async def root():
         "health": "/api/health"
     }
 
+# Mount static files last so the catch-all "/" mount doesn't shadow API routes
+try:
+    app.mount("/", StaticFiles(directory="../frontend", html=True), name="frontend")
+except RuntimeError:
+    pass
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
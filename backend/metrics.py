@@ -0,0 +1,258 @@
+"""
+Prometheus metrics, aggregated across uvicorn workers
+
+Every worker process writes its samples to memory-mapped files in a shared
+directory (prometheus_client's multiprocess mode) and GET /metrics merges
+the files of all workers, so a scrape that lands on any worker sees the
+whole server. The directory is per server run: METRICS_DIR/<pid of the
+uvicorn master>, which all workers share as their parent. Directories left
+by previous runs are removed on startup. PROMETHEUS_MULTIPROC_DIR, if set,
+is used as is.
+
+Collected here:
+- request latency per route template (MetricsMiddleware),
+- SQL statements and time per request, via cursor events on both engines,
+- connection-pool checkout wait, checked-out connections and timeouts,
+- duration and errors of outgoing Radicale, IMAP and SMTP calls
+  (external_call()).
+"""
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from config import settings
+
+
+def _prune_dead_runs(base: str) -> None:
+    for name in os.listdir(base):
+        if not name.isdigit():
+            continue
+        try:
+            os.kill(int(name), 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+        except PermissionError:
+            pass   # alive, owned by someone else
+
+
+# Must be set before prometheus_client is imported: it picks its value storage then
+if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    _prune_dead_runs(settings.METRICS_DIR)
+    _run_dir = os.path.join(settings.METRICS_DIR, str(os.getppid()))
+    os.makedirs(_run_dir, exist_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = _run_dir
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+REQUEST_SECONDS = Histogram(
+    "prohub_http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "prohub_http_request_db_queries", "SQL statements executed per HTTP request", ["route"], buckets=QUERY_BUCKETS,
+)
+REQUEST_DB_SECONDS = Histogram(
+    "prohub_http_request_db_seconds", "Time spent in SQL statements per HTTP request", ["route"],
+)
+DB_QUERIES = Counter("prohub_db_queries", "SQL statements executed, including background workers", ["engine"])
+DB_SECONDS = Counter("prohub_db_query_seconds", "Time spent in SQL statements, including background workers", ["engine"])
+
+POOL_CHECKOUT_SECONDS = Histogram(
+    "prohub_db_pool_checkout_seconds", "Time to obtain a pooled connection, including waiting for one", ["engine"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+POOL_TIMEOUTS = Counter("prohub_db_pool_checkout_timeouts", "Checkouts that gave up waiting for a connection", ["engine"])
+POOL_CHECKED_OUT = Gauge(
+    "prohub_db_pool_checked_out", "Connections currently checked out", ["engine"], multiprocess_mode="livesum",
+)
+POOL_CAPACITY = Gauge(
+    "prohub_db_pool_capacity", "pool_size + max_overflow", ["engine"], multiprocess_mode="livesum",
+)
+
+EXTERNAL_SECONDS = Histogram(
+    "prohub_external_call_duration_seconds", "Outgoing Radicale/IMAP/SMTP call latency", ["service", "operation"],
+)
+EXTERNAL_ERRORS = Counter(
+    "prohub_external_call_errors", "Outgoing Radicale/IMAP/SMTP calls that failed", ["service", "operation"],
+)
+
+
+# ─── Per-request SQL accounting ─────────────────────────────────────────────
+
+class RequestStats:
+    """SQL work done on behalf of one HTTP request"""
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# Set by MetricsMiddleware; sync routes see the same object through the
+# context copied into the threadpool, async ones through SQLAlchemy's greenlet
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+# The start time lives on the execution context, which belongs to one
+# statement, so a statement that fails between the two events leaves nothing
+# behind. Sequence and default pre-executions run without a context; they are
+# not counted.
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute_for(engine_name: str):
+    queries, seconds = DB_QUERIES.labels(engine_name), DB_SECONDS.labels(engine_name)
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        queries.inc()
+        seconds.inc(elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+
+    return after_cursor_execute
+
+
+# ─── Connection pools ───────────────────────────────────────────────────────
+
+class _TimedPoolMixin:
+    """Times every checkout; ``metrics_engine`` labels the samples"""
+    metrics_engine = "sync"
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.labels(self.metrics_engine).inc()
+            raise
+        finally:
+            POOL_CHECKOUT_SECONDS.labels(self.metrics_engine).observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    metrics_engine = "sync"
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    metrics_engine = "async"
+
+
+def instrument_engine(engine, name: str) -> None:
+    """Count statements and track pool usage of ``engine`` (pass ``.sync_engine`` for an AsyncEngine)"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute_for(name))
+
+    pool = engine.pool
+    checked_out = POOL_CHECKED_OUT.labels(name)
+    if isinstance(pool, QueuePool):
+        POOL_CAPACITY.labels(name).set(pool.size() + pool._max_overflow)
+
+    @event.listens_for(pool, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checked_out.inc()
+
+    @event.listens_for(pool, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        checked_out.dec()
+
+
+# ─── Outgoing calls ─────────────────────────────────────────────────────────
+
+class _Call:
+    __slots__ = ("ok",)
+
+    def __init__(self):
+        self.ok = True
+
+
+@contextmanager
+def external_call(service: str, operation: str):
+    """Time the block as one ``service`` call; an exception, or setting ``.ok = False`` on the yielded object, counts it as an error"""
+    call = _Call()
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.ok = False
+        raise
+    finally:
+        EXTERNAL_SECONDS.labels(service, operation).observe(time.perf_counter() - start)
+        if not call.ok:
+            EXTERNAL_ERRORS.labels(service, operation).inc()
+
+
+# ─── HTTP ───────────────────────────────────────────────────────────────────
+
+def route_label(scope) -> str:
+    """Route template a request was dispatched to, e.g. /api/notes/{note_id}"""
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"   # 404s: keep arbitrary paths out of the label set
+    # FastAPI keeps included routers rather than copying their routes, so the
+    # route's own path_format lacks the prefix; the effective route context it
+    # records in the scope carries the full template.
+    context = scope.get("fastapi", {}).get("effective_route_context")
+    return getattr(context, "path_format", None) or getattr(route, "path_format", None) or "/"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL work per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_stats.reset(token)
+            route = route_label(scope)
+            REQUEST_SECONDS.labels(scope["method"], route, status).observe(elapsed)
+            REQUEST_QUERIES.labels(route).observe(stats.queries)
+            REQUEST_DB_SECONDS.labels(route).observe(stats.seconds)
+
+
+def render() -> bytes:
+    """All workers' samples in the Prometheus text format"""
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def mark_process_dead() -> None:
+    """Drop this worker's live gauges (checked-out connections) on shutdown"""
+    multiprocess.mark_process_dead(os.getpid())
@@ -1,8 +1,8 @@
 """
 SQLAlchemy Database Models - Complete v2.0
 """
-from sqlalchemy import Column, Integer, String, Text, Boolean, Date, Numeric, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Boolean, Date, Numeric, DateTime, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 from database import Base
 
@@ -28,6 +28,9 @@ class User(Base):
 
 class Note(Base):
     __tablename__ = "notes"
+    __table_args__ = (
+        Index("ix_notes_user_created", "user_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -45,6 +48,10 @@ class Note(Base):
 
 class CalendarEvent(Base):
     __tablename__ = "calendar_events"
+    __table_args__ = (
+        Index("ix_calendar_events_user_date", "user_id", "date", "id"),
+        Index("ix_calendar_events_user_revision", "user_id", "sync_revision"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -54,14 +61,45 @@ class CalendarEvent(Base):
     date = Column(Date, nullable=False)
     priority = Column(String(20), default="medium")
     caldav_uid = Column(String(255), unique=True, nullable=True)
+    sync_revision = Column(BigInteger, nullable=True)   # calendar version of the last change (calendar_sync.py)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     owner = relationship("User", back_populates="calendar_events")
 
 
+class CalendarTombstone(Base):
+    """A deleted CalDAV resource, kept so sync-collection can report it to clients"""
+    __tablename__ = "calendar_tombstones"
+    __table_args__ = (
+        Index("ix_calendar_tombstones_user_revision", "user_id", "revision"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    caldav_uid = Column(String(255), nullable=False)
+    revision = Column(BigInteger, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ResourceVersion(Base):
+    """Per-user change counter for one resource (e.g. "calendar"); see versions.py"""
+    __tablename__ = "resource_versions"
+    __table_args__ = (
+        UniqueConstraint("user_id", "resource", name="uq_resource_versions_user_resource"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    resource = Column(String(50), nullable=False)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
 class Category(Base):
     __tablename__ = "categories"
+    __table_args__ = (
+        Index("ix_categories_user", "user_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -77,6 +115,10 @@ class Category(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index("ix_transactions_user_date", "user_id", "date", "id"),
+        Index("uq_transactions_user_import_hash", "user_id", "import_hash", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -88,6 +130,7 @@ class Transaction(Base):
     is_recurring = Column(Boolean, default=False)
     recurring_interval = Column(String(20), nullable=True)
     notes = Column(Text, nullable=True)
+    import_hash = Column(String(64), nullable=True)   # set on statement imports; makes re-imports idempotent
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
@@ -95,8 +138,59 @@ class Transaction(Base):
     category = relationship("Category", back_populates="transactions")
 
 
+class ImportJob(Base):
+    """Progress and outcome of one bank-statement import (statement_import.py)"""
+    __tablename__ = "import_jobs"
+    __table_args__ = (
+        Index("ix_import_jobs_user", "user_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    filename = Column(String(255), nullable=True)
+    format = Column(String(10), nullable=False)
+    status = Column(String(20), nullable=False, default="running")   # running, done, failed
+    bytes_total = Column(BigInteger, nullable=True)
+    bytes_read = Column(BigInteger, nullable=False, default=0)
+    rows_read = Column(Integer, nullable=False, default=0)
+    imported = Column(Integer, nullable=False, default=0)
+    duplicates = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class TransactionRollup(Base):
+    """Per-user, per-month, per-category totals maintained alongside transactions."""
+    __tablename__ = "transaction_rollups"
+    __table_args__ = (
+        Index("ix_transaction_rollups_user_month", "user_id", "month"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    category_id = Column(Integer, ForeignKey("categories.id", ondelete="SET NULL"), nullable=True)
+    month = Column(Date, nullable=False)
+    type = Column(String(20), nullable=False)
+    total = Column(Numeric(14, 2), nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+
+# One row per (user, month, category, type), the conflict target of the rollup
+# upserts; category_id is coalesced since NULLs never collide in a unique index
+Index(
+    "uq_transaction_rollups_key",
+    TransactionRollup.user_id, TransactionRollup.month, func.coalesce(TransactionRollup.category_id, 0), TransactionRollup.type,
+    unique=True,
+)
+
+
 class Budget(Base):
     __tablename__ = "budgets"
+    __table_args__ = (
+        Index("ix_budgets_user", "user_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -115,6 +209,9 @@ class Budget(Base):
 
 class SavingsGoal(Base):
     __tablename__ = "savings_goals"
+    __table_args__ = (
+        Index("ix_savings_goals_user_created", "user_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -131,6 +228,9 @@ class SavingsGoal(Base):
 
 class MailAccount(Base):
     __tablename__ = "mail_accounts"
+    __table_args__ = (
+        Index("ix_mail_accounts_user", "user_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -150,10 +250,32 @@ class MailAccount(Base):
     
     owner = relationship("User", back_populates="mail_accounts")
     emails = relationship("Email", back_populates="account", cascade="all, delete-orphan")
+    folder_states = relationship("MailFolderState", back_populates="account", cascade="all, delete-orphan")
+
+
+class MailFolderState(Base):
+    """IMAP sync position per account and folder (UIDVALIDITY/UIDNEXT)."""
+    __tablename__ = "mail_folder_states"
+    __table_args__ = (
+        UniqueConstraint("account_id", "folder", name="uq_mail_folder_states_account_folder"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(Integer, ForeignKey("mail_accounts.id", ondelete="CASCADE"), nullable=False)
+    folder = Column(String(255), nullable=False, default="INBOX")
+    uidvalidity = Column(BigInteger, nullable=True)
+    uidnext = Column(BigInteger, nullable=True)
+    last_seen_uid = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    account = relationship("MailAccount", back_populates="folder_states")
 
 
 class Email(Base):
     __tablename__ = "emails"
+    __table_args__ = (
+        Index("ix_emails_account_date", "account_id", "date", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     account_id = Column(Integer, ForeignKey("mail_accounts.id", ondelete="CASCADE"), nullable=False)
@@ -163,15 +285,76 @@ class Email(Base):
     recipients = Column(Text, nullable=True)
     cc = Column(Text, nullable=True)
     bcc = Column(Text, nullable=True)
-    body_text = Column(Text, nullable=True)
-    body_html = Column(Text, nullable=True)
+    # Bodies live in the on-disk cache (mail_bodies.py); only pre-cache rows still fill these
+    body_text = deferred(Column(Text, nullable=True), group="body")
+    body_html = deferred(Column(Text, nullable=True), group="body")
     date = Column(DateTime(timezone=True), nullable=False)
     is_read = Column(Boolean, default=False)
     is_starred = Column(Boolean, default=False)
     is_archived = Column(Boolean, default=False)
     folder = Column(String(255), default="INBOX")
+    imap_uid = Column(BigInteger, nullable=True)
     has_attachments = Column(Boolean, default=False)
     attachment_count = Column(Integer, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     account = relationship("MailAccount", back_populates="emails")
+    attachments = relationship("EmailAttachment", back_populates="email", cascade="all, delete-orphan", passive_deletes=True)
+
+
+class EmailAttachment(Base):
+    """An attachment of an Email; the payload is a content-addressed blob (attachment_store.py)"""
+    __tablename__ = "email_attachments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    email_id = Column(Integer, ForeignKey("emails.id", ondelete="CASCADE"), nullable=False, index=True)
+    filename = Column(String(255), nullable=False)
+    content_type = Column(String(255), nullable=False, default="application/octet-stream")
+    size = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    email = relationship("Email", back_populates="attachments")
+
+
+class RadicaleOutbox(Base):
+    """Pending CalDAV pushes to Radicale, one live row per (username, caldav_uid)."""
+    __tablename__ = "radicale_outbox"
+    __table_args__ = (
+        Index("ix_radicale_outbox_uid", "username", "caldav_uid"),
+        Index("ix_radicale_outbox_due", "next_attempt_at", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String(100), nullable=False)
+    caldav_uid = Column(String(255), nullable=False)
+    action = Column(String(10), nullable=False)
+    payload = Column(Text, nullable=True)
+    version = Column(Integer, nullable=False, default=1)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(Text, nullable=True)
+    failed_at = Column(DateTime, nullable=True)   # gave up after MAX_ATTEMPTS; kept until the UID is enqueued again
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class OutgoingEmail(Base):
+    """Outbound mail queued for background SMTP delivery."""
+    __tablename__ = "outgoing_emails"
+    __table_args__ = (
+        Index("ix_outgoing_emails_due", "status", "next_attempt_at", "id"),
+        Index("ix_outgoing_emails_account", "account_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(Integer, ForeignKey("mail_accounts.id", ondelete="CASCADE"), nullable=False)
+    recipients = Column(Text, nullable=False)
+    subject = Column(String(500), nullable=True)
+    message = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    claim_token = Column(String(32), nullable=True)   # set while a worker holds the row in 'sending'
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,110 @@
+"""
+Keyset (cursor) pagination helpers
+
+A cursor is an opaque, URL-safe token holding the sort key and id of the last
+row on the previous page. The next page is read with a row-value comparison
+against that key, so it costs the same index range scan however deep it is.
+
+SQLite keeps dates and datetimes as text in whichever format wrote them
+(CURRENT_TIMESTAMP has no fraction, SQLAlchemy's binds always do) and orders
+them as text. There the cursor carries the stored text and is compared as
+text, so the predicate follows the same order as the ORDER BY.
+"""
+import base64
+import json
+from datetime import date, datetime
+from typing import Optional
+
+from fastapi import HTTPException, Response
+from sqlalchemy import String, literal, tuple_, type_coerce
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _encode_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(column, raw):
+    if column is None:
+        return str(raw)
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(raw)
+    if python_type is date:
+        return date.fromisoformat(raw)
+    return python_type(raw)
+
+
+def encode_cursor(sort_value, row_id: int) -> str:
+    """Build an opaque cursor for the row with the given sort value and id"""
+    raw = json.dumps([_encode_value(sort_value), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, sort_column) -> tuple:
+    """Decode a cursor back into typed (sort_value, id); 400 on anything malformed.
+
+    ``sort_column=None`` keeps the sort value as a string.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return _decode_value(sort_column, sort_value), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _stored_as_text(query, sort_column) -> bool:
+    return (
+        query.session.get_bind().dialect.name == "sqlite"
+        and sort_column.type.python_type in (date, datetime)
+    )
+
+
+def keyset_page(query, sort_column, id_column, cursor: Optional[str], limit: int, descending: bool = True, skip: int = 0):
+    """Return (rows, next_cursor) for one page of ``query`` ordered by (sort_column, id_column).
+
+    ``skip`` is honoured only without a cursor, for clients still paging by offset.
+    ``sort_column`` must be NOT NULL: NULLs cannot be compared in a row-value
+    predicate and would drop out of every page after the first.
+    """
+    as_text = _stored_as_text(query, sort_column)
+    if cursor:
+        key = tuple_(sort_column, id_column)
+        if as_text:
+            sort_value, row_id = decode_cursor(cursor, None)
+            bound = literal(sort_value, String())
+        else:
+            sort_value, row_id = decode_cursor(cursor, sort_column)
+            bound = literal(sort_value, sort_column.type)
+        after = tuple_(bound, literal(row_id, id_column.type))
+        query = query.filter(key < after if descending else key > after)
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    if skip and not cursor:
+        query = query.offset(skip)
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    row_id = getattr(rows[-1], id_column.key)
+    if as_text:
+        sort_value = query.session.query(type_coerce(sort_column, String)).filter(id_column == row_id).scalar()
+    else:
+        sort_value = getattr(rows[-1], sort_column.key)
+    return rows, encode_cursor(sort_value, row_id)
+
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]) -> None:
+    """Expose the next-page cursor without changing the list response body"""
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
@@ -0,0 +1,144 @@
+"""
+Dedicated process pool for password hashing
+
+argon2 is deliberately slow and memory-hard. Run inline in a sync route it
+holds one of the shared FastAPI threadpool's threads for the whole hash, so
+a burst of logins starves every other sync endpoint. Here hashing runs in a
+small pool of worker processes instead, awaited from async routes, so it
+neither blocks the event loop nor occupies threadpool threads, and it runs
+in parallel without the GIL.
+
+Admission is bounded: at most PASSWORD_HASH_MAX_PENDING jobs may be queued
+or running in this process. Beyond that ``PoolSaturated`` is raised at once
+and the route answers 503, rather than piling up requests whose clients will
+have timed out by the time their hash runs.
+
+Workers are spawned (not forked) because the API process runs background
+threads whose locks a fork could copy in a held state.
+"""
+import asyncio
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from config import settings
+
+LATENCY_SAMPLES = 1024   # recent jobs kept for the percentiles in stats()
+
+
+class PoolSaturated(Exception):
+    """Too many password hashes queued; the caller should retry later"""
+
+
+# ─── Worker side (runs in the pool processes) ───────────────────────────────
+
+def _warm() -> None:
+    import auth  # noqa: F401  (imports passlib/argon2 once per worker)
+
+
+def _hash(password: str) -> Tuple[str, float]:
+    from auth import pwd_context
+    start = time.perf_counter()
+    return pwd_context.hash(password), time.perf_counter() - start
+
+
+def _verify(password: str, hashed: str) -> Tuple[Tuple[bool, Optional[str]], float]:
+    """(matches, new hash if the stored one uses outdated parameters)"""
+    from auth import pwd_context
+    start = time.perf_counter()
+    try:
+        result = pwd_context.verify_and_update(password, hashed)
+    except ValueError:   # not a hash passlib recognizes
+        result = (False, None)
+    return result, time.perf_counter() - start
+
+
+# ─── API side ────────────────────────────────────────────────────────────────
+
+def _percentile(samples, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class PasswordHasherPool:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self._wait = deque(maxlen=LATENCY_SAMPLES)   # seconds queued before a worker picked the job up
+        self._run = deque(maxlen=LATENCY_SAMPLES)    # seconds spent hashing in the worker
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def start(self) -> None:
+        """Spawn the workers now so the first logins don't pay for it"""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_warm)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _submit(self, fn, *args):
+        if self.in_flight >= self.max_pending:
+            self.rejected += 1
+            raise PoolSaturated()
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            result, run_seconds = await asyncio.wrap_future(self._get_executor().submit(fn, *args))
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); replace the pool for the next caller
+            self.failed += 1
+            self.shutdown()
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        self._run.append(run_seconds)
+        self._wait.append(max(time.perf_counter() - started - run_seconds, 0.0))
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password)
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """(matches, replacement hash or None); see passlib's verify_and_update"""
+        return await self._submit(_verify, password, hashed)
+
+    def stats(self) -> dict:
+        wait, run = list(self._wait), list(self._run)
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "wait_ms": {"p50": round(_percentile(wait, 0.5) * 1e3, 1), "p95": round(_percentile(wait, 0.95) * 1e3, 1)},
+            "run_ms": {"p50": round(_percentile(run, 0.5) * 1e3, 1), "p95": round(_percentile(run, 0.95) * 1e3, 1)},
+        }
+
+
+password_pool = PasswordHasherPool(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_PENDING)
@@ -0,0 +1,125 @@
+"""
+Slow-query log and repeated-statement (N+1) detector
+
+Both engines report every statement through before/after_cursor_execute.
+Within an HTTP request (QueryAuditMiddleware) each statement is reduced to
+its shape: placeholders unified and IN/VALUES lists collapsed, so the same
+query with other parameters or list lengths counts as one shape. A request
+that runs one shape more than REPEATED_QUERY_LIMIT times is almost always a
+query per loop iteration; it is logged once per shape, or rejected with
+RepeatedQueryError when QUERY_AUDIT_STRICT or DEBUG is set (test runs
+should set QUERY_AUDIT_STRICT=true). executemany and insertmanyvalues
+batches are bulk by definition and not counted.
+
+Statements slower than SLOW_QUERY_MS are logged with the route that ran
+them, or "-" for background workers.
+
+Routes that loop over batches on purpose (streaming imports) call
+allow_repeats() to opt out of the repeat check for their request.
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Optional
+
+from sqlalchemy import event
+
+from config import settings
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_PLACEHOLDER = re.compile(r"\?|%\(\w+\)s|\$\d+")
+_PLACEHOLDER_LIST = re.compile(r"\(\?(?:\s*,\s*\?)*\)(?:\s*,\s*\(\?(?:\s*,\s*\?)*\))*")
+
+
+class RepeatedQueryError(Exception):
+    """One statement shape ran more than REPEATED_QUERY_LIMIT times in a request"""
+
+
+@lru_cache(maxsize=4096)
+def statement_shape(statement: str) -> str:
+    """``statement`` with every placeholder as ? and placeholder lists as (?)"""
+    return _PLACEHOLDER_LIST.sub("(?)", _PLACEHOLDER.sub("?", " ".join(statement.split())))
+
+
+class RequestQueries:
+    """Statement shapes seen during one request"""
+    __slots__ = ("scope", "shapes", "flagged", "repeat_limit")
+
+    def __init__(self, scope, repeat_limit: Optional[int]):
+        self.scope = scope
+        self.shapes = Counter()
+        self.flagged = set()
+        self.repeat_limit = repeat_limit
+
+
+_current: ContextVar[Optional[RequestQueries]] = ContextVar("request_queries", default=None)
+
+
+def allow_repeats() -> None:
+    """Skip the repeat check for the rest of the current request"""
+    request = _current.get()
+    if request is not None:
+        request.repeat_limit = None
+
+
+def _strict() -> bool:
+    return settings.QUERY_AUDIT_STRICT or settings.DEBUG
+
+
+def _check_repeats(request: RequestQueries, statement: str) -> None:
+    shape = statement_shape(statement)
+    request.shapes[shape] += 1
+    if request.shapes[shape] <= request.repeat_limit or shape in request.flagged:
+        return
+    request.flagged.add(shape)
+    message = f"{metrics.route_label(request.scope)} ran the same statement more than {request.repeat_limit} times: {shape[:500]}"
+    if _strict():
+        raise RepeatedQueryError(message)
+    logger.warning(f"Repeated query: {message}")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    request = _current.get()
+    if request is not None and request.repeat_limit is not None and not executemany:
+        _check_repeats(request, statement)
+    if context is not None:   # per statement, so a failed one leaves nothing behind
+        context._audit_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_audit_started", None)
+    if started is None:
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms < settings.SLOW_QUERY_MS:
+        return
+    request = _current.get()
+    route = metrics.route_label(request.scope) if request is not None else "-"
+    logger.warning(f"Slow query ({elapsed_ms:.0f} ms) on {route}: {' '.join(statement.split())[:1000]}")
+
+
+def instrument_engine(engine) -> None:
+    """Audit statements of ``engine`` (pass ``.sync_engine`` for an AsyncEngine)"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class QueryAuditMiddleware:
+    """ASGI middleware giving each HTTP request its own statement counts"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _current.set(RequestQueries(scope, settings.REPEATED_QUERY_LIMIT))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
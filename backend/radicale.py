@@ -0,0 +1,272 @@
+"""
+Radicale client with a write-behind outbox
+
+Calendar writes no longer call Radicale on the request path. They record the
+pending PUT/DELETE in the radicale_outbox table inside the same DB transaction
+as the event change, and a background worker pushes due rows over a pooled
+keep-alive HTTP session. Repeated edits to one UID collapse into a single row
+(the latest action wins), and failed pushes are retried with exponential
+backoff. After MAX_ATTEMPTS a row is marked failed and no longer retried;
+enqueueing its UID again starts over.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from sqlalchemy import case, func, insert
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+import metrics
+import models
+
+logger = logging.getLogger(__name__)
+
+# ─── Radicale config ────────────────────────────────────────────────────────
+RADICALE_INTERNAL = "http://127.0.0.1:5232"   # direct internal connection
+CALDAV_PASSWORD   = getattr(settings, "CALDAV_PASSWORD", "12345")
+HTTP_TIMEOUT      = 5
+
+# ─── Outbox tuning ──────────────────────────────────────────────────────────
+BATCH_SIZE    = 50
+PUSH_WORKERS  = 8                        # concurrent pushes per batch, sharing the HTTP pool
+POLL_INTERVAL = 2.0                      # seconds between idle polls
+LEASE         = timedelta(seconds=60)    # how long a claimed row is hidden from other workers
+BACKOFF_BASE  = 5                        # seconds, doubled per failed attempt
+BACKOFF_MAX   = 3600
+MAX_ATTEMPTS  = 10                       # about 1.5 hours of retries before a push is given up
+
+_http = requests.Session()
+_http.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=PUSH_WORKERS))
+_http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=PUSH_WORKERS))
+_pushers = ThreadPoolExecutor(max_workers=PUSH_WORKERS, thread_name_prefix="radicale-push")
+
+
+def _event_url(username: str, uid: str) -> str:
+    return f"{RADICALE_INTERNAL}/{username}/calendar/{uid}.ics"
+
+
+def _put(username: str, uid: str, ics: str) -> Optional[str]:
+    """PUT one event; returns None on success or an error description"""
+    url = _event_url(username, uid)
+    with metrics.external_call("radicale", "put") as call:
+        try:
+            r = _http.put(
+                url,
+                data=ics.encode("utf-8"),
+                auth=HTTPBasicAuth(username, CALDAV_PASSWORD),
+                headers={"Content-Type": "text/calendar; charset=utf-8"},
+                timeout=HTTP_TIMEOUT,
+            )
+        except requests.RequestException as e:
+            call.ok = False
+            logger.warning(f"CalDAV sync error: {e}")
+            return str(e)
+        call.ok = r.status_code in (201, 204)
+    if call.ok:
+        logger.info(f"CalDAV sync OK: {url} → {r.status_code}")
+        return None
+    logger.warning(f"CalDAV sync failed: {url} → {r.status_code} {r.text[:200]}")
+    return f"HTTP {r.status_code}: {r.text[:200]}"
+
+
+def _delete(username: str, uid: str) -> Optional[str]:
+    """DELETE one event; a missing event counts as deleted"""
+    url = _event_url(username, uid)
+    with metrics.external_call("radicale", "delete") as call:
+        try:
+            r = _http.delete(url, auth=HTTPBasicAuth(username, CALDAV_PASSWORD), timeout=HTTP_TIMEOUT)
+        except requests.RequestException as e:
+            call.ok = False
+            logger.warning(f"CalDAV delete error: {e}")
+            return str(e)
+        call.ok = r.status_code in (200, 204, 404)
+    logger.info(f"CalDAV delete: {url} → {r.status_code}")
+    if call.ok:
+        return None
+    return f"HTTP {r.status_code}: {r.text[:200]}"
+
+
+def put_event(username: str, uid: str, ics: str) -> bool:
+    """PUT a single event into Radicale right now. Returns True on success."""
+    return _put(username, uid, ics) is None
+
+
+def delete_event(username: str, uid: str) -> bool:
+    """DELETE a single event from Radicale right now. Returns True on success."""
+    return _delete(username, uid) is None
+
+
+# ─── Outbox ──────────────────────────────────────────────────────────────────
+
+def _enqueue(db: Session, username: str, uid: str, action: str, payload: Optional[str]) -> None:
+    O = models.RadicaleOutbox
+    now = datetime.utcnow()
+    row = db.query(O).filter(O.username == username, O.caldav_uid == uid).order_by(O.id.desc()).first()
+    if row is None:
+        db.add(O(username=username, caldav_uid=uid, action=action, payload=payload, next_attempt_at=now))
+        return
+    row.action = action
+    row.payload = payload
+    row.version = row.version + 1
+    row.attempts = 0
+    row.next_attempt_at = now
+    row.last_error = None
+    row.failed_at = None
+
+
+def enqueue_put(db: Session, username: str, uid: str, ics: str) -> None:
+    """Schedule a PUT of ``ics``; the caller commits, then calls wake()"""
+    _enqueue(db, username, uid, "put", ics)
+
+
+def enqueue_delete(db: Session, username: str, uid: str) -> None:
+    """Schedule a DELETE; replaces any pending PUT for the same UID"""
+    _enqueue(db, username, uid, "delete", None)
+
+
+def _enqueue_many(db: Session, username: str, items: List[Tuple[str, Optional[str]]], action: str, chunk_size: int) -> int:
+    O = models.RadicaleOutbox
+    now = datetime.utcnow()
+    for i in range(0, len(items), chunk_size):
+        chunk = items[i:i + chunk_size]
+        uids = [uid for uid, _ in chunk]
+        db.query(O).filter(O.username == username, O.caldav_uid.in_(uids)).delete(synchronize_session=False)
+        db.execute(insert(O), [
+            {"username": username, "caldav_uid": uid, "action": action, "payload": payload,
+             "version": 1, "attempts": 0, "next_attempt_at": now}
+            for uid, payload in chunk
+        ])
+    return len(items)
+
+
+def enqueue_puts(db: Session, username: str, items: Iterable[Tuple[str, str]], chunk_size: int = 500) -> int:
+    """Bulk-schedule PUTs of (uid, ics) pairs, replacing pending rows for those UIDs"""
+    return _enqueue_many(db, username, list(items), "put", chunk_size)
+
+
+def enqueue_deletes(db: Session, username: str, uids: Iterable[str], chunk_size: int = 500) -> int:
+    """Bulk-schedule DELETEs, replacing pending rows for those UIDs"""
+    return _enqueue_many(db, username, [(uid, None) for uid in uids], "delete", chunk_size)
+
+
+def outbox_status(db: Session, username: str) -> dict:
+    """Counts for one user's outbox rows; ``done`` once nothing is left to retry (failed rows included)"""
+    O = models.RadicaleOutbox
+    failed = O.failed_at.isnot(None)
+    total, failed_count, retrying, last_error = db.query(
+        func.count(O.id),
+        func.coalesce(func.sum(case((failed, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((~failed & (O.attempts > 0), 1), else_=0)), 0),
+        func.max(O.last_error),
+    ).filter(O.username == username).one()
+    pending = total - failed_count
+    return {
+        "total": total, "pending": pending, "retrying": retrying, "failed": failed_count,
+        "last_error": last_error, "done": pending == 0,
+    }
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_BASE * 2 ** max(attempts - 1, 0), BACKOFF_MAX))
+
+
+def process_due(limit: int = BATCH_SIZE) -> int:
+    """Push up to ``limit`` due outbox rows. Returns how many were attempted."""
+    O = models.RadicaleOutbox
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        rows = (
+            db.query(O)
+            .filter(O.next_attempt_at <= now, O.failed_at.is_(None))
+            .order_by(O.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        # Rows are in id order, so the last one per UID is the newest action;
+        # older duplicates (from concurrent enqueues) are superseded by it.
+        latest = {}
+        for r in rows:
+            latest[(r.username, r.caldav_uid)] = r
+        for r in rows:
+            if latest[(r.username, r.caldav_uid)] is r:
+                r.next_attempt_at = now + LEASE
+            else:
+                db.delete(r)
+        claims = [(r.id, r.version, r.attempts, r.username, r.caldav_uid, r.action, r.payload) for r in latest.values()]
+        db.commit()
+
+        def push(claim):
+            _, _, _, username, uid, action, payload = claim
+            return _put(username, uid, payload) if action == "put" else _delete(username, uid)
+
+        # Pushes run concurrently (one per UID); results are written back from
+        # this thread since the session is not shared with the pushers.
+        for claim, error in zip(claims, _pushers.map(push, claims)):
+            row_id, version, attempts = claim[:3]
+            # A newer edit bumps version; leave that row for the next round.
+            current = db.query(O).filter(O.id == row_id, O.version == version)
+            if error is None:
+                current.delete(synchronize_session=False)
+            else:
+                failed = attempts + 1 >= MAX_ATTEMPTS
+                if failed:
+                    logger.warning(f"Giving up CalDAV {claim[5]} of {claim[4]} after {attempts + 1} attempts: {error}")
+                current.update({
+                    O.attempts: attempts + 1,
+                    O.next_attempt_at: datetime.utcnow() + _backoff(attempts + 1),
+                    O.last_error: error,
+                    O.failed_at: datetime.utcnow() if failed else None,
+                }, synchronize_session=False)
+            db.commit()
+        return len(claims)
+    finally:
+        db.close()
+
+
+# ─── Background worker ──────────────────────────────────────────────────────
+
+_wake = threading.Event()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def wake() -> None:
+    """Nudge the worker after committing new outbox rows"""
+    _wake.set()
+
+
+def _run() -> None:
+    while not _stop.is_set():
+        try:
+            attempted = process_due()
+        except Exception:
+            logger.exception("Radicale outbox worker failed")
+            attempted = 0
+        if attempted < BATCH_SIZE:
+            _wake.wait(POLL_INTERVAL)
+            _wake.clear()
+
+
+def start_worker() -> None:
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="radicale-outbox", daemon=True)
+    _thread.start()
+
+
+def stop_worker(timeout: float = 5.0) -> None:
+    _stop.set()
+    _wake.set()
+    if _thread is not None:
+        _thread.join(timeout)
@@ -2,32 +2,46 @@
 Auth Router - Login, Register, User Info
 """
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 from dependencies import get_current_user
 import models
 import schemas
-from auth import verify_password, get_password_hash, create_access_token
+from auth import create_access_token
+from password_pool import password_pool, PoolSaturated
 
 router = APIRouter()
 
 
+async def _run_hashing(job):
+    """Await a password_pool job, answering 503 when the pool is saturated"""
+    try:
+        return await job
+    except PoolSaturated:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress, please retry",
+            headers={"Retry-After": "1"}
+        )
+
+
 @router.post("/register", response_model=schemas.Token, status_code=status.HTTP_201_CREATED)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Register a new user"""
     # Check if username exists
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+    db_user = await db.scalar(select(models.User.id).where(models.User.username == user.username))
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
     # Check if email exists
     if user.email:
-        db_email = db.query(models.User).filter(models.User.email == user.email).first()
+        db_email = await db.scalar(select(models.User.id).where(models.User.email == user.email))
         if db_email:
             raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await _run_hashing(password_pool.hash(user.password))
     db_user = models.User(
         username=user.username,
         email=user.email,
@@ -35,8 +49,7 @@ def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
     
     # Create access token
     access_token = create_access_token(data={"sub": db_user.id})
@@ -45,11 +58,11 @@ def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
 
 
 @router.post("/login", response_model=schemas.Token)
-def login(user_credentials: schemas.UserLogin, db: Session = Depends(get_db)):
+async def login(user_credentials: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
     """Login and get access token"""
-    user = db.query(models.User).filter(
+    user = await db.scalar(select(models.User).where(
         models.User.username == user_credentials.username
-    ).first()
+    ))
     
     if not user:
         raise HTTPException(
@@ -57,11 +70,17 @@ def login(user_credentials: schemas.UserLogin, db: Session = Depends(get_db)):
             detail="Invalid credentials"
         )
     
-    if not verify_password(user_credentials.password, user.hashed_password):
+    valid, new_hash = await _run_hashing(password_pool.verify(user_credentials.password, user.hashed_password))
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
+
+    # Stored hash uses outdated argon2 parameters: upgrade it while we have the password
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     
     # Create access token
     access_token = create_access_token(data={"sub": str(user.id)})
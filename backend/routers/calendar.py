@@ -1,82 +1,27 @@
 """
-Calendar Router with automatic CalDAV sync to Radicale
+Calendar Router with automatic CalDAV sync to Radicale (via the outbox in radicale.py)
 """
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile, status
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import insert, update
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import date
-import uuid, models, schemas, logging, requests
-from requests.auth import HTTPBasicAuth
-from database import get_db
+import uuid, models, schemas, logging, ics, calendar_sync, versions, fast_json, query_audit
+from database import get_db, SessionLocal
 from dependencies import get_current_user
-from config import settings
+import radicale
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-# ─── Radicale config ────────────────────────────────────────────────────────
-RADICALE_INTERNAL = "http://127.0.0.1:5232"   # direct internal connection
-CALDAV_PASSWORD   = getattr(settings, "CALDAV_PASSWORD", "12345")
+IMPORT_BATCH     = 500          # events per INSERT/UPDATE round-trip and commit
+IMPORT_READ_SIZE = 64 * 1024    # bytes read from the upload per parser feed
 
 
-def _ics_content(event: models.CalendarEvent) -> str:
+def _ics_content(event) -> str:
     """Build a minimal VCALENDAR/VEVENT iCal string."""
-    uid  = event.caldav_uid or str(uuid.uuid4())
-    dts  = event.date.strftime("%Y%m%d")
-    desc = (event.description or "").replace("\n", "\\n")
-    return (
-        "BEGIN:VCALENDAR\r\n"
-        "VERSION:2.0\r\n"
-        "PRODID:-//PolyHub//Calendar//EN\r\n"
-        "CALSCALE:GREGORIAN\r\n"
-        "BEGIN:VEVENT\r\n"
-        f"UID:{uid}\r\n"
-        f"DTSTART;VALUE=DATE:{dts}\r\n"
-        f"SUMMARY:{event.title}\r\n"
-        f"DESCRIPTION:{desc}\r\n"
-        "END:VEVENT\r\n"
-        "END:VCALENDAR\r\n"
-    )
-
-
-def sync_to_radicale(username: str, event: models.CalendarEvent) -> bool:
-    """PUT a single event into Radicale. Returns True on success."""
-    uid  = event.caldav_uid or str(uuid.uuid4())
-    url  = f"{RADICALE_INTERNAL}/{username}/calendar/{uid}.ics"
-    ics  = _ics_content(event)
-    try:
-        r = requests.put(
-            url,
-            data=ics.encode("utf-8"),
-            auth=HTTPBasicAuth(username, CALDAV_PASSWORD),
-            headers={"Content-Type": "text/calendar; charset=utf-8"},
-            timeout=5,
-        )
-        if r.status_code in (201, 204):
-            logger.info(f"CalDAV sync OK: {url} → {r.status_code}")
-            return True
-        logger.warning(f"CalDAV sync failed: {url} → {r.status_code} {r.text[:200]}")
-        return False
-    except Exception as e:
-        logger.warning(f"CalDAV sync error: {e}")
-        return False
-
-
-def delete_from_radicale(username: str, caldav_uid: str) -> bool:
-    """DELETE an event from Radicale."""
-    url = f"{RADICALE_INTERNAL}/{username}/calendar/{caldav_uid}.ics"
-    try:
-        r = requests.delete(
-            url,
-            auth=HTTPBasicAuth(username, CALDAV_PASSWORD),
-            timeout=5,
-        )
-        logger.info(f"CalDAV delete: {url} → {r.status_code}")
-        return r.status_code in (200, 204, 404)
-    except Exception as e:
-        logger.warning(f"CalDAV delete error: {e}")
-        return False
+    return ics.calendar_object(event.caldav_uid or str(uuid.uuid4()), event.date, event.title, event.description)
 
 
 # ─── Endpoints ───────────────────────────────────────────────────────────────
@@ -94,65 +39,197 @@ def create_event(
         caldav_uid=uid,
     )
     db.add(db_event)
+    # Queue the Radicale push in the same transaction; the outbox worker sends it
+    radicale.enqueue_put(db, current_user.username, uid, _ics_content(db_event))
     db.commit()
     db.refresh(db_event)
-
-    # Sync to Radicale (non-blocking — failure doesn't break the response)
-    sync_to_radicale(current_user.username, db_event)
+    radicale.wake()
 
     return db_event
 
 
+@router.post("/batch", response_model=schemas.CalendarEventBatchResult)
+def batch_events(
+    batch: schemas.CalendarEventBatch,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Apply arrays of creates, updates and deletes in one transaction.
+
+    Rows are written with executemany/INSERT..RETURNING, and the Radicale
+    pushes for all of them are queued in the same commit. Created rows come
+    back in id order.
+    """
+    E = models.CalendarEvent
+    update_ids = [item.id for item in batch.update]
+    ids = update_ids + batch.delete
+    if ids:
+        owned = {event_id for (event_id,) in db.query(E.id).filter(E.user_id == current_user.id, E.id.in_(ids))}
+        missing = sorted(set(ids) - owned)
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Events not found: {missing}")
+
+    deleted_uids = []
+    if batch.delete:
+        deleted_uids = calendar_sync.delete_events(db, current_user.id, E.id.in_(batch.delete))
+        radicale.enqueue_deletes(db, current_user.username, deleted_uids)
+
+    created, updated = [], []
+    if batch.create or batch.update:
+        # Bulk statements skip the ORM hooks, so stamp the CalDAV sync revision here
+        revision = calendar_sync.next_revision(db, current_user.id)
+        updates = []
+        for item in batch.update:
+            fields = item.model_dump(exclude_unset=True, exclude={"id"})
+            if fields:
+                updates.append({**fields, "id": item.id, "sync_revision": revision})
+        if updates:
+            db.execute(update(E), updates)
+        if batch.create:
+            created = sorted(db.scalars(
+                insert(E).returning(E).execution_options(render_nulls=True),
+                [{**event.model_dump(), "user_id": current_user.id, "caldav_uid": str(uuid.uuid4()), "sync_revision": revision}
+                 for event in batch.create],
+            ).all(), key=lambda e: e.id)
+        if update_ids:
+            updated = db.query(E).filter(E.id.in_(update_ids)).order_by(E.id).all()
+        radicale.enqueue_puts(db, current_user.username, ((e.caldav_uid, _ics_content(e)) for e in created + updated if e.caldav_uid))
+
+    result = {
+        "created": [schemas.CalendarEventResponse.model_validate(e) for e in created],
+        "updated": [schemas.CalendarEventResponse.model_validate(e) for e in updated],
+        "deleted": len(batch.delete),
+    }
+    db.commit()
+    radicale.wake()
+    return result
+
+
 @router.get("/", response_model=List[schemas.CalendarEventResponse])
 def get_events(
+    request: Request,
+    response: Response,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    query = db.query(models.CalendarEvent).filter(
-        models.CalendarEvent.user_id == current_user.id
-    )
+    not_modified = versions.conditional_get(request, response, db, current_user.id, calendar_sync.RESOURCE)
+    if not_modified:
+        return not_modified
+    E = models.CalendarEvent
+    query = db.query(*fast_json.columns(E, schemas.CalendarEventResponse)).filter(E.user_id == current_user.id)
     if start_date:
-        query = query.filter(models.CalendarEvent.date >= start_date)
+        query = query.filter(E.date >= start_date)
     if end_date:
-        query = query.filter(models.CalendarEvent.date <= end_date)
-    return query.order_by(models.CalendarEvent.date.asc()).all()
+        query = query.filter(E.date <= end_date)
+    rows = query.order_by(E.date.asc()).all()
+    return fast_json.list_response([row._asdict() for row in rows], response)
+
+
+def _ics_stream(user_id: int, chunk_size: int = 500):
+    """Yield the VCALENDAR in pieces, reading events through a server-side cursor"""
+    E = models.CalendarEvent
+    db = SessionLocal()
+    try:
+        yield ics.CALENDAR_HEADER
+        rows = (
+            db.query(E.caldav_uid, E.date, E.title, E.description)
+            .filter(E.user_id == user_id)
+            .order_by(E.date, E.id)
+            .yield_per(chunk_size)
+        )
+        chunk = []
+        for e in rows:
+            chunk.append(ics.vevent(e.caldav_uid or str(uuid.uuid4()), e.date, e.title, e.description))
+            if len(chunk) >= chunk_size:
+                yield "".join(chunk)
+                chunk = []
+        chunk.append(ics.CALENDAR_FOOTER)
+        yield "".join(chunk)
+    finally:
+        db.close()
 
 
 @router.get("/export/ics")
 def export_ics(
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    events = db.query(models.CalendarEvent).filter(
-        models.CalendarEvent.user_id == current_user.id
-    ).all()
-
-    ics = (
-        "BEGIN:VCALENDAR\r\n"
-        "VERSION:2.0\r\n"
-        "PRODID:-//PolyHub//Calendar//EN\r\n"
-        "CALSCALE:GREGORIAN\r\n"
-    )
-    for e in events:
-        dts = e.date.strftime("%Y%m%d")
-        ics += (
-            "BEGIN:VEVENT\r\n"
-            f"UID:{e.caldav_uid or uuid.uuid4()}\r\n"
-            f"DTSTART;VALUE=DATE:{dts}\r\n"
-            f"SUMMARY:{e.title}\r\n"
-            "END:VEVENT\r\n"
-        )
-    ics += "END:VCALENDAR\r\n"
+    # Every event write bumps the calendar version (ORM flushes and bulk batches alike)
+    not_modified = versions.conditional_get(request, response, db, current_user.id, calendar_sync.RESOURCE)
+    if not_modified:
+        return not_modified
 
-    return Response(
-        content=ics,
+    return StreamingResponse(
+        _ics_stream(current_user.id),
         media_type="text/calendar",
-        headers={"Content-Disposition": "attachment; filename=polyhub-calendar.ics"},
+        headers={**response.headers, "Content-Disposition": "attachment; filename=polyhub-calendar.ics"},
     )
 
 
+def _import_batch(db: Session, user: models.User, batch: List[ics.ParsedEvent], totals: dict) -> None:
+    """Upsert one batch of parsed events by caldav_uid and queue their Radicale pushes"""
+    E = models.CalendarEvent
+    events = {}
+    for parsed in batch:
+        if parsed.date is None:
+            totals["skipped"] += 1
+            continue
+        events[parsed.uid or str(uuid.uuid4())] = parsed   # a repeated UID: the last one wins
+    if not events:
+        return
+
+    existing = {uid: (event_id, owner) for uid, event_id, owner in db.query(E.caldav_uid, E.id, E.user_id).filter(E.caldav_uid.in_(list(events)))}
+    # Bulk statements skip the ORM hooks, so stamp the CalDAV sync revision here
+    revision = calendar_sync.next_revision(db, user.id)
+    inserts, updates, pushes = [], [], []
+    for uid, parsed in events.items():
+        values = {"title": parsed.title, "description": parsed.description, "date": parsed.date, "priority": parsed.priority, "sync_revision": revision}
+        if uid not in existing:
+            inserts.append({**values, "user_id": user.id, "caldav_uid": uid})
+        elif existing[uid][1] == user.id:
+            updates.append({**values, "id": existing[uid][0]})
+        else:
+            totals["skipped"] += 1   # UID belongs to another user's event
+            continue
+        pushes.append((uid, ics.calendar_object(uid, parsed.date, parsed.title, parsed.description)))
+
+    if inserts:
+        db.execute(insert(E), inserts)
+    if updates:
+        db.execute(update(E), updates)
+    radicale.enqueue_puts(db, user.username, pushes)
+    db.commit()
+    totals["imported"] += len(inserts)
+    totals["updated"] += len(updates)
+
+
+@router.post("/import")
+def import_ics(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Import an .ics file; events whose UID already exists are updated instead of duplicated"""
+    query_audit.allow_repeats()   # a statement set per batch, by design
+    parser = ics.VEventParser()
+    totals = {"imported": 0, "updated": 0, "skipped": 0}
+    batch: List[ics.ParsedEvent] = []
+    while True:
+        chunk = file.file.read(IMPORT_READ_SIZE)
+        batch.extend(parser.feed(chunk) if chunk else parser.close())
+        while len(batch) >= IMPORT_BATCH or (not chunk and batch):
+            _import_batch(db, current_user, batch[:IMPORT_BATCH], totals)
+            batch = batch[IMPORT_BATCH:]
+        if not chunk:
+            break
+    radicale.wake()
+    return totals
+
+
 @router.delete("/{event_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_event(
     event_id: int,
@@ -166,34 +243,47 @@ def delete_event(
     if not event:
         raise HTTPException(status_code=404)
 
-    # Remove from Radicale first
     if event.caldav_uid:
-        delete_from_radicale(current_user.username, event.caldav_uid)
+        radicale.enqueue_delete(db, current_user.username, event.caldav_uid)
 
     db.delete(event)
     db.commit()
+    radicale.wake()
     return None
 
 
-@router.post("/sync-all", status_code=status.HTTP_200_OK)
+@router.post("/sync-all", status_code=status.HTTP_202_ACCEPTED)
 def sync_all_events(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    """Re-sync ALL events for this user to Radicale. Useful after setup."""
-    events = db.query(models.CalendarEvent).filter(
-        models.CalendarEvent.user_id == current_user.id
-    ).all()
-
-    ok, fail = 0, 0
-    for e in events:
-        if not e.caldav_uid:
-            e.caldav_uid = str(uuid.uuid4())
-            db.commit()
-            db.refresh(e)
-        if sync_to_radicale(current_user.username, e):
-            ok += 1
-        else:
-            fail += 1
+    """Re-sync ALL events for this user to Radicale. Useful after setup.
+
+    Queues every event in the outbox and returns immediately; poll
+    /sync-all/status for progress.
+    """
+    E = models.CalendarEvent
+    missing = db.query(E.id).filter(E.user_id == current_user.id, E.caldav_uid.is_(None)).all()
+    if missing:
+        # Bulk UPDATE skips the ORM hooks, so stamp the CalDAV sync revision here
+        revision = calendar_sync.next_revision(db, current_user.id)
+        db.execute(update(E), [
+            {"id": event_id, "caldav_uid": str(uuid.uuid4()), "sync_revision": revision}
+            for (event_id,) in missing
+        ])
+
+    events = db.query(E.caldav_uid, E.date, E.title, E.description).filter(E.user_id == current_user.id).all()
+    queued = radicale.enqueue_puts(db, current_user.username, ((e.caldav_uid, _ics_content(e)) for e in events))
+    db.commit()
+    radicale.wake()
 
-    return {"synced": ok, "failed": fail, "total": len(events)}
+    return {"queued": queued, "assigned_uids": len(missing), "status_url": "/api/calendar/sync-all/status"}
+
+
+@router.get("/sync-all/status")
+def sync_all_status(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Progress of pending Radicale pushes for this user; pushes that failed for good count as done"""
+    return radicale.outbox_status(db, current_user.username)
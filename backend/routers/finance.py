@@ -1,14 +1,143 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, extract, literal_column, select, insert, update, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from typing import List, Optional
 from decimal import Decimal
-import models, schemas
-from database import get_db
+from collections import defaultdict
+from datetime import date, datetime, timezone
+import models, schemas, versions, forecast, budgets, statement_import, fast_json, query_audit
+from database import get_db, get_async_db
 from dependencies import get_current_user
+from pagination import keyset_page, set_next_cursor
+from finance_util import month_start, is_month_end
 
 router = APIRouter()
 
+IMPORT_BATCH = 5000   # statement rows per INSERT/COPY round-trip and commit
+
+
+# ─── Monthly rollups ────────────────────────────────────────────────────────
+
+def _rollup_key_update(user_id: int, month: date, category_id: Optional[int], typ: str, total: Decimal, count: int):
+    """UPDATE adding ``total``/``count`` to one existing monthly rollup row"""
+    R = models.TransactionRollup
+    return (
+        update(R)
+        .where(
+            R.user_id == user_id,
+            R.month == month,
+            R.category_id == category_id,
+            R.type == typ,
+        )
+        .values(total=R.total + total, count=R.count + count)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _rollup_update(tr: models.Transaction, sign: int):
+    """UPDATE adding (sign=1) or removing (sign=-1) ``tr`` to/from its existing monthly rollup row"""
+    return _rollup_key_update(tr.user_id, month_start(tr.date), tr.category_id, tr.type, Decimal(tr.amount) * sign, sign)
+
+
+_INSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+ROLLUP_CHUNK = 500   # rollup keys per upsert statement
+
+
+def _rollup_upsert(dialect_name: str, rows: List[dict]):
+    """INSERT of rollup rows that adds to the existing row of the same key instead"""
+    R = models.TransactionRollup
+    stmt = _INSERTS[dialect_name](R).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[R.user_id, R.month, func.coalesce(R.category_id, literal_column("0")), R.type],   # uq_transaction_rollups_key
+        set_={"total": R.total + stmt.excluded.total, "count": R.count + stmt.excluded.count},
+    )
+
+
+def apply_rollup(db: Session, tr: models.Transaction, sign: int = 1) -> None:
+    """Add (sign=1) or remove (sign=-1) a transaction from its monthly rollup.
+
+    Runs inside the caller's DB transaction; the caller commits.
+    """
+    if sign < 0:
+        db.execute(_rollup_update(tr, sign))
+        return
+    db.execute(_rollup_upsert(db.get_bind().dialect.name, [{
+        "user_id": tr.user_id, "month": month_start(tr.date), "category_id": tr.category_id,
+        "type": tr.type, "total": Decimal(tr.amount), "count": 1,
+    }]))
+
+
+def add_rollup_delta(deltas: dict, day: date, category_id: Optional[int], typ: str, amount, sign: int) -> None:
+    """Accumulate one transaction into {(month, category_id, type): [total, count]}"""
+    delta = deltas[(month_start(day), category_id, typ)]
+    delta[0] += Decimal(amount) * sign
+    delta[1] += sign
+
+
+def apply_rollup_deltas(db: Session, user_id: int, deltas: dict) -> None:
+    """Apply summed changes {(month, category_id, type): [total, count]} to the rollups.
+
+    One multi-row upsert per ROLLUP_CHUNK keys adds each change to its key's
+    row, creating the rows that don't exist yet. The caller commits.
+    """
+    rows = [
+        {"user_id": user_id, "month": month, "category_id": category_id, "type": typ, "total": total, "count": count}
+        for (month, category_id, typ), (total, count) in deltas.items()
+        if total or count
+    ]
+    dialect_name = db.get_bind().dialect.name
+    for i in range(0, len(rows), ROLLUP_CHUNK):
+        db.execute(_rollup_upsert(dialect_name, rows[i:i + ROLLUP_CHUNK]))
+
+
+def merge_category_rollups(db: Session, user_id: int, category_id: int) -> None:
+    """Fold a category's rollup rows into the uncategorized ones, before the category is deleted"""
+    R = models.TransactionRollup
+    rows = db.query(R.month, R.type, R.total, R.count).filter(R.user_id == user_id, R.category_id == category_id).all()
+    db.query(R).filter(R.user_id == user_id, R.category_id == category_id).delete(synchronize_session=False)
+    apply_rollup_deltas(db, user_id, {(month, None, typ): [total, count] for month, typ, total, count in rows})
+
+
+def rebuild_rollups(db: Session, user_id: Optional[int] = None) -> int:
+    """Recompute rollups from the transactions table (all users or one). Returns rows written."""
+    T, R = models.Transaction, models.TransactionRollup
+    year, month = extract("year", T.date), extract("month", T.date)
+    query = db.query(T.user_id, T.category_id, T.type, year, month, func.sum(T.amount), func.count(T.id))
+    delete = db.query(R)
+    if user_id is not None:
+        query = query.filter(T.user_id == user_id)
+        delete = delete.filter(R.user_id == user_id)
+    delete.delete(synchronize_session=False)
+    rows = [
+        R(user_id=uid, category_id=cid, type=typ, month=date(int(y), int(m), 1), total=total, count=n)
+        for uid, cid, typ, y, m, total, n in query.group_by(T.user_id, T.category_id, T.type, year, month)
+    ]
+    db.add_all(rows)
+    db.commit()
+    return len(rows)
+
+
+def backfill_rollups(db: Session) -> None:
+    """Populate rollups once for databases that predate the rollup table."""
+    if db.query(models.TransactionRollup.id).first() is None and db.query(models.Transaction.id).first() is not None:
+        rebuild_rollups(db)
+
+
+def _covers_whole_months(start_date: Optional[date], end_date: Optional[date]) -> bool:
+    return (start_date is None or start_date.day == 1) and (end_date is None or is_month_end(end_date))
+
+
+def _totals_by_type(rows) -> dict:
+    totals = {"income": Decimal(0), "expense": Decimal(0)}
+    for typ, total in rows:
+        totals[typ] = totals.get(typ, Decimal(0)) + (total or Decimal(0))
+    return totals
+
 @router.post("/categories", response_model=schemas.CategoryResponse, status_code=status.HTTP_201_CREATED)
 def create_category(cat: schemas.CategoryCreate, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
     c = models.Category(**cat.model_dump(), user_id=cu.id)
@@ -18,63 +147,328 @@ def create_category(cat: schemas.CategoryCreate, db: Session = Depends(get_db),
     return c
 
 @router.get("/categories", response_model=List[schemas.CategoryResponse])
-def get_categories(db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+def get_categories(request: Request, response: Response, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    not_modified = versions.conditional_get(request, response, db, cu.id, "categories")
+    if not_modified:
+        return not_modified
     return db.query(models.Category).filter(models.Category.user_id == cu.id).all()
 
+@router.delete("/categories/{category_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_category(category_id: int, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    """Delete a category; its transactions become uncategorized and its budgets are deleted.
+
+    Done explicitly rather than through the foreign keys' SET NULL/CASCADE, so
+    the category's rollups are merged into the uncategorized ones instead of
+    turning into duplicate uncategorized rows.
+    """
+    C, T, B = models.Category, models.Transaction, models.Budget
+    if db.query(C.id).filter(C.id == category_id, C.user_id == cu.id).first() is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    merge_category_rollups(db, cu.id, category_id)
+    db.query(T).filter(T.category_id == category_id).update({T.category_id: None}, synchronize_session=False)
+    db.query(B).filter(B.category_id == category_id).delete(synchronize_session=False)
+    db.query(C).filter(C.id == category_id).delete(synchronize_session=False)
+    # Bulk statements skip the ORM hooks that bump these versions
+    conn = db.connection()
+    for resource in ("categories", forecast.RESOURCE, "budgets"):
+        versions.bump(conn, cu.id, resource)
+    db.commit()
+    return Response(status_code=204)
+
 @router.post("/transactions", response_model=schemas.TransactionResponse, status_code=status.HTTP_201_CREATED)
 def create_transaction(t: schemas.TransactionCreate, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
     tr = models.Transaction(**t.model_dump(), user_id=cu.id)
     db.add(tr)
+    apply_rollup(db, tr)
     db.commit()
     db.refresh(tr)
     return tr
 
+@router.post("/transactions/batch", response_model=schemas.TransactionBatchResult)
+def batch_transactions(batch: schemas.TransactionBatch, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    """Apply arrays of creates, updates and deletes in one transaction.
+
+    Rows are written with executemany/INSERT..RETURNING and the monthly
+    rollups are adjusted once per touched month/category/type. Created rows
+    come back in id order.
+    """
+    T = models.Transaction
+    update_ids = [item.id for item in batch.update]
+    ids = update_ids + batch.delete
+    old = {}
+    if ids:
+        old = {row.id: row for row in db.query(T.id, T.date, T.category_id, T.type, T.amount).filter(T.user_id == cu.id, T.id.in_(ids))}
+        missing = sorted(set(ids) - set(old))
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Transactions not found: {missing}")
+
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+
+    def count(row, sign: int) -> None:
+        add_rollup_delta(deltas, row["date"], row["category_id"], row["type"], row["amount"], sign)
+
+    updates = []
+    for item in batch.update:
+        fields = item.model_dump(exclude_unset=True, exclude={"id"})
+        if not fields:
+            continue
+        before = old[item.id]._asdict()
+        count(before, -1)
+        count({**before, **fields}, 1)
+        updates.append({**fields, "id": item.id})
+    if updates:
+        db.execute(update(T), updates)
+
+    if batch.delete:
+        for transaction_id in batch.delete:
+            count(old[transaction_id]._asdict(), -1)
+        db.execute(delete(T).where(T.id.in_(batch.delete)).execution_options(synchronize_session=False))
+
+    created = []
+    if batch.create:
+        rows = [{**t.model_dump(), "user_id": cu.id} for t in batch.create]
+        for row in rows:
+            count(row, 1)
+        # render_nulls: rows with and without a category_id stay in one INSERT batch
+        created = sorted(db.scalars(insert(T).returning(T).execution_options(render_nulls=True), rows).all(), key=lambda t: t.id)
+
+    apply_rollup_deltas(db, cu.id, deltas)
+    if ids or created:
+        versions.bump(db.connection(), cu.id, forecast.RESOURCE)
+
+    if created:
+        # Attach categories from one query instead of a lazy load per created row
+        categories = {c.id: c for c in db.query(models.Category).filter(models.Category.user_id == cu.id)}
+        for t in created:
+            set_committed_value(t, "category", categories.get(t.category_id))
+    updated = db.query(T).options(joinedload(T.category)).filter(T.id.in_(update_ids)).order_by(T.id).all() if update_ids else []
+    result = {
+        "created": [schemas.TransactionResponse.model_validate(t) for t in created],
+        "updated": [schemas.TransactionResponse.model_validate(t) for t in updated],
+        "deleted": len(batch.delete),
+    }
+    db.commit()
+    return result
+
 @router.get("/transactions", response_model=List[schemas.TransactionResponse])
-def get_transactions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
-    return db.query(models.Transaction).filter(models.Transaction.user_id == cu.id).order_by(models.Transaction.date.desc()).offset(skip).limit(limit).all()
+def get_transactions(request: Request, response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    # Rows embed their category, so category edits invalidate the list too
+    not_modified = versions.conditional_get(request, response, db, cu.id, forecast.RESOURCE, "categories")
+    if not_modified:
+        return not_modified
+    T, C = models.Transaction, models.Category
+    category_columns = [getattr(C, name).label(f"category__{name}") for name in _CATEGORY_FIELDS]
+    query = (
+        db.query(*fast_json.columns(T, schemas.TransactionResponse, exclude=("category",)), *category_columns)
+        .outerjoin(C, C.id == T.category_id)
+        .filter(T.user_id == cu.id)
+    )
+    rows, next_cursor = keyset_page(query, T.date, T.id, cursor, limit, skip=skip)
+    set_next_cursor(response, next_cursor)
+    return fast_json.list_response([_transaction_item(row) for row in rows], response)
+
+
+_CATEGORY_FIELDS = list(schemas.CategoryResponse.model_fields)
+
+
+def _transaction_item(row) -> dict:
+    """Row of get_transactions' query as TransactionResponse would serialize it"""
+    item = row._asdict()
+    category = {name: item.pop(f"category__{name}") for name in _CATEGORY_FIELDS}
+    item["category"] = category if category["id"] is not None else None
+    return item
+
+# ─── Statement import ───────────────────────────────────────────────────────
+
+async def _import_batch(db: AsyncSession, user_id: int, job: models.ImportJob, rows: list, mapper, hasher) -> None:
+    """Write one batch of statement rows, update rollups and job progress, and commit"""
+    values = [statement_import.to_values(user_id, row, mapper.category_for(row), hasher(row)) for row in rows]
+    inserted = await statement_import.write_batch(db, values)
+    if inserted:
+        deltas = defaultdict(lambda: [Decimal(0), 0])
+        for day, category_id, typ, amount in inserted:
+            add_rollup_delta(deltas, day, category_id, typ, amount, 1)
+
+        def sync_part(session: Session) -> None:
+            apply_rollup_deltas(session, user_id, deltas)
+            versions.bump(session.connection(), user_id, forecast.RESOURCE)
+
+        await db.run_sync(sync_part)
+    job.rows_read += len(rows)
+    job.imported += len(inserted)
+    job.duplicates += len(rows) - len(inserted)
+    await db.commit()
+
+
+async def _finish_import(db: AsyncSession, job: models.ImportJob, job_status: str, error: Optional[str] = None) -> None:
+    job.status = job_status
+    job.error = error
+    job.finished_at = datetime.now(timezone.utc)
+    await db.commit()
+
+
+@router.post("/import", response_model=schemas.ImportJobResponse)
+async def import_statement(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|ofx)$"),
+    filename: Optional[str] = None,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Import a CSV or OFX bank statement sent as the raw request body.
+
+    The body is parsed while it streams in and written in batches of
+    IMPORT_BATCH rows; rows imported before (same import_hash) are counted as
+    duplicates. Progress is committed per batch, so GET /import/jobs shows it
+    from other requests while the upload is still running.
+    """
+    query_audit.allow_repeats()   # a statement set per batch, by design
+    length = request.headers.get("content-length", "")
+    job = models.ImportJob(
+        user_id=current_user.id, filename=(filename or "")[:255] or None, format=format or "csv",
+        bytes_total=int(length) if length.isdigit() else None, bytes_read=0,
+        rows_read=0, imported=0, duplicates=0, skipped=0,
+    )
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+
+    mapper = await statement_import.CategoryMapper.load(db, current_user.id)
+    hasher = statement_import.RowHasher()
+    parser, batch = None, []
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            if parser is None:
+                job.format = format or statement_import.detect_format(chunk)
+                parser = statement_import.parser_for(job.format)
+            job.bytes_read += len(chunk)
+            batch.extend(await run_in_threadpool(parser.feed, chunk))
+            while len(batch) >= IMPORT_BATCH:
+                job.skipped = parser.skipped
+                await _import_batch(db, current_user.id, job, batch[:IMPORT_BATCH], mapper, hasher)
+                batch = batch[IMPORT_BATCH:]
+        if parser is None:
+            raise ValueError("Empty upload")
+        batch.extend(parser.close())
+        job.skipped = parser.skipped
+        await _import_batch(db, current_user.id, job, batch, mapper, hasher)
+    except ValueError as e:
+        await _finish_import(db, job, "failed", str(e))
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        await db.rollback()
+        await _finish_import(db, job, "failed", "Import interrupted")
+        raise
+    await _finish_import(db, job, "done")
+    return job
+
+
+@router.get("/import/jobs", response_model=List[schemas.ImportJobResponse])
+def get_import_jobs(limit: int = Query(20, ge=1, le=100), db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    J = models.ImportJob
+    return db.query(J).filter(J.user_id == cu.id).order_by(J.id.desc()).limit(limit).all()
+
+
+@router.get("/import/jobs/{job_id}", response_model=schemas.ImportJobResponse)
+def get_import_job(job_id: int, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    job = db.query(models.ImportJob).filter(models.ImportJob.id == job_id, models.ImportJob.user_id == cu.id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return job
+
 
 @router.get("/summary")
 async def get_summary(
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    query = db.query(models.Transaction).filter(models.Transaction.user_id == current_user.id)
-    
-    if start_date:
-        query = query.filter(models.Transaction.date >= start_date)
-    if end_date:
-        query = query.filter(models.Transaction.date <= end_date)
-    
-    transactions = query.all()
-    
-    # WICHTIG: Berechnung hinzufügen!
-    total_income = sum(float(t.amount) for t in transactions if t.type == "income")
-    total_expense = sum(float(t.amount) for t in transactions if t.type == "expense")
-    
+    # Whole-month ranges (the dashboard case) are answered from the rollups;
+    # anything else is aggregated in SQL over the transactions themselves.
+    if _covers_whole_months(start_date, end_date):
+        R = models.TransactionRollup
+        stmt = select(R.category_id, R.type, func.sum(R.total)).where(R.user_id == current_user.id)
+        if start_date:
+            stmt = stmt.where(R.month >= month_start(start_date))
+        if end_date:
+            stmt = stmt.where(R.month <= month_start(end_date))
+        stmt = stmt.group_by(R.category_id, R.type)
+    else:
+        T = models.Transaction
+        stmt = select(T.category_id, T.type, func.sum(T.amount)).where(T.user_id == current_user.id)
+        if start_date:
+            stmt = stmt.where(T.date >= start_date)
+        if end_date:
+            stmt = stmt.where(T.date <= end_date)
+        stmt = stmt.group_by(T.category_id, T.type)
+    by_category = (await db.execute(stmt)).all()
+
+    totals = _totals_by_type((typ, total) for _, typ, total in by_category)
+    total_income = float(totals["income"])
+    total_expense = float(totals["expense"])
+
     return {
         "total_income": total_income,
         "total_expense": total_expense,
-        "balance": total_income - total_expense
+        "balance": total_income - total_expense,
+        "by_category": [
+            {"category_id": cid, "type": typ, "total": float(total or 0)}
+            for cid, typ, total in by_category
+        ],
     }
 
+@router.get("/summary/monthly")
+def get_monthly_summary(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    R = models.TransactionRollup
+    query = db.query(R.month, R.type, func.sum(R.total)).filter(R.user_id == current_user.id)
+    if start_date:
+        query = query.filter(R.month >= month_start(start_date))
+    if end_date:
+        query = query.filter(R.month <= month_start(end_date))
+    months = {}
+    for month, typ, total in query.group_by(R.month, R.type).order_by(R.month):
+        row = months.setdefault(month, {"month": month.isoformat(), "income": 0.0, "expense": 0.0, "savings": 0.0})
+        row[typ] = float(total or 0)
+    for row in months.values():
+        row["balance"] = row["income"] - row["expense"]
+    return list(months.values())
+
+@router.get("/forecast")
+def get_forecast(
+    months: int = Query(24, ge=1, le=120),
+    daily: bool = False,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Projected balance from recurring (and scheduled) transactions over the next ``months`` months"""
+    result = forecast.forecast(db, current_user.id, months)
+    return result if daily else {k: v for k, v in result.items() if k != "daily"}
+
 @router.delete("/transactions/{transaction_id}", status_code=204)
 async def delete_transaction(
     transaction_id: int,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    transaction = db.query(models.Transaction).filter(
+    transaction = await db.scalar(select(models.Transaction).where(
         models.Transaction.id == transaction_id,
         models.Transaction.user_id == current_user.id
-    ).first()
+    ))
     
     if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
-    db.delete(transaction)
-    db.commit()
+    await db.execute(_rollup_update(transaction, -1))
+    await db.delete(transaction)
+    await db.commit()
     return Response(status_code=204)
 
 @router.post("/budgets", response_model=schemas.BudgetResponse, status_code=status.HTTP_201_CREATED)
@@ -86,9 +480,16 @@ def create_budget(b: schemas.BudgetCreate, db: Session = Depends(get_db), cu: mo
     return budget
 
 @router.get("/budgets", response_model=List[schemas.BudgetResponse])
-def get_budgets(db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+def get_budgets(request: Request, response: Response, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    not_modified = versions.conditional_get(request, response, db, cu.id, "budgets", "categories")
+    if not_modified:
+        return not_modified
     return db.query(models.Budget).filter(models.Budget.user_id == cu.id).all()
 
+@router.get("/budgets/status", response_model=schemas.BudgetStatusResponse)
+def get_budget_status(db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    return budgets.budget_status(db, cu.id)
+
 @router.post("/savings", response_model=schemas.SavingsGoalResponse, status_code=status.HTTP_201_CREATED)
 def create_savings(s: schemas.SavingsGoalCreate, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
     goal = models.SavingsGoal(**s.model_dump(), user_id=cu.id)
@@ -98,5 +499,8 @@ def create_savings(s: schemas.SavingsGoalCreate, db: Session = Depends(get_db),
     return goal
 
 @router.get("/savings", response_model=List[schemas.SavingsGoalResponse])
-def get_savings(db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+def get_savings(request: Request, response: Response, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    not_modified = versions.conditional_get(request, response, db, cu.id, "savings")
+    if not_modified:
+        return not_modified
     return db.query(models.SavingsGoal).filter(models.SavingsGoal.user_id == cu.id).all()
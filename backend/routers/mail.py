@@ -1,15 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Response, Query
+from fastapi.responses import FileResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from typing import List, Optional
-import models, schemas, imaplib, smtplib, email
+import models, schemas, mail_outbox, fast_json
+from mail_bodies import load_body
+from attachment_store import blob_store
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from datetime import datetime
 from database import get_db
 from dependencies import get_current_user
+from mail_sync import sync_folder
+from mail_poller import imap_pool
+from pagination import keyset_page, set_next_cursor
+import search
 
 router = APIRouter()
 
+SYNC_LOCK_TIMEOUT = 60   # seconds /sync waits for a running poller sync of the same account
+
 @router.post("/accounts", response_model=schemas.MailAccountResponse, status_code=status.HTTP_201_CREATED)
 def create_account(acc: schemas.MailAccountCreate, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
     db_acc = models.MailAccount(**acc.model_dump(), user_id=cu.id)
@@ -27,53 +36,92 @@ def sync_emails(account_id: int, limit: int = 50, db: Session = Depends(get_db),
     acc = db.query(models.MailAccount).filter(models.MailAccount.id == account_id, models.MailAccount.user_id == cu.id).first()
     if not acc:
         raise HTTPException(status_code=404)
+    lock = imap_pool.sync_lock(acc.id)
+    if not lock.acquire(timeout=SYNC_LOCK_TIMEOUT):
+        raise HTTPException(status_code=409, detail="A sync of this account is already running")
     try:
-        mail = imaplib.IMAP4_SSL(acc.imap_server, acc.imap_port) if acc.imap_use_ssl else imaplib.IMAP4(acc.imap_server, acc.imap_port)
-        mail.login(acc.email_address, acc.password)
-        mail.select("INBOX")
-        _, msgs = mail.search(None, 'ALL')
-        synced = 0
-        for num in msgs[0].split()[-limit:]:
-            _, data = mail.fetch(num, '(RFC822)')
-            msg = email.message_from_bytes(data[0][1])
-            mid = msg.get('Message-ID', '')
-            if db.query(models.Email).filter(models.Email.message_id == mid).first():
-                continue
-            db_email = models.Email(account_id=acc.id, message_id=mid, subject=msg.get('Subject', ''), sender=msg.get('From', ''), recipients=msg.get('To', ''), date=datetime.utcnow(), folder="INBOX", has_attachments=False, attachment_count=0)
-            db.add(db_email)
-            synced += 1
-        acc.last_sync = datetime.utcnow()
-        db.commit()
-        mail.close()
-        mail.logout()
+        with imap_pool.connection(acc) as conn:
+            synced = sync_folder(db, acc, conn, "INBOX", initial_limit=limit)
         return {"synced": synced}
+    except IntegrityError:
+        # the poller, running in another worker process, stored the same messages first
+        db.rollback()
+        raise HTTPException(status_code=409, detail="A sync of this account is already running")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        lock.release()
 
 @router.get("/emails", response_model=List[schemas.EmailResponse])
-def get_emails(account_id: Optional[int] = None, skip: int = 0, limit: int = 50, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
-    q = db.query(models.Email).join(models.MailAccount).filter(models.MailAccount.user_id == cu.id)
+def get_emails(response: Response, account_id: Optional[int] = None, skip: int = 0, limit: int = 50, cursor: Optional[str] = None, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    E = models.Email
+    # Only the list columns; the bodies are deferred and never read here
+    q = db.query(*fast_json.columns(E, schemas.EmailResponse)).join(models.MailAccount, models.MailAccount.id == E.account_id).filter(models.MailAccount.user_id == cu.id)
     if account_id:
         q = q.filter(models.Email.account_id == account_id)
-    return q.order_by(models.Email.date.desc()).offset(skip).limit(limit).all()
+    rows, next_cursor = keyset_page(q, models.Email.date, models.Email.id, cursor, limit, skip=skip)
+    set_next_cursor(response, next_cursor)
+    return fast_json.list_response([row._asdict() for row in rows], response)
+
+@router.get("/search", response_model=List[schemas.EmailSearchResult])
+def search_emails(response: Response, q: str = Query(..., min_length=1), account_id: Optional[int] = None, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    if not search.is_available():
+        raise HTTPException(status_code=503, detail="Search is not available")
+    rows, next_cursor = search.search_emails(db, cu.id, q, account_id, cursor, limit)
+    set_next_cursor(response, next_cursor)
+    return rows
+
+@router.get("/emails/{email_id}", response_model=schemas.EmailDetailResponse)
+def get_email(email_id: int, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    email = db.query(models.Email).join(models.MailAccount).filter(
+        models.Email.id == email_id, models.MailAccount.user_id == cu.id
+    ).first()
+    if not email:
+        raise HTTPException(status_code=404)
+    try:
+        body = load_body(db, email, imap_pool)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Could not fetch message body: {e}")
+    # Built from the list schema so the deferred body columns are never loaded here
+    return schemas.EmailDetailResponse(
+        **schemas.EmailResponse.model_validate(email).model_dump(),
+        cc=email.cc,
+        attachment_count=email.attachment_count or 0,
+        attachments=[schemas.EmailAttachmentResponse.model_validate(a) for a in email.attachments],
+        body_text=body["text"] if body else None,
+        body_html=body["html"] if body else None,
+    )
+
+@router.get("/attachments/{attachment_id}")
+def download_attachment(attachment_id: int, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    att = db.query(models.EmailAttachment).join(models.Email).join(models.MailAccount).filter(
+        models.EmailAttachment.id == attachment_id, models.MailAccount.user_id == cu.id
+    ).first()
+    if not att or not blob_store.exists(att.sha256):
+        raise HTTPException(status_code=404)
+    # Served from the blob file: sendfile where available, Range requests honoured
+    return FileResponse(blob_store.path(att.sha256), media_type=att.content_type, filename=att.filename)
 
-@router.post("/accounts/{account_id}/send")
+@router.post("/accounts/{account_id}/send", status_code=status.HTTP_202_ACCEPTED)
 def send_email(account_id: int, email_data: schemas.EmailSend, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
     acc = db.query(models.MailAccount).filter(models.MailAccount.id == account_id, models.MailAccount.user_id == cu.id).first()
     if not acc:
         raise HTTPException(status_code=404)
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = acc.email_address
-        msg['To'] = ', '.join(email_data.to)
-        msg['Subject'] = email_data.subject
-        msg.attach(MIMEText(email_data.body, 'html' if email_data.is_html else 'plain'))
-        smtp = smtplib.SMTP(acc.smtp_server, acc.smtp_port)
-        if acc.smtp_use_tls:
-            smtp.starttls()
-        smtp.login(acc.email_address, acc.password)
-        smtp.sendmail(acc.email_address, email_data.to, msg.as_string())
-        smtp.quit()
-        return {"message": "Email sent"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    msg = MIMEMultipart()
+    msg['From'] = acc.email_address
+    msg['To'] = ', '.join(email_data.to)
+    msg['Subject'] = email_data.subject
+    msg.attach(MIMEText(email_data.body, 'html' if email_data.is_html else 'plain'))
+    queued = mail_outbox.enqueue(db, acc, list(email_data.to), email_data.subject, msg.as_string())
+    db.commit()
+    mail_outbox.wake()
+    return {"message": "Email queued", "id": queued.id, "status": queued.status}
+
+@router.get("/outbox/{outgoing_id}", response_model=schemas.OutgoingEmailResponse)
+def get_outgoing_status(outgoing_id: int, db: Session = Depends(get_db), cu: models.User = Depends(get_current_user)):
+    out = db.query(models.OutgoingEmail).join(models.MailAccount).filter(
+        models.OutgoingEmail.id == outgoing_id, models.MailAccount.user_id == cu.id
+    ).first()
+    if not out:
+        raise HTTPException(status_code=404)
+    return out
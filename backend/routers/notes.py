@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from sqlalchemy import delete, insert, update
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from database import get_db
 from dependencies import get_current_user
-import models, schemas
+from pagination import keyset_page, set_next_cursor
+import search
+import uuid, models, schemas, calendar_sync, ics, radicale, versions
 
 router = APIRouter()
 
@@ -11,26 +14,152 @@ router = APIRouter()
 def create_note(note: schemas.NoteCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     db_note = models.Note(**note.model_dump(), user_id=current_user.id)
     db.add(db_note)
+    if note.in_calendar and note.deadline:
+        db.flush()   # assigns db_note.id; the note, its event and the Radicale push commit together
+        event = _deadline_event(current_user.id, db_note)
+        db.add(models.CalendarEvent(**event))
+        radicale.enqueue_put(db, current_user.username, event["caldav_uid"], _event_ics(event))
     db.commit()
     db.refresh(db_note)
     if note.in_calendar and note.deadline:
-        event = models.CalendarEvent(user_id=current_user.id, note_id=db_note.id, title=note.title, date=note.deadline, priority=note.priority)
-        db.add(event)
-        db.commit()
+        radicale.wake()
     return db_note
 
+def _deadline_event(user_id: int, note: models.Note) -> dict:
+    """Column values of the calendar event for a note's deadline"""
+    return {
+        "user_id": user_id, "note_id": note.id, "title": f"📝 {note.title}"[:255], "description": note.content[:200],
+        "date": note.deadline, "priority": note.priority, "caldav_uid": str(uuid.uuid4()),
+    }
+
+def _event_ics(event: dict) -> str:
+    return ics.calendar_object(event["caldav_uid"], event["date"], event["title"], event["description"])
+
+# Note fields that show up in (or decide about) the note's deadline event
+DEADLINE_EVENT_FIELDS = {"title", "content", "priority", "deadline", "in_calendar"}
+
+def _sync_deadline_events(db: Session, user: models.User, notes: List[models.Note]) -> bool:
+    """Bring the deadline events of already-flushed ``notes`` in line with them.
+
+    A note with in_calendar and a deadline gets its linked events updated, or
+    one created; any other note loses its linked events. Changes go through
+    the ORM so the CalDAV sync hooks see them, and the Radicale pushes are
+    queued in bulk. Returns True if anything was queued for Radicale.
+    """
+    if not notes:
+        return False
+    E = models.CalendarEvent
+    linked = {}
+    for event in db.query(E).filter(E.note_id.in_([n.id for n in notes])):
+        linked.setdefault(event.note_id, []).append(event)
+
+    puts, deletes = [], []
+    for note in notes:
+        events = linked.get(note.id, [])
+        if not (note.in_calendar and note.deadline):
+            deletes.extend(e.caldav_uid for e in events if e.caldav_uid)
+            for event in events:
+                db.delete(event)
+            continue
+        wanted = _deadline_event(user.id, note)
+        if not events:
+            db.add(E(**wanted))
+            puts.append((wanted["caldav_uid"], _event_ics(wanted)))
+        for event in events:
+            event.caldav_uid = event.caldav_uid or wanted["caldav_uid"]
+            for field in ("title", "description", "date", "priority"):
+                setattr(event, field, wanted[field])
+            puts.append((event.caldav_uid, _event_ics({**wanted, "caldav_uid": event.caldav_uid})))
+    radicale.enqueue_puts(db, user.username, puts)
+    radicale.enqueue_deletes(db, user.username, deletes)
+    return bool(puts or deletes)
+
+@router.post("/batch", response_model=schemas.NoteBatchResult)
+def batch_notes(batch: schemas.NoteBatch, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Apply arrays of creates, updates and deletes in one transaction.
+
+    Rows are written with executemany/INSERT..RETURNING rather than one ORM
+    object at a time; an id that isn't the user's rejects the whole batch.
+    Created rows come back in id order.
+    """
+    N = models.Note
+    update_ids = [item.id for item in batch.update]
+    ids = update_ids + batch.delete
+    if ids:
+        owned = {note_id for (note_id,) in db.query(N.id).filter(N.user_id == current_user.id, N.id.in_(ids))}
+        missing = sorted(set(ids) - owned)
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Notes not found: {missing}")
+
+    updates = []
+    for item in batch.update:
+        fields = item.model_dump(exclude_unset=True, exclude={"id"})
+        if fields:
+            updates.append({**fields, "id": item.id})
+    if updates:
+        db.execute(update(N), updates)
+
+    deleted = 0
+    if batch.delete:
+        # Bulk deletes skip the ORM hooks; tombstone the linked events explicitly for CalDAV clients
+        uids = calendar_sync.delete_events(db, current_user.id, models.CalendarEvent.note_id.in_(batch.delete))
+        radicale.enqueue_deletes(db, current_user.username, uids)
+        deleted = db.execute(delete(N).where(N.id.in_(batch.delete)).execution_options(synchronize_session=False)).rowcount
+
+    created = []
+    if batch.create:
+        created = sorted(db.scalars(
+            insert(N).returning(N).execution_options(render_nulls=True),
+            [{**note.model_dump(), "user_id": current_user.id} for note in batch.create],
+        ).all(), key=lambda n: n.id)
+        events = [_deadline_event(current_user.id, n) for n in created if n.in_calendar and n.deadline]
+        if events:
+            revision = calendar_sync.next_revision(db, current_user.id)
+            db.execute(insert(models.CalendarEvent), [{**e, "sync_revision": revision} for e in events])
+            radicale.enqueue_puts(db, current_user.username, ((e["caldav_uid"], _event_ics(e)) for e in events))
+
+    if updates or batch.delete or created:
+        # Bulk statements skip the ORM hooks that bump the notes version
+        versions.bump(db.connection(), current_user.id, "notes")
+    updated = db.query(N).filter(N.id.in_(update_ids)).order_by(N.id).all() if update_ids else []
+    changed_deadlines = {item.id for item in batch.update if DEADLINE_EVENT_FIELDS & item.model_fields_set}
+    _sync_deadline_events(db, current_user, [n for n in updated if n.id in changed_deadlines])
+    result = {
+        "created": [schemas.NoteResponse.model_validate(n) for n in created],
+        "updated": [schemas.NoteResponse.model_validate(n) for n in updated],
+        "deleted": deleted,
+    }
+    db.commit()
+    radicale.wake()
+    return result
+
+# Columns the list can be sorted by: the cursor compares row values, so only
+# columns that are never NULL (deadline and updated_at are left out)
+NOTE_SORT_COLUMNS = {"created_at": models.Note.created_at, "title": models.Note.title, "priority": models.Note.priority}
+
 @router.get("/", response_model=List[schemas.NoteResponse])
-def get_notes(skip: int = 0, limit: int = 100, priority: Optional[str] = None, is_archived: Optional[bool] = None, sort_by: str = "created_at", sort_order: str = "desc", db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_notes(request: Request, response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, priority: Optional[str] = None, is_archived: Optional[bool] = None, sort_by: str = "created_at", sort_order: str = "desc", db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    if sort_by not in NOTE_SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of: {', '.join(NOTE_SORT_COLUMNS)}")
+    not_modified = versions.conditional_get(request, response, db, current_user.id, "notes")
+    if not_modified:
+        return not_modified
     query = db.query(models.Note).filter(models.Note.user_id == current_user.id)
     if priority:
         query = query.filter(models.Note.priority == priority)
     if is_archived is not None:
         query = query.filter(models.Note.is_archived == is_archived)
-    if sort_order == "desc":
-        query = query.order_by(getattr(models.Note, sort_by).desc())
-    else:
-        query = query.order_by(getattr(models.Note, sort_by).asc())
-    return query.offset(skip).limit(limit).all()
+    rows, next_cursor = keyset_page(query, NOTE_SORT_COLUMNS[sort_by], models.Note.id, cursor, limit, descending=sort_order == "desc", skip=skip)
+    set_next_cursor(response, next_cursor)
+    return rows
+
+@router.get("/search", response_model=List[schemas.NoteSearchResult])
+def search_notes(response: Response, q: str = Query(..., min_length=1), limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    if not search.is_available():
+        raise HTTPException(status_code=503, detail="Search is not available")
+    rows, next_cursor = search.search_notes(db, current_user.id, q, cursor, limit)
+    set_next_cursor(response, next_cursor)
+    return rows
 
 @router.get("/{note_id}", response_model=schemas.NoteResponse)
 def get_note(note_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
@@ -44,10 +173,17 @@ def update_note(note_id: int, note_update: schemas.NoteUpdate, db: Session = Dep
     db_note = db.query(models.Note).filter(models.Note.id == note_id, models.Note.user_id == current_user.id).first()
     if not db_note:
         raise HTTPException(status_code=404, detail="Note not found")
-    for field, value in note_update.model_dump(exclude_unset=True).items():
+    fields = note_update.model_dump(exclude_unset=True)
+    for field, value in fields.items():
         setattr(db_note, field, value)
+    queued = False
+    if DEADLINE_EVENT_FIELDS & fields.keys():
+        db.flush()
+        queued = _sync_deadline_events(db, current_user, [db_note])
     db.commit()
     db.refresh(db_note)
+    if queued:
+        radicale.wake()
     return db_note
 
 @router.delete("/{note_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -55,6 +191,12 @@ def delete_note(note_id: int, db: Session = Depends(get_db), current_user: model
     db_note = db.query(models.Note).filter(models.Note.id == note_id, models.Note.user_id == current_user.id).first()
     if not db_note:
         raise HTTPException(status_code=404, detail="Note not found")
+    # Delete the note's events through the ORM (not just the FK cascade) so CalDAV clients see them go
+    for event in db.query(models.CalendarEvent).filter(models.CalendarEvent.note_id == db_note.id):
+        if event.caldav_uid:
+            radicale.enqueue_delete(db, current_user.username, event.caldav_uid)
+        db.delete(event)
     db.delete(db_note)
     db.commit()
+    radicale.wake()
     return None
@@ -1,15 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.responses import Response
 from sqlalchemy.orm import Session
 from typing import List
-import models, schemas
+import models, schemas, versions
 from database import get_db
 from dependencies import get_current_user
 
 router = APIRouter()
 
 @router.get("/", response_model=List[schemas.SavingsGoalResponse])
-def get_savings(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_savings(request: Request, response: Response, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    not_modified = versions.conditional_get(request, response, db, current_user.id, "savings")
+    if not_modified:
+        return not_modified
     return db.query(models.SavingsGoal).filter(models.SavingsGoal.user_id == current_user.id).order_by(models.SavingsGoal.created_at.desc()).all()
 
 @router.post("/", response_model=schemas.SavingsGoalResponse, status_code=status.HTTP_201_CREATED)
@@ -1,11 +1,38 @@
 """
 Pydantic Schemas for Request/Response Validation
 """
-from pydantic import BaseModel, EmailStr, Field
-from datetime import date, datetime
-from typing import Optional, List
+from pydantic import BaseModel, EmailStr, Field, model_validator
+from datetime import date, date as date_type, datetime
+from typing import ClassVar, Optional, List
 from decimal import Decimal
 
+# Largest array accepted per operation by the /batch endpoints
+BATCH_LIMIT = 5000
+
+
+class BatchBase(BaseModel):
+    """create/update/delete arrays applied in one transaction; subclasses type the arrays"""
+    @model_validator(mode="after")
+    def _distinct_ids(self):
+        ids = [item.id for item in self.update] + list(self.delete)
+        if len(set(ids)) != len(ids):
+            raise ValueError("an id may appear only once across update and delete")
+        return self
+
+
+class BatchUpdateItem(BaseModel):
+    """One /batch update: only the fields sent are changed, with the same
+    constraints as on create; NOT_NULL fields may be omitted but not sent as null"""
+    NOT_NULL: ClassVar[tuple] = ()
+    id: int
+
+    @model_validator(mode="after")
+    def _no_explicit_nulls(self):
+        nulls = [name for name in self.NOT_NULL if name in self.model_fields_set and getattr(self, name) is None]
+        if nulls:
+            raise ValueError(f"{', '.join(nulls)} may not be null")
+        return self
+
 
 # User Schemas
 class UserBase(BaseModel):
@@ -58,6 +85,34 @@ class NoteResponse(NoteBase):
     class Config:
         from_attributes = True
 
+class NoteBatchUpdate(BatchUpdateItem):
+    NOT_NULL = ("title", "content", "priority", "in_calendar", "is_archived")
+    title: Optional[str] = Field(None, min_length=1, max_length=255)
+    content: Optional[str] = Field(None, min_length=1)
+    priority: Optional[str] = Field(None, pattern="^(low|medium|high)$")
+    deadline: Optional[date] = None
+    in_calendar: Optional[bool] = None
+    is_archived: Optional[bool] = None
+
+class NoteBatch(BatchBase):
+    create: List[NoteCreate] = Field(default_factory=list, max_length=BATCH_LIMIT)
+    update: List[NoteBatchUpdate] = Field(default_factory=list, max_length=BATCH_LIMIT)
+    delete: List[int] = Field(default_factory=list, max_length=BATCH_LIMIT)
+
+class NoteBatchResult(BaseModel):
+    created: List[NoteResponse]
+    updated: List[NoteResponse]
+    deleted: int
+
+class NoteSearchResult(BaseModel):
+    id: int
+    title: str
+    priority: str
+    deadline: Optional[date] = None
+    created_at: datetime
+    rank: float
+    snippet: Optional[str] = None
+
 
 # Calendar Schemas
 class CalendarEventBase(BaseModel):
@@ -72,7 +127,7 @@ class CalendarEventCreate(CalendarEventBase):
 class CalendarEventUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
-    date: Optional[date] = None
+    date: Optional[date_type] = None   # a field named "date" shadows the type in the class body
     priority: Optional[str] = None
 
 class CalendarEventResponse(CalendarEventBase):
@@ -84,6 +139,23 @@ class CalendarEventResponse(CalendarEventBase):
     class Config:
         from_attributes = True
 
+class CalendarEventBatchUpdate(BatchUpdateItem):
+    NOT_NULL = ("title", "date", "priority")
+    title: Optional[str] = Field(None, min_length=1, max_length=255)
+    description: Optional[str] = None
+    date: Optional[date_type] = None
+    priority: Optional[str] = Field(None, pattern="^(low|medium|high)$")
+
+class CalendarEventBatch(BatchBase):
+    create: List[CalendarEventCreate] = Field(default_factory=list, max_length=BATCH_LIMIT)
+    update: List[CalendarEventBatchUpdate] = Field(default_factory=list, max_length=BATCH_LIMIT)
+    delete: List[int] = Field(default_factory=list, max_length=BATCH_LIMIT)
+
+class CalendarEventBatchResult(BaseModel):
+    created: List[CalendarEventResponse]
+    updated: List[CalendarEventResponse]
+    deleted: int
+
 
 # Category Schemas
 class CategoryBase(BaseModel):
@@ -125,7 +197,7 @@ class TransactionUpdate(BaseModel):
     title: Optional[str] = None
     amount: Optional[Decimal] = None
     type: Optional[str] = None
-    date: Optional[date] = None
+    date: Optional[date_type] = None
     category_id: Optional[int] = None
     is_recurring: Optional[bool] = None
     recurring_interval: Optional[str] = None
@@ -139,6 +211,44 @@ class TransactionResponse(TransactionBase):
     class Config:
         from_attributes = True
 
+class TransactionBatchUpdate(BatchUpdateItem):
+    NOT_NULL = ("title", "amount", "type", "date", "is_recurring")
+    title: Optional[str] = Field(None, min_length=1, max_length=255)
+    amount: Optional[Decimal] = Field(None, gt=0)
+    type: Optional[str] = Field(None, pattern="^(income|expense|savings)$")
+    date: Optional[date_type] = None
+    category_id: Optional[int] = None
+    is_recurring: Optional[bool] = None
+    recurring_interval: Optional[str] = None
+    notes: Optional[str] = None
+
+class TransactionBatch(BatchBase):
+    create: List[TransactionCreate] = Field(default_factory=list, max_length=BATCH_LIMIT)
+    update: List[TransactionBatchUpdate] = Field(default_factory=list, max_length=BATCH_LIMIT)
+    delete: List[int] = Field(default_factory=list, max_length=BATCH_LIMIT)
+
+class TransactionBatchResult(BaseModel):
+    created: List[TransactionResponse]
+    updated: List[TransactionResponse]
+    deleted: int
+
+class ImportJobResponse(BaseModel):
+    id: int
+    filename: Optional[str] = None
+    format: str
+    status: str
+    bytes_total: Optional[int] = None
+    bytes_read: int
+    rows_read: int
+    imported: int
+    duplicates: int
+    skipped: int
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
 class FinanceSummary(BaseModel):
     total_income: Decimal
     total_expense: Decimal
@@ -179,6 +289,15 @@ class BudgetResponse(BudgetBase):
     class Config:
         from_attributes = True
 
+class BudgetStatus(BudgetResponse):
+    period_start: date
+    period_end: date
+    alert: bool = False
+
+class BudgetStatusResponse(BaseModel):
+    budgets: List[BudgetStatus]
+    alerts: List[BudgetStatus]
+
 
 # Savings Schemas
 class SavingsGoalBase(BaseModel):
@@ -250,11 +369,35 @@ class EmailResponse(BaseModel):
     is_archived: bool
     folder: str
     has_attachments: bool
-    body_text: Optional[str] = None
     created_at: datetime
     class Config:
         from_attributes = True
 
+class EmailAttachmentResponse(BaseModel):
+    id: int
+    filename: str
+    content_type: str
+    size: int
+    class Config:
+        from_attributes = True
+
+class EmailDetailResponse(EmailResponse):
+    cc: Optional[str] = None
+    attachment_count: int = 0
+    attachments: List[EmailAttachmentResponse] = []
+    body_text: Optional[str] = None
+    body_html: Optional[str] = None
+
+class EmailSearchResult(BaseModel):
+    id: int
+    account_id: int
+    subject: Optional[str] = None
+    sender: str
+    date: datetime
+    is_read: bool
+    rank: float
+    snippet: Optional[str] = None
+
 class EmailSend(BaseModel):
     to: List[EmailStr]
     cc: Optional[List[EmailStr]] = None
@@ -263,6 +406,18 @@ class EmailSend(BaseModel):
     body: str
     is_html: bool = False
 
+class OutgoingEmailResponse(BaseModel):
+    id: int
+    account_id: int
+    subject: Optional[str] = None
+    status: str
+    attempts: int
+    last_error: Optional[str] = None
+    created_at: datetime
+    sent_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
 class EmailUpdate(BaseModel):
     is_read: Optional[bool] = None
     is_starred: Optional[bool] = None
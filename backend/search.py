@@ -0,0 +1,200 @@
+"""
+Full-text search over notes and emails
+
+PostgreSQL: each table gets a generated ``search_vector`` tsvector column
+with a GIN index, queried with websearch_to_tsquery and ranked by
+ts_rank_cd; snippets come from ts_headline, computed only for the rows of
+the returned page.
+
+SQLite: each table gets an FTS5 external-content shadow table
+(``notes_fts``/``emails_fts``) kept current by triggers, ranked by bm25()
+with snippet() highlights.
+
+Results are ordered by (rank, id) descending and paged with the same opaque
+cursors as the list endpoints (see pagination.py).
+
+Snippets are returned as HTML: the database marks matches with private-use
+sentinel characters, the text is escaped, and only then are the sentinels
+replaced with <mark> tags, so markup in notes or email subjects is shown as
+text rather than rendered.
+"""
+import html
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Float, literal_column, text
+from sqlalchemy.orm import Session
+
+from database import engine
+from pagination import decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_STOP = "</mark>"
+# What the database wraps matches in; swapped for the tags after escaping
+_START_SENTINEL = "\ue000"
+_STOP_SENTINEL = "\ue001"
+
+_RANK = literal_column("rank", Float)
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# table -> (indexed columns, snippet column)
+_INDEXED = {
+    "notes": (("title", "content"), "content"),
+    "emails": (("subject", "sender", "recipients"), "subject"),
+}
+
+_available = False
+
+
+def _setup_postgres(conn) -> None:
+    for table, (columns, _) in _INDEXED.items():
+        document = " || ' ' || ".join(f"coalesce({c}, '')" for c in columns)
+        conn.execute(text(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('simple', {document})) STORED"
+        ))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_search ON {table} USING GIN (search_vector)"))
+
+
+def _setup_sqlite(conn) -> None:
+    for table, (columns, _) in _INDEXED.items():
+        fts = f"{table}_fts"
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": fts}).first()
+        cols = ", ".join(columns)
+        new_cols = ", ".join(f"new.{c}" for c in columns)
+        old_cols = ", ".join(f"old.{c}" for c in columns)
+        conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', content_rowid='id')"))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"
+        ))
+        if not exists:
+            conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+def setup_search() -> None:
+    """Create the search columns/indexes (Postgres) or FTS5 tables and triggers (SQLite)"""
+    global _available
+    try:
+        with engine.begin() as conn:
+            if engine.dialect.name == "postgresql":
+                _setup_postgres(conn)
+            elif engine.dialect.name == "sqlite":
+                _setup_sqlite(conn)
+            else:
+                logger.warning(f"Full-text search not supported on {engine.dialect.name}")
+                return
+        _available = True
+    except Exception as e:
+        logger.warning(f"Full-text search setup failed: {e}")
+
+
+def is_available() -> bool:
+    return _available
+
+
+def _fts5_query(q: str) -> str:
+    """Quote every word so user input can't use (or break) FTS5 query syntax; last word matches as a prefix"""
+    words = _WORD.findall(q)
+    if not words:
+        return ""
+    quoted = [f'"{w}"' for w in words]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _snippet_html(snippet: Optional[str]) -> Optional[str]:
+    """Escaped ``snippet`` with the sentinel-marked matches wrapped in <mark>"""
+    if snippet is None:
+        return None
+    escaped = html.escape(snippet, quote=False)
+    return escaped.replace(_START_SENTINEL, HIGHLIGHT_START).replace(_STOP_SENTINEL, HIGHLIGHT_STOP)
+
+
+def _page(db: Session, inner_sql: str, outer_sql: str, params: dict, cursor: Optional[str], limit: int) -> Tuple[List[dict], Optional[str]]:
+    keyset = ""
+    if cursor:
+        rank, row_id = decode_cursor(cursor, _RANK)
+        keyset = "WHERE (m.rank < :cursor_rank OR (m.rank = :cursor_rank AND m.id < :cursor_id))"
+        params = {**params, "cursor_rank": rank, "cursor_id": row_id}
+    sql = outer_sql.format(page=f"SELECT * FROM ({inner_sql}) m {keyset} ORDER BY m.rank DESC, m.id DESC LIMIT :limit")
+    rows = [dict(r) for r in db.execute(text(sql), {**params, "limit": limit + 1}).mappings()]
+    for row in rows:
+        row["snippet"] = _snippet_html(row["snippet"])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]["rank"], rows[-1]["id"])
+
+
+def search_notes(db: Session, user_id: int, q: str, cursor: Optional[str], limit: int) -> Tuple[List[dict], Optional[str]]:
+    """Ranked note matches for ``q`` with highlighted content snippets"""
+    if engine.dialect.name == "postgresql":
+        inner = (
+            "SELECT n.id, ts_rank_cd(n.search_vector, query)::float8 AS rank "
+            "FROM notes n, websearch_to_tsquery('simple', :q) query "
+            "WHERE n.user_id = :user_id AND n.search_vector @@ query"
+        )
+        outer = (
+            "SELECT p.id, n.title, n.priority, n.deadline, n.created_at, p.rank, "
+            "ts_headline('simple', n.content, websearch_to_tsquery('simple', :q), "
+            f"'StartSel={_START_SENTINEL}, StopSel={_STOP_SENTINEL}, MaxFragments=2, MaxWords=20, MinWords=5') AS snippet "
+            "FROM ({page}) p JOIN notes n ON n.id = p.id ORDER BY p.rank DESC, p.id DESC"
+        )
+        params = {"q": q, "user_id": user_id}
+    else:
+        inner = (
+            "SELECT n.id, n.title, n.priority, n.deadline, n.created_at, -bm25(notes_fts) AS rank, "
+            f"snippet(notes_fts, 1, '{_START_SENTINEL}', '{_STOP_SENTINEL}', '…', 16) AS snippet "
+            "FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid "
+            "WHERE notes_fts MATCH :q AND n.user_id = :user_id"
+        )
+        outer = "{page}"
+        params = {"q": _fts5_query(q), "user_id": user_id}
+        if not params["q"]:
+            return [], None
+    return _page(db, inner, outer, params, cursor, limit)
+
+
+def search_emails(db: Session, user_id: int, q: str, account_id: Optional[int], cursor: Optional[str], limit: int) -> Tuple[List[dict], Optional[str]]:
+    """Ranked email matches for ``q`` across the user's accounts, with highlighted subjects"""
+    account_filter = " AND e.account_id = :account_id" if account_id else ""
+    if engine.dialect.name == "postgresql":
+        inner = (
+            "SELECT e.id, ts_rank_cd(e.search_vector, query)::float8 AS rank "
+            "FROM emails e JOIN mail_accounts a ON a.id = e.account_id, websearch_to_tsquery('simple', :q) query "
+            f"WHERE a.user_id = :user_id AND e.search_vector @@ query{account_filter}"
+        )
+        outer = (
+            "SELECT p.id, e.account_id, e.subject, e.sender, e.date, e.is_read, p.rank, "
+            "ts_headline('simple', coalesce(e.subject, '') || ' — ' || e.sender, websearch_to_tsquery('simple', :q), "
+            f"'StartSel={_START_SENTINEL}, StopSel={_STOP_SENTINEL}, HighlightAll=true') AS snippet "
+            "FROM ({page}) p JOIN emails e ON e.id = p.id ORDER BY p.rank DESC, p.id DESC"
+        )
+        params = {"q": q, "user_id": user_id}
+    else:
+        inner = (
+            "SELECT e.id, e.account_id, e.subject, e.sender, e.date, e.is_read, -bm25(emails_fts) AS rank, "
+            f"highlight(emails_fts, 0, '{_START_SENTINEL}', '{_STOP_SENTINEL}') AS snippet "
+            "FROM emails_fts JOIN emails e ON e.id = emails_fts.rowid JOIN mail_accounts a ON a.id = e.account_id "
+            f"WHERE emails_fts MATCH :q AND a.user_id = :user_id{account_filter}"
+        )
+        outer = "{page}"
+        params = {"q": _fts5_query(q), "user_id": user_id}
+        if not params["q"]:
+            return [], None
+    if account_id:
+        params["account_id"] = account_id
+    return _page(db, inner, outer, params, cursor, limit)
@@ -0,0 +1,440 @@
+"""
+Bank-statement import (CSV and OFX) into transactions
+
+The upload is parsed as it arrives: ``CsvParser``/``OfxParser`` are fed
+raw bytes in arbitrary chunks (like ics.VEventParser) and return each
+statement row once it is complete, so memory stays flat no matter how
+long the statement is.
+
+Every row gets an ``import_hash`` over its date, signed amount and
+normalized title (plus its position among identical rows of the same
+day), stored under a unique (user_id, import_hash) index. Importing an
+overlapping or identical statement again therefore inserts only the rows
+that are new.
+
+Rows are written in batches: on Postgres (asyncpg) they are COPYed into a
+temporary staging table and moved over with one INSERT .. SELECT .. ON
+CONFLICT DO NOTHING; elsewhere a multi-row INSERT .. ON CONFLICT DO NOTHING
+does the same. Either way RETURNING yields the rows actually inserted, so
+the caller can maintain the monthly rollups.
+"""
+import csv
+import hashlib
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+
+FORMATS = ("csv", "ofx")
+MAX_RECORD_BYTES = 64 * 1024   # longer CSV records/OFX blocks are dropped, keeping memory bounded
+
+_INSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+_COLUMNS = ("user_id", "category_id", "title", "amount", "type", "date", "is_recurring", "notes", "import_hash")
+
+
+@dataclass
+class StatementRow:
+    date: date
+    amount: Decimal              # signed: negative is money going out
+    title: str
+    category: Optional[str] = None
+    notes: Optional[str] = None
+
+
+def detect_format(head: bytes) -> str:
+    """OFX (1.x SGML or 2.x XML) or CSV, judged from the first bytes of the upload"""
+    probe = head[:1024].lstrip(b"\xef\xbb\xbf \t\r\n").upper()
+    return "ofx" if probe.startswith(b"OFXHEADER") or b"<OFX>" in probe or b"<?OFX" in probe else "csv"
+
+
+def _decode(raw: bytes) -> str:
+    # Banks export UTF-8 or Windows-1252 depending on the bank and the year
+    try:
+        return raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return raw.decode("cp1252", errors="replace")
+
+
+def parse_amount(value: str) -> Optional[Decimal]:
+    """Accepts 1234.56, 1,234.56, 1.234,56, -12,5, 12.50- and currency suffixes"""
+    value = re.sub(r"[^\d,.\-+]", "", value.strip())
+    if value.endswith("-"):
+        value = "-" + value[:-1]
+    if "," in value and "." in value:
+        # whichever separator comes last is the decimal point
+        value = value.replace(".", "").replace(",", ".") if value.rfind(",") > value.rfind(".") else value.replace(",", "")
+    elif "," in value:
+        value = value.replace(",", ".") if len(value) - value.rfind(",") <= 3 else value.replace(",", "")
+    try:
+        return Decimal(value).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return None
+
+
+_DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d.%m.%y", "%Y%m%d")
+_SLASH_DATE = re.compile(r"^\s*(\d{1,2})/(\d{1,2})/\d{4}\s*$")
+
+
+def slash_day_first(value: str) -> Optional[bool]:
+    """For a dd/mm/yyyy or mm/dd/yyyy date, whether it can only be day-first (True) or month-first (False); None if it could be either or isn't one"""
+    match = _SLASH_DATE.match(value)
+    if not match:
+        return None
+    first, second = int(match.group(1)), int(match.group(2))
+    if first > 12 >= second:
+        return True
+    if second > 12 >= first:
+        return False
+    return None
+
+
+def parse_date(value: str, day_first: bool = True) -> Optional[date]:
+    """``day_first`` decides between %d/%m/%Y and %m/%d/%Y; other formats are unambiguous"""
+    value = value.strip()
+    slash = ("%d/%m/%Y", "%m/%d/%Y") if day_first else ("%m/%d/%Y", "%d/%m/%Y")
+    for fmt in _DATE_FORMATS + slash:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+# ─── CSV ─────────────────────────────────────────────────────────────────────
+
+# Header names (lower-cased) per field; English plus the usual German bank exports
+CSV_COLUMNS = {
+    "date": ("date", "booking date", "transaction date", "datum", "buchungstag", "buchungsdatum", "valuta", "wertstellung"),
+    "amount": ("amount", "value", "betrag", "umsatz", "betrag (eur)", "amount (eur)"),
+    "title": ("title", "description", "payee", "name", "beguenstigter/zahlungspflichtiger", "empfänger", "auftraggeber/empfänger", "verwendungszweck", "buchungstext", "memo"),
+    "category": ("category", "kategorie"),
+    "notes": ("notes", "note", "memo", "verwendungszweck", "reference", "referenz"),
+}
+
+
+class CsvParser:
+    """Incremental CSV reader: ``feed`` bytes, collect the rows each call completes.
+
+    The delimiter (, ; or tab) is sniffed from the header line and columns
+    are found by header name. Unparseable and zero-amount rows are counted
+    in ``skipped``.
+
+    Slash dates are read as day/month or month/day for the whole file: rows
+    are held back until one date settles the order (a day above 12), or
+    until DATE_ORDER_SAMPLE rows left it open, which reads them day-first.
+    """
+
+    DATE_ORDER_SAMPLE = 200
+
+    def __init__(self):
+        self._partial = b""
+        self._record: List[bytes] = []   # physical lines of a record with an open quote
+        self._columns: Optional[Dict[str, int]] = None
+        self._delimiter = ","
+        self._day_first: Optional[bool] = None
+        self._undecided: List[List[str]] = []   # rows with slash dates, waiting for _day_first
+        self.skipped = 0
+
+    def feed(self, data: bytes) -> List[StatementRow]:
+        rows: List[StatementRow] = []
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        if len(self._partial) > MAX_RECORD_BYTES:
+            self._partial = b""
+            self.skipped += 1
+        for line in lines:
+            self._physical_line(line, rows)
+        return rows
+
+    def close(self) -> List[StatementRow]:
+        rows: List[StatementRow] = []
+        if self._partial:
+            self._physical_line(self._partial, rows)
+            self._partial = b""
+        if self._record:
+            self._logical_line(b"\n".join(self._record), rows)
+            self._record = []
+        if self._undecided:
+            self._decide_date_order(True, rows)
+        if self._columns is None:
+            raise ValueError("No header row with date and amount columns found")
+        return rows
+
+    def _physical_line(self, line: bytes, rows: List[StatementRow]) -> None:
+        # A record continues onto the next line while it has an unbalanced quote
+        self._record.append(line)
+        record = b"\n".join(self._record)
+        if record.count(b'"') % 2:
+            if len(record) > MAX_RECORD_BYTES:
+                self._record = []
+                self.skipped += 1
+            return
+        self._record = []
+        self._logical_line(record, rows)
+
+    def _logical_line(self, record: bytes, rows: List[StatementRow]) -> None:
+        text_line = _decode(record.rstrip(b"\r"))
+        if not text_line.strip():
+            return
+        if self._columns is None:
+            self._header(text_line)
+            return
+        fields = next(csv.reader([text_line], delimiter=self._delimiter))
+        if self._day_first is None and _SLASH_DATE.match(self._field(fields, "date")):
+            day_first = slash_day_first(self._field(fields, "date"))
+            self._undecided.append(fields)
+            if day_first is not None or len(self._undecided) >= self.DATE_ORDER_SAMPLE:
+                self._decide_date_order(day_first is not False, rows)
+            return
+        self._add_row(fields, rows)
+
+    def _decide_date_order(self, day_first: bool, rows: List[StatementRow]) -> None:
+        self._day_first = day_first
+        undecided, self._undecided = self._undecided, []
+        for fields in undecided:
+            self._add_row(fields, rows)
+
+    def _add_row(self, fields: List[str], rows: List[StatementRow]) -> None:
+        row = self._row(fields)
+        if row is None:
+            self.skipped += 1
+        else:
+            rows.append(row)
+
+    def _header(self, line: str) -> None:
+        self._delimiter = max((";", ",", "\t"), key=line.count)
+        names = [name.strip().lower() for name in next(csv.reader([line], delimiter=self._delimiter))]
+        columns = {}
+        for field, aliases in CSV_COLUMNS.items():
+            for alias in aliases:
+                if alias in names and names.index(alias) not in columns.values():
+                    columns[field] = names.index(alias)
+                    break
+        if "date" not in columns or "amount" not in columns:
+            # Banks often put an account summary above the table; keep looking for the header
+            return
+        self._columns = columns
+
+    def _field(self, fields: List[str], name: str) -> str:
+        index = self._columns.get(name)
+        return fields[index].strip() if index is not None and index < len(fields) else ""
+
+    def _row(self, fields: List[str]) -> Optional[StatementRow]:
+        def field(name: str) -> str:
+            return self._field(fields, name)
+
+        day = parse_date(field("date"), day_first=self._day_first is not False)
+        amount = parse_amount(field("amount"))
+        if day is None or not amount:   # None, or a zero amount that is neither income nor expense
+            return None
+        return StatementRow(
+            date=day,
+            amount=amount,
+            title=field("title") or field("notes") or "Imported transaction",
+            category=field("category") or None,
+            notes=field("notes") or None,
+        )
+
+
+# ─── OFX ─────────────────────────────────────────────────────────────────────
+
+_OFX_TAG = re.compile(r"<([A-Z0-9.]+)>([^<\r\n]*)", re.IGNORECASE)
+
+
+class OfxParser:
+    """Incremental OFX reader for both SGML (1.x) and XML (2.x) statements.
+
+    Only the <STMTTRN> aggregates are looked at; everything between them is
+    discarded as soon as it has been scanned.
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self.skipped = 0
+
+    def feed(self, data: bytes) -> List[StatementRow]:
+        rows: List[StatementRow] = []
+        buffer = self._buffer + data
+        upper, pos = buffer.upper(), 0
+        while True:
+            start = upper.find(b"<STMTTRN>", pos)
+            if start < 0:
+                pos = max(pos, len(buffer) - 16)   # keep a possibly split opening tag
+                break
+            end = upper.find(b"</STMTTRN>", start)
+            if end < 0:
+                pos = start
+                if len(buffer) - start > MAX_RECORD_BYTES:
+                    pos = len(buffer)
+                    self.skipped += 1
+                break
+            row = self._row(_decode(buffer[start + 9:end]))
+            if row is None:
+                self.skipped += 1
+            else:
+                rows.append(row)
+            pos = end + 10
+        self._buffer = buffer[pos:]
+        return rows
+
+    def close(self) -> List[StatementRow]:
+        self._buffer = b""
+        return []
+
+    @staticmethod
+    def _row(block: str) -> Optional[StatementRow]:
+        tags = {}
+        for name, value in _OFX_TAG.findall(block):
+            tags.setdefault(name.upper(), value.strip())
+        day = parse_date(tags.get("DTPOSTED", "")[:8])
+        amount = parse_amount(tags.get("TRNAMT", ""))
+        if day is None or not amount:
+            return None
+        name, memo = tags.get("NAME", ""), tags.get("MEMO", "")
+        return StatementRow(date=day, amount=amount, title=name or memo or "Imported transaction", notes=memo if name and memo else None)
+
+
+def parser_for(fmt: str):
+    return OfxParser() if fmt == "ofx" else CsvParser()
+
+
+# ─── Categories and dedupe ──────────────────────────────────────────────────
+
+def _normalize(title: str) -> str:
+    return " ".join(title.lower().split())
+
+
+class CategoryMapper:
+    """Picks a category for imported rows.
+
+    In order: a category column naming one of the user's categories, the
+    category the user most often gave earlier transactions with the same
+    title, and a category whose name appears in the title.
+    """
+
+    def __init__(self, categories: List[Tuple[int, str]], history: Dict[str, int]):
+        self._by_name = {_normalize(name): category_id for category_id, name in categories}
+        self._history = history
+        self._in_title = sorted(self._by_name.items(), key=lambda item: -len(item[0]))
+
+    @classmethod
+    async def load(cls, db: AsyncSession, user_id: int) -> "CategoryMapper":
+        C, T = models.Category, models.Transaction
+        categories = (await db.execute(select(C.id, C.name).where(C.user_id == user_id))).all()
+        counts = (await db.execute(
+            select(func.lower(T.title), T.category_id, func.count())
+            .where(T.user_id == user_id, T.category_id.isnot(None))
+            .group_by(func.lower(T.title), T.category_id)
+        )).all()
+        history, best = {}, {}
+        for title, category_id, n in counts:
+            key = _normalize(title)
+            if n > best.get(key, 0):
+                history[key], best[key] = category_id, n
+        return cls(categories, history)
+
+    def category_for(self, row: StatementRow) -> Optional[int]:
+        if row.category and _normalize(row.category) in self._by_name:
+            return self._by_name[_normalize(row.category)]
+        title = _normalize(row.title)
+        if title in self._history:
+            return self._history[title]
+        for name, category_id in self._in_title:
+            if name and name in title:
+                return category_id
+        return None
+
+
+class RowHasher:
+    """Stable import_hash per row.
+
+    Identical rows on the same day (two equal coffees) are told apart by
+    their position among those rows. Positions are tracked for the most
+    recent TRACKED_DAYS dates only, which covers any statement ordered by
+    date (or spanning about a year in any order) while keeping memory
+    bounded; re-reading the same file always reproduces the same hashes.
+    """
+
+    TRACKED_DAYS = 400
+
+    def __init__(self):
+        self._days: "OrderedDict[date, Dict[str, int]]" = OrderedDict()
+
+    def __call__(self, row: StatementRow) -> str:
+        seen = self._days.get(row.date)
+        if seen is None:
+            seen = self._days[row.date] = {}
+            if len(self._days) > self.TRACKED_DAYS:
+                self._days.popitem(last=False)
+        else:
+            self._days.move_to_end(row.date)
+        key = f"{row.date.isoformat()}|{row.amount:.2f}|{_normalize(row.title)}"
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        return hashlib.sha256(f"{key}|{occurrence}".encode()).hexdigest()
+
+
+def to_values(user_id: int, row: StatementRow, category_id: Optional[int], import_hash: str) -> dict:
+    return {
+        "user_id": user_id,
+        "category_id": category_id,
+        "title": row.title[:255],
+        "amount": abs(row.amount),
+        "type": "expense" if row.amount < 0 else "income",
+        "date": row.date,
+        "is_recurring": False,
+        "notes": row.notes,
+        "import_hash": import_hash,
+    }
+
+
+# ─── Writing ─────────────────────────────────────────────────────────────────
+
+async def _copy_batch(db: AsyncSession, values: List[dict]) -> list:
+    """COPY into a per-connection staging table, then move the new rows over"""
+    T = models.Transaction
+    conn = await db.connection()
+    raw = (await conn.get_raw_connection()).driver_connection
+    columns = ", ".join(_COLUMNS)
+    await conn.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS transaction_import_stage ON COMMIT DELETE ROWS "
+        f"AS SELECT {columns} FROM transactions WITH NO DATA"
+    ))
+    await raw.copy_records_to_table(
+        "transaction_import_stage",
+        records=[tuple(v[c] for c in _COLUMNS) for v in values],
+        columns=list(_COLUMNS),
+    )
+    result = await conn.execute(text(
+        f"INSERT INTO transactions ({columns}) SELECT {columns} FROM transaction_import_stage "
+        "ON CONFLICT (user_id, import_hash) DO NOTHING "
+        "RETURNING date, category_id, type, amount"
+    ).columns(T.date, T.category_id, T.type, T.amount))
+    rows = result.all()
+    await conn.execute(text("TRUNCATE transaction_import_stage"))
+    return rows
+
+
+async def write_batch(db: AsyncSession, values: List[dict]) -> list:
+    """Insert ``values``, skipping already imported hashes; returns (date, category_id, type, amount) of new rows"""
+    if not values:
+        return []
+    T = models.Transaction
+    dialect = db.bind.dialect
+    if dialect.name == "postgresql" and dialect.driver == "asyncpg":
+        return await _copy_batch(db, values)
+    stmt = (
+        _INSERTS[dialect.name](T.__table__)
+        .on_conflict_do_nothing(index_elements=["user_id", "import_hash"])
+        .returning(T.date, T.category_id, T.type, T.amount)
+    )
+    return (await db.execute(stmt, values)).all()
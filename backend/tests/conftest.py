@@ -0,0 +1,36 @@
+"""
+Shared fixtures: the app on a throwaway SQLite database, with the query
+audit in strict mode so a repeated statement fails the test.
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+_tmp = tempfile.mkdtemp(prefix="prohub-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
+os.environ.setdefault("SECRET_KEY", "tests")
+os.environ["MAIL_POLLER_ENABLED"] = "false"
+os.environ["QUERY_AUDIT_STRICT"] = "true"
+os.environ["MAIL_BODY_CACHE_DIR"] = f"{_tmp}/bodies"
+os.environ["MAIL_ATTACHMENT_DIR"] = f"{_tmp}/attachments"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture(scope="session")
+def client():
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def auth(client):
+    """Authorization headers of a fresh user"""
+    credentials = {"username": f"user-{uuid.uuid4().hex[:12]}", "password": "secret-password"}
+    assert client.post("/api/auth/register", json=credentials).status_code == 201
+    token = client.post("/api/auth/login", json=credentials).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,73 @@
+"""Attachment download one message at a time, the flags it sets, and the blob sweep"""
+import os
+import time
+import uuid
+from datetime import datetime
+from email.message import EmailMessage
+
+import pytest
+
+from attachment_store import blob_store, collect_garbage
+from database import SessionLocal
+import mail_sync
+import models
+
+
+def _raw_message(payload: bytes = None) -> bytes:
+    message = EmailMessage()
+    message["Subject"] = "report"
+    message.set_content("see attached")
+    if payload is not None:
+        message.add_attachment(payload, maintype="application", subtype="octet-stream", filename="report.bin")
+    return message.as_bytes()
+
+
+class FakeImap:
+    def __init__(self, messages):
+        self.messages = messages
+        self.fetches = []
+
+    def uid(self, command, uid_set, items):
+        self.fetches.append(uid_set)
+        uid = int(uid_set)
+        return "OK", [(f"1 (UID {uid} BODY[] {{{len(self.messages[uid])}}}".encode(), self.messages[uid]), b")"]
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+def test_attachments_are_fetched_one_message_per_command(db):
+    user = models.User(username=f"att-{uuid.uuid4().hex[:12]}", hashed_password="x")
+    db.add(user)
+    db.flush()
+    acc = models.MailAccount(user_id=user.id, email_address="me@example.com", provider="custom",
+                             imap_server="imap.example.com", smtp_server="smtp.example.com", password="x")
+    db.add(acc)
+    db.flush()
+    rows = [{"message_id": f"<{uuid.uuid4()}@example.com>", "imap_uid": uid} for uid in (7, 8, 9, 10)]
+    db.add_all([models.Email(account_id=acc.id, sender="a@example.com", date=datetime(2026, 1, 1), **row) for row in rows])
+    db.flush()
+    conn = FakeImap({**{uid: _raw_message(f"payload {uid}".encode()) for uid in (7, 8, 9)}, 10: _raw_message()})
+
+    assert mail_sync._fetch_attachments(db, conn, rows) == 3
+    assert conn.fetches == ["7", "8", "9", "10"]
+    # The flags come from the stored parts: uid 10 looked worth fetching but had none
+    flags = db.query(models.Email.imap_uid, models.Email.has_attachments, models.Email.attachment_count).filter_by(account_id=acc.id)
+    assert sorted(flags) == [(7, True, 1), (8, True, 1), (9, True, 1), (10, False, 0)]
+    db.rollback()
+
+
+def test_garbage_collection_removes_only_unreferenced_old_blobs(db):
+    kept, orphan, fresh = (blob_store.put(f"{name} {uuid.uuid4()}".encode()) for name in ("kept", "orphan", "fresh"))
+    db.add(models.EmailAttachment(email_id=0, filename="a", content_type="text/plain", size=1, sha256=kept))
+    db.commit()
+    old = time.time() - 2 * 3600
+    for sha256 in (kept, orphan):
+        os.utime(blob_store.path(sha256), (old, old))
+
+    assert collect_garbage(db) == 1
+    assert [blob_store.exists(h) for h in (kept, orphan, fresh)] == [True, False, True]
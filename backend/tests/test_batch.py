@@ -0,0 +1,121 @@
+"""
+/batch endpoints: update items are validated like creates
+"""
+import pytest
+
+
+def _transaction(client, auth, **fields):
+    body = {"title": "Groceries", "amount": "12.50", "type": "expense", "date": "2026-03-01", **fields}
+    response = client.post("/api/finance/transactions", json=body, headers=auth)
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+
+def _note(client, auth, **fields):
+    response = client.post("/api/notes/", json={"title": "Report", "content": "Write it", **fields}, headers=auth)
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+def _event(client, auth):
+    response = client.post("/api/calendar/", json={"title": "Meeting", "date": "2026-03-02"}, headers=auth)
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+
+@pytest.mark.parametrize("fields", [
+    {"amount": None},
+    {"amount": "-5"},
+    {"amount": "0"},
+    {"type": "bogus"},
+    {"type": None},
+    {"title": None},
+    {"title": ""},
+    {"date": None},
+    {"is_recurring": None},
+])
+def test_transaction_batch_update_rejects_invalid_fields(client, auth, fields):
+    transaction_id = _transaction(client, auth)
+    response = client.post("/api/finance/transactions/batch", json={"update": [{"id": transaction_id, **fields}]}, headers=auth)
+    assert response.status_code == 422
+    assert client.get("/api/finance/transactions", headers=auth).json()[0]["amount"] == "12.50"
+
+
+def test_transaction_batch_update_keeps_nullable_fields_nullable(client, auth):
+    transaction_id = _transaction(client, auth, notes="paid cash")
+    response = client.post("/api/finance/transactions/batch", json={"update": [{"id": transaction_id, "notes": None, "amount": "20"}]}, headers=auth)
+    assert response.status_code == 200, response.text
+    updated = response.json()["updated"][0]
+    assert updated["notes"] is None and updated["amount"] == "20.00"
+
+
+@pytest.mark.parametrize("fields", [
+    {"title": None}, {"title": ""}, {"content": None}, {"priority": "urgent"}, {"priority": None},
+    {"in_calendar": None}, {"is_archived": None},
+])
+def test_note_batch_update_rejects_invalid_fields(client, auth, fields):
+    note_id = _note(client, auth)["id"]
+    response = client.post("/api/notes/batch", json={"update": [{"id": note_id, **fields}]}, headers=auth)
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("fields", [{"title": None}, {"date": None}, {"priority": None}, {"priority": "urgent"}])
+def test_event_batch_update_rejects_invalid_fields(client, auth, fields):
+    event_id = _event(client, auth)
+    response = client.post("/api/calendar/batch", json={"update": [{"id": event_id, **fields}]}, headers=auth)
+    assert response.status_code == 422
+
+
+def _deadline_events(client, auth):
+    return [e for e in client.get("/api/calendar/", headers=auth).json() if e["note_id"] is not None]
+
+
+def test_note_batch_update_syncs_deadline_event(client, auth):
+    note = _note(client, auth, deadline="2026-04-01", in_calendar=True)
+    assert [e["date"] for e in _deadline_events(client, auth)] == ["2026-04-01"]
+
+    update = {"id": note["id"], "title": "Final report", "deadline": "2026-04-15"}
+    assert client.post("/api/notes/batch", json={"update": [update]}, headers=auth).status_code == 200
+    [event] = _deadline_events(client, auth)
+    assert (event["title"], event["date"]) == ("📝 Final report", "2026-04-15")
+
+    update = {"id": note["id"], "in_calendar": False}
+    assert client.post("/api/notes/batch", json={"update": [update]}, headers=auth).status_code == 200
+    assert _deadline_events(client, auth) == []
+
+    update = {"id": note["id"], "in_calendar": True}
+    assert client.post("/api/notes/batch", json={"update": [update]}, headers=auth).status_code == 200
+    assert [e["date"] for e in _deadline_events(client, auth)] == ["2026-04-15"]
+
+
+def test_note_update_syncs_deadline_event(client, auth):
+    note = _note(client, auth, deadline="2026-05-01", in_calendar=True)
+    assert client.put(f"/api/notes/{note['id']}", json={"deadline": "2026-05-03"}, headers=auth).status_code == 200
+    assert [e["date"] for e in _deadline_events(client, auth)] == ["2026-05-03"]
+    assert client.put(f"/api/notes/{note['id']}", json={"deadline": None}, headers=auth).status_code == 200
+    assert _deadline_events(client, auth) == []
+
+
+def _summary_by_category(client, auth, **params):
+    body = client.get("/api/finance/summary", params=params, headers=auth).json()
+    return sorted((c["category_id"] or 0, c["type"], round(c["total"], 2)) for c in body["by_category"] if c["total"])
+
+
+def test_transaction_batch_across_many_months_keeps_rollups_in_sync(client, auth):
+    # One rollup row per month: strict query audit fails the request if rollups are updated row by row
+    months = [f"{2020 + i // 12}-{i % 12 + 1:02d}-15" for i in range(30)]
+    create = [{"title": f"Rent {d}", "amount": "100", "type": "expense", "date": d} for d in months]
+    response = client.post("/api/finance/transactions/batch", json={"create": create}, headers=auth)
+    assert response.status_code == 200, response.text
+    created = response.json()["created"]
+
+    response = client.post("/api/finance/transactions/batch", json={"create": create}, headers=auth)
+    assert response.status_code == 200, response.text
+    update = [{"id": t["id"], "amount": "150", "date": "2019-06-01"} for t in created[:10]]
+    delete = [t["id"] for t in created[10:15]]
+    response = client.post("/api/finance/transactions/batch", json={"update": update, "delete": delete}, headers=auth)
+    assert response.status_code == 200, response.text
+
+    from_rollups = _summary_by_category(client, auth)
+    from_transactions = _summary_by_category(client, auth, start_date="2000-01-01", end_date="2099-12-30")
+    assert from_rollups == from_transactions == [(0, "expense", 100 * 45 + 150 * 10)]
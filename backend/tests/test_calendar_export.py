@@ -0,0 +1,24 @@
+"""The .ics export ETag changes with every calendar write, bulk batches included"""
+from tests.test_batch import _event
+
+
+def _export(client, auth, etag=None):
+    headers = {**auth, **({"If-None-Match": etag} if etag else {})}
+    return client.get("/api/calendar/export/ics", headers=headers)
+
+
+def test_batch_edit_invalidates_the_export_etag(client, auth):
+    event_id = _event(client, auth)
+    first = _export(client, auth)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert _export(client, auth, etag).status_code == 304
+
+    # Same count, and the edit may land within the same second as the create
+    response = client.post("/api/calendar/batch", json={"update": [{"id": event_id, "title": "Moved"}]}, headers=auth)
+    assert response.status_code == 200, response.text
+
+    second = _export(client, auth, etag)
+    assert second.status_code == 200
+    assert second.headers["ETag"] != etag
+    assert "SUMMARY:Moved" in second.text
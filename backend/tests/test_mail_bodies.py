@@ -0,0 +1,34 @@
+"""Legacy bodies move into the cache without loading the deferred columns onto the email"""
+import uuid
+from datetime import datetime
+
+from sqlalchemy import inspect
+
+from database import SessionLocal
+from mail_bodies import load_body
+import models
+
+
+def test_legacy_body_is_moved_to_the_cache():
+    db = SessionLocal()
+    try:
+        user = models.User(username=f"body-{uuid.uuid4().hex[:12]}", hashed_password="x")
+        db.add(user)
+        db.flush()
+        acc = models.MailAccount(user_id=user.id, email_address="me@example.com", provider="custom",
+                                 imap_server="imap.example.com", smtp_server="smtp.example.com", password="x")
+        db.add(acc)
+        db.flush()
+        db.add(models.Email(account_id=acc.id, message_id=f"<{uuid.uuid4()}@example.com>", sender="a@example.com",
+                            date=datetime(2026, 1, 1), body_text="hello", body_html="<p>hello</p>"))
+        db.commit()
+        account_id = acc.id
+        db.expunge_all()
+        email = db.query(models.Email).filter_by(account_id=account_id).one()
+
+        assert load_body(db, email, pool=None) == {"text": "hello", "html": "<p>hello</p>"}
+        assert "body_text" not in inspect(email).dict
+        assert db.query(models.Email.body_text, models.Email.body_html).filter_by(id=email.id).one() == (None, None)
+        assert load_body(db, email, pool=None) == {"text": "hello", "html": "<p>hello</p>"}   # now from the cache
+    finally:
+        db.close()
@@ -0,0 +1,98 @@
+"""Outbox claiming: each row is delivered once and only its claimant records the outcome"""
+import json
+import smtplib
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import SessionLocal
+import mail_outbox
+import models
+
+
+@pytest.fixture
+def account_id():
+    db = SessionLocal()
+    try:
+        user = models.User(username=f"outbox-{uuid.uuid4().hex[:12]}", hashed_password="x")
+        db.add(user)
+        db.flush()
+        acc = models.MailAccount(
+            user_id=user.id, email_address="me@example.com", provider="custom",
+            imap_server="imap.example.com", smtp_server="smtp.example.com", password="x",
+        )
+        db.add(acc)
+        db.commit()
+        yield acc.id
+        db.delete(user)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _queue(account_id: int, *recipients: str) -> int:
+    db = SessionLocal()
+    try:
+        row = models.OutgoingEmail(
+            account_id=account_id, recipients=json.dumps(list(recipients)), subject="s", message="m",
+            status="queued", next_attempt_at=datetime.utcnow() - timedelta(seconds=1),
+        )
+        db.add(row)
+        db.commit()
+        return row.id
+    finally:
+        db.close()
+
+
+def _row(row_id: int) -> models.OutgoingEmail:
+    db = SessionLocal()
+    try:
+        return db.get(models.OutgoingEmail, row_id)
+    finally:
+        db.close()
+
+
+def test_concurrent_worker_does_not_send_a_claimed_row_again(monkeypatch, account_id):
+    first, second = _queue(account_id, "a@example.com"), _queue(account_id, "b@example.com")
+    sent = []
+
+    def deliver(acc, recipients, message):
+        sent.extend(recipients)
+        if len(sent) == 1:
+            mail_outbox.process_due()   # a second worker polling while this delivery is in flight
+        return {}
+
+    monkeypatch.setattr(mail_outbox, "_deliver", deliver)
+    mail_outbox.process_due()
+    assert sorted(sent) == ["a@example.com", "b@example.com"]
+    assert [_row(first).status, _row(second).status] == ["sent", "sent"]
+
+
+def test_outcome_is_dropped_once_the_row_was_reclaimed(monkeypatch, account_id):
+    row_id = _queue(account_id, "a@example.com")
+
+    def deliver(acc, recipients, message):
+        # the lease ran out mid-send and the row went back to the queue
+        db = SessionLocal()
+        try:
+            db.query(models.OutgoingEmail).filter_by(id=row_id).update({"next_attempt_at": datetime.utcnow()})
+            db.commit()
+            mail_outbox.requeue_stale_sending(db)
+        finally:
+            db.close()
+        raise smtplib.SMTPServerDisconnected("gone")
+
+    monkeypatch.setattr(mail_outbox, "_deliver", deliver)
+    mail_outbox.process_due(limit=1)
+    row = _row(row_id)
+    assert (row.status, row.last_error) == ("retrying", None)
+
+
+def test_refused_recipients_are_recorded(monkeypatch, account_id):
+    row_id = _queue(account_id, "a@example.com", "b@example.com")
+    monkeypatch.setattr(mail_outbox, "_deliver", lambda acc, recipients, message: {"b@example.com": (550, b"No such user")})
+    mail_outbox.process_due()
+    row = _row(row_id)
+    assert row.status == "sent"
+    assert row.last_error == "Refused recipients: b@example.com: 550 No such user"
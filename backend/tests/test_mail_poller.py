@@ -0,0 +1,62 @@
+"""ImapPool idle cap and the per-account sync lock"""
+from types import SimpleNamespace
+
+import mail_poller
+from mail_poller import ImapPool
+from routers import mail as mail_router
+
+
+class FakeImap:
+    state = "AUTH"
+
+    def __init__(self):
+        self.logged_out = False
+
+    def noop(self):
+        return "OK", [b""]
+
+    def logout(self):
+        self.logged_out = True
+
+
+def _account(account_id: int):
+    return SimpleNamespace(id=account_id, imap_server="imap.example.com", imap_port=993, imap_use_ssl=True,
+                           email_address=f"u{account_id}@example.com", password="x")
+
+
+def _sync(monkeypatch, pool: ImapPool, account_id: int) -> FakeImap:
+    conn = FakeImap()
+    monkeypatch.setattr(mail_poller, "open_imap", lambda acc: conn)
+    with pool.connection(_account(account_id)):
+        pass
+    return conn
+
+
+def test_idle_connections_over_the_cap_evict_the_least_recently_used(monkeypatch):
+    pool = ImapPool(max_in_use=4, max_idle=2, max_idle_seconds=600)
+    first, second = _sync(monkeypatch, pool, 1), _sync(monkeypatch, pool, 2)
+    with pool.connection(_account(1)):   # reuses and refreshes account 1
+        pass
+    third = _sync(monkeypatch, pool, 3)
+    assert [first.logged_out, second.logged_out, third.logged_out] == [False, True, False]
+
+
+def test_idle_watchers_count_against_the_cap(monkeypatch):
+    pool = ImapPool(max_in_use=4, max_idle=2, max_idle_seconds=600)
+    cached = _sync(monkeypatch, pool, 1)
+    assert pool.reserve_watcher() and pool.reserve_watcher()
+    assert cached.logged_out
+    assert not pool.reserve_watcher()
+    assert _sync(monkeypatch, pool, 2).logged_out   # no room left to cache it
+    pool.release_watcher()
+    assert not _sync(monkeypatch, pool, 3).logged_out
+
+
+def test_manual_sync_waits_for_a_running_sync_of_the_account(client, auth, monkeypatch):
+    account = {"email_address": "me@example.com", "provider": "custom", "imap_server": "imap.example.com",
+               "smtp_server": "smtp.example.com", "password": "x"}
+    account_id = client.post("/api/mail/accounts", json=account, headers=auth).json()["id"]
+    monkeypatch.setattr(mail_router, "SYNC_LOCK_TIMEOUT", 0.01)
+    with mail_poller.imap_pool.sync_lock(account_id):
+        response = client.post(f"/api/mail/accounts/{account_id}/sync", headers=auth)
+    assert response.status_code == 409
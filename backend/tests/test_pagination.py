@@ -0,0 +1,64 @@
+"""Cursor pagination walks every row exactly once, also across equal sort values"""
+from sqlalchemy import text
+
+from database import SessionLocal
+from tests.test_batch import _note, _transaction
+
+
+def _walk(client, auth, path, limit, **params):
+    pages, cursor = [], None
+    for _ in range(20):   # a cursor that repeats a page would loop forever
+        query = {"limit": limit, **params, **({"cursor": cursor} if cursor else {})}
+        response = client.get(path, params=query, headers=auth)
+        assert response.status_code == 200, response.text
+        pages.append([row["title"] for row in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+    raise AssertionError(f"cursor never ran out: {pages[:3]}")
+
+
+def _set_created_at(note_ids, value):
+    db = SessionLocal()
+    try:
+        for note_id in note_ids:
+            db.execute(text("UPDATE notes SET created_at = :value WHERE id = :id"), {"value": value, "id": note_id})
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_notes_created_in_the_same_second_page_through(client, auth):
+    ids = [_note(client, auth, title=f"n{i}")["id"] for i in (1, 2, 3)]
+    _set_created_at(ids, "2026-01-01 10:00:00")   # CURRENT_TIMESTAMP format, no fraction
+
+    assert _walk(client, auth, "/api/notes/", 2) == [["n3", "n2"], ["n1"]]
+    assert _walk(client, auth, "/api/notes/", 2, sort_order="asc") == [["n1", "n2"], ["n3"]]
+
+
+def test_notes_with_mixed_timestamp_formats_page_through(client, auth):
+    ids = [_note(client, auth, title=f"n{i}")["id"] for i in (1, 2, 3, 4)]
+    _set_created_at(ids[:2], "2026-01-01 10:00:00")
+    _set_created_at(ids[2:], "2026-01-01 10:00:00.000000")
+
+    titles = [t for page in _walk(client, auth, "/api/notes/", 1) for t in page]
+    assert sorted(titles) == ["n1", "n2", "n3", "n4"]
+
+
+def test_notes_sorted_by_title_page_through(client, auth):
+    for title in ("b", "a", "c", "a"):
+        _note(client, auth, title=title)
+    assert _walk(client, auth, "/api/notes/", 3, sort_by="title", sort_order="asc") == [["a", "a", "b"], ["c"]]
+
+
+def test_notes_reject_nullable_sort_columns(client, auth):
+    assert client.get("/api/notes/", params={"sort_by": "deadline"}, headers=auth).status_code == 400
+
+
+def test_transactions_on_the_same_date_page_through(client, auth):
+    for i in range(5):
+        _transaction(client, auth, title=f"t{i}", date="2026-03-01")
+    _transaction(client, auth, title="later", date="2026-03-02")
+
+    pages = _walk(client, auth, "/api/finance/transactions", 2)
+    assert pages == [["later", "t4"], ["t3", "t2"], ["t1", "t0"]]
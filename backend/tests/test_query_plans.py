@@ -0,0 +1,134 @@
+"""
+Query-plan regression check: every SELECT a read endpoint issues must reach
+its rows through an index, never a full scan of a table.
+
+The statements of each request are captured on both engines and run through
+EXPLAIN QUERY PLAN against a seeded user with a few months of data.
+"""
+import re
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+from database import engine, async_engine, Base, SessionLocal
+import models
+from routers import finance
+
+SQLITE_SEQ_SCAN = re.compile(r"^SCAN (\w+)$")
+
+REPORT_QUERY = """<?xml version="1.0" encoding="utf-8"?>
+<C:calendar-query xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">
+  <D:prop><D:getetag/><C:calendar-data/></D:prop>
+  <C:filter><C:comp-filter name="VCALENDAR"><C:comp-filter name="VEVENT">
+    <C:time-range start="20260301T000000Z" end="20260401T000000Z"/>
+  </C:comp-filter></C:comp-filter></C:filter>
+</C:calendar-query>"""
+
+REPORT_SYNC = """<?xml version="1.0" encoding="utf-8"?>
+<D:sync-collection xmlns:D="DAV:"><D:sync-token/><D:prop><D:getetag/></D:prop></D:sync-collection>"""
+
+
+def _seed(db, user_id: int) -> int:
+    """A few months of data for ``user_id``; returns the id of one of its emails"""
+    category = models.Category(user_id=user_id, name="Groceries")
+    account = models.MailAccount(
+        user_id=user_id, email_address="plans@example.com", provider="custom",
+        imap_server="imap.example.com", smtp_server="smtp.example.com", password="x",
+    )
+    db.add_all([category, account])
+    db.flush()
+    emails = []
+    for i in range(200):
+        day = date(2026, 1, 1) + timedelta(days=i)
+        tr = models.Transaction(
+            user_id=user_id, category_id=category.id, title=f"t{i}",
+            amount=Decimal("12.50"), type="income" if i % 5 == 0 else "expense", date=day,
+        )
+        db.add(tr)
+        finance.apply_rollup(db, tr)
+        db.add(models.Note(user_id=user_id, title=f"n{i}", content="quarterly plan", created_at=datetime.combine(day, datetime.min.time())))
+        db.add(models.CalendarEvent(user_id=user_id, title=f"e{i}", date=day, caldav_uid=f"plan-{uuid.uuid4()}"))
+        email = models.Email(
+            account_id=account.id, message_id=f"<{uuid.uuid4()}@example.com>", sender="a@example.com",
+            subject="quarterly plan", date=datetime.combine(day, datetime.min.time()), body_text="hi",
+        )
+        db.add(email)
+        emails.append(email)
+    db.add(models.Budget(user_id=user_id, category_id=category.id, name="Food", amount=Decimal("300"), period="monthly", start_date=date(2026, 1, 1)))
+    db.add(models.SavingsGoal(user_id=user_id, name="Trip", target_amount=Decimal("1000")))
+    db.commit()
+    return emails[0].id
+
+
+@pytest.fixture(scope="module")
+def seeded(client):
+    """Authorization headers and an email id of a user with seeded data"""
+    credentials = {"username": f"plans-{uuid.uuid4().hex[:12]}", "password": "secret-password"}
+    assert client.post("/api/auth/register", json=credentials).status_code == 201
+    headers = {"Authorization": f"Bearer {client.post('/api/auth/login', json=credentials).json()['access_token']}"}
+    user_id = client.get("/api/auth/me", headers=headers).json()["id"]
+    db = SessionLocal()
+    try:
+        email_id = _seed(db, user_id)
+    finally:
+        db.close()
+    return headers, email_id
+
+
+# The savings lists are left out: both routes fail response validation against
+# the second SavingsGoalResponse in schemas.py, which shadows the first
+REQUESTS = [
+    ("GET", "/api/notes/", {}),
+    ("GET", "/api/notes/", {"params": {"is_archived": "false"}}),
+    ("GET", "/api/notes/search", {"params": {"q": "quarterly"}}),
+    ("GET", "/api/calendar/", {"params": {"start_date": "2026-03-01", "end_date": "2026-03-31"}}),
+    ("GET", "/api/calendar/export/ics", {}),
+    ("GET", "/api/finance/categories", {}),
+    ("GET", "/api/finance/transactions", {}),
+    ("GET", "/api/finance/summary", {"params": {"start_date": "2026-03-01", "end_date": "2026-03-31"}}),
+    ("GET", "/api/finance/summary", {"params": {"start_date": "2026-03-05", "end_date": "2026-03-20"}}),
+    ("GET", "/api/finance/summary/monthly", {}),
+    ("GET", "/api/finance/forecast", {}),
+    ("GET", "/api/finance/budgets", {}),
+    ("GET", "/api/finance/budgets/status", {}),
+    ("GET", "/api/mail/accounts", {}),
+    ("GET", "/api/mail/emails", {}),
+    ("GET", "/api/mail/search", {"params": {"q": "quarterly"}}),
+    ("GET", "/api/mail/emails/{email_id}", {}),
+    ("REPORT", "/caldav/calendar/", {"content": REPORT_QUERY}),
+    ("REPORT", "/caldav/calendar/", {"content": REPORT_SYNC}),
+]
+
+
+def _sequential_scans(conn, statement: str, parameters) -> list:
+    """Tables the plan for ``statement`` reads with a full scan (derived tables of literal rows don't count)"""
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    scanned = [m.group(1) for m in (SQLITE_SEQ_SCAN.match(row[-1]) for row in rows) if m]
+    return [table for table in scanned if table in Base.metadata.tables]
+
+
+@pytest.mark.parametrize("method, path, kwargs", REQUESTS, ids=[f"{m} {p} {k.get('params', '')}" for m, p, k in REQUESTS])
+def test_read_endpoint_uses_indexes(client, seeded, method, path, kwargs):
+    headers, email_id = seeded
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        response = client.request(method, path.format(email_id=email_id), headers=headers, **kwargs)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+        event.remove(async_engine.sync_engine, "before_cursor_execute", capture)
+    assert response.status_code in (200, 207), response.text
+    assert captured
+
+    with engine.connect() as conn:
+        scans = [(tables, " ".join(statement.split())) for statement, parameters in captured if (tables := _sequential_scans(conn, statement, parameters))]
+    assert scans == []
@@ -0,0 +1,28 @@
+"""Statement timing in metrics.py and query_audit.py survives failing statements"""
+import pytest
+from sqlalchemy import exc, text
+
+import database
+import metrics
+
+
+def _queries() -> float:
+    return metrics.DB_QUERIES.labels("sync")._value.get()
+
+
+def test_failed_statements_leave_no_start_times_on_the_connection():
+    with database.engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(exc.OperationalError):
+                conn.execute(text("SELECT * FROM no_such_table"))
+            conn.rollback()
+        before = _queries()
+        conn.execute(text("SELECT 1"))
+        assert _queries() == before + 1
+        assert not any(isinstance(value, list) and value for value in conn.info.values())
+
+
+def test_requests_are_labelled_with_the_prefixed_route_template(client, auth):
+    note_id = client.post("/api/notes/", json={"title": "t", "content": "c"}, headers=auth).json()["id"]
+    assert client.get(f"/api/notes/{note_id}", headers=auth).status_code == 200
+    assert 'route="/api/notes/{note_id}"' in metrics.render().decode()
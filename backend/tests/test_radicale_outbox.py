@@ -0,0 +1,37 @@
+"""Radicale outbox rows stop retrying after MAX_ATTEMPTS"""
+import uuid
+from datetime import datetime, timedelta
+
+from database import SessionLocal
+import models
+import radicale
+
+
+def test_push_fails_for_good_after_max_attempts(monkeypatch):
+    username = f"cal-{uuid.uuid4().hex[:12]}"
+    db = SessionLocal()
+    try:
+        radicale.enqueue_puts(db, username, [("a", "ics"), ("b", "ics")])
+        db.query(models.RadicaleOutbox).filter_by(username=username, caldav_uid="a").update(
+            {"attempts": radicale.MAX_ATTEMPTS - 1, "next_attempt_at": datetime.utcnow() - timedelta(seconds=1)}
+        )
+        db.query(models.RadicaleOutbox).filter_by(username=username, caldav_uid="b").update(
+            {"next_attempt_at": datetime.utcnow() + timedelta(hours=1)}
+        )
+        db.commit()
+        monkeypatch.setattr(radicale, "_put", lambda username, uid, ics: "HTTP 500: down")
+
+        radicale.process_due()
+        status = radicale.outbox_status(db, username)
+        assert {k: status[k] for k in ("total", "pending", "failed", "done")} == {"total": 2, "pending": 1, "failed": 1, "done": False}
+
+        db.query(models.RadicaleOutbox).filter_by(username=username, caldav_uid="b").delete()
+        db.commit()
+        assert radicale.outbox_status(db, username)["done"]
+
+        radicale.enqueue_puts(db, username, [("a", "ics")])
+        db.commit()
+        status = radicale.outbox_status(db, username)
+        assert (status["failed"], status["pending"]) == (0, 1)
+    finally:
+        db.close()
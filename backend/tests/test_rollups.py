@@ -0,0 +1,59 @@
+"""Monthly rollups keep one row per key, also across category deletes"""
+import uuid
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import func
+
+from database import SessionLocal
+import models
+from routers.finance import apply_rollup_deltas
+from tests.test_batch import _summary_by_category
+
+
+def _duplicate_keys() -> list:
+    R = models.TransactionRollup
+    db = SessionLocal()
+    try:
+        return (
+            db.query(R.user_id, R.month, R.category_id, R.type)
+            .group_by(R.user_id, R.month, R.category_id, R.type)
+            .having(func.count() > 1)
+            .all()
+        )
+    finally:
+        db.close()
+
+
+def test_repeated_deltas_add_to_one_row_per_key():
+    db = SessionLocal()
+    try:
+        user = models.User(username=f"rollup-{uuid.uuid4().hex[:12]}", hashed_password="x")
+        db.add(user)
+        db.flush()
+        for _ in range(3):
+            apply_rollup_deltas(db, user.id, {(date(2026, 2, 1), None, "expense"): [Decimal("2.50"), 1]})
+        db.commit()
+        rows = db.query(models.TransactionRollup.total, models.TransactionRollup.count).filter_by(user_id=user.id).all()
+        assert [(Decimal(total), count) for total, count in rows] == [(Decimal("7.50"), 3)]
+    finally:
+        db.close()
+
+
+def test_deleting_a_category_merges_its_rollups_into_uncategorized(client, auth):
+    category_id = client.post("/api/finance/categories", json={"name": "Food"}, headers=auth).json()["id"]
+    for category in (category_id, None, None):
+        transaction = {"title": "Lunch", "amount": "10", "type": "expense", "date": "2026-03-05", "category_id": category}
+        assert client.post("/api/finance/transactions", json=transaction, headers=auth).status_code == 201
+
+    assert client.delete(f"/api/finance/categories/{category_id}", headers=auth).status_code == 204
+
+    assert _summary_by_category(client, auth) == [(0, "expense", 30)]
+    assert _summary_by_category(client, auth, start_date="2026-03-02", end_date="2026-03-30") == [(0, "expense", 30)]
+    assert _duplicate_keys() == []
+    categories = client.get("/api/finance/categories", headers=auth).json()
+    assert category_id not in [c["id"] for c in categories]
+
+
+def test_deleting_another_users_category_is_not_found(client, auth):
+    assert client.delete("/api/finance/categories/999999", headers=auth).status_code == 404
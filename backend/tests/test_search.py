@@ -0,0 +1,15 @@
+"""Search: snippets are escaped HTML with only the <mark> tags as markup; page sizes are bounded"""
+import pytest
+
+
+def test_note_snippet_escapes_content(client, auth):
+    note = {"title": "xss", "content": "<img src=x onerror=alert(1)> quokka & friends"}
+    assert client.post("/api/notes/", json=note, headers=auth).status_code == 201
+    results = client.get("/api/notes/search", params={"q": "quokka"}, headers=auth).json()
+    assert [r["snippet"] for r in results] == ["&lt;img src=x onerror=alert(1)&gt; <mark>quokka</mark> &amp; friends"]
+
+
+@pytest.mark.parametrize("path", ["/api/notes/search", "/api/mail/search"])
+@pytest.mark.parametrize("limit", [0, 101])
+def test_search_limit_is_bounded(client, auth, path, limit):
+    assert client.get(path, params={"q": "quokka", "limit": limit}, headers=auth).status_code == 422
@@ -0,0 +1,33 @@
+"""CSV statement parsing: zero amounts and the per-file day/month order"""
+from datetime import date
+from decimal import Decimal
+
+from statement_import import CsvParser
+
+
+def _parse(text: str):
+    parser = CsvParser()
+    rows = parser.feed(text.encode())
+    rows += parser.close()
+    return parser, rows
+
+
+def test_zero_amount_rows_are_skipped():
+    parser, rows = _parse("Date,Amount,Description\n2026-01-02,0.00,Card check\n2026-01-03,-4.50,Coffee\n")
+    assert [(r.title, r.amount) for r in rows] == [("Coffee", Decimal("-4.50"))]
+    assert parser.skipped == 1
+
+
+def test_month_first_file_is_detected_from_a_later_row():
+    parser, rows = _parse("Date,Amount,Description\n03/04/2026,-1,a\n05/06/2026,-2,b\n12/25/2026,-3,c\n")
+    assert [r.date for r in rows] == [date(2026, 3, 4), date(2026, 5, 6), date(2026, 12, 25)]
+
+
+def test_day_first_file_is_detected_from_a_later_row():
+    parser, rows = _parse("Date,Amount,Description\n03/04/2026,-1,a\n25/12/2026,-3,c\n05/06/2026,-2,b\n")
+    assert [r.date for r in rows] == [date(2026, 4, 3), date(2026, 12, 25), date(2026, 6, 5)]
+
+
+def test_ambiguous_file_reads_day_first():
+    parser, rows = _parse("Date,Amount,Description\n03/04/2026,-1,a\n")
+    assert [r.date for r in rows] == [date(2026, 4, 3)]
@@ -0,0 +1,114 @@
+"""
+In-process cache of verified access tokens to user snapshots
+
+get_current_user runs on every authenticated request, including every CalDAV
+PROPFIND. Caching the user row per token lets those requests skip the
+SELECT on users entirely. Entries expire after USER_CACHE_TTL_SECONDS (or
+when the token itself expires, if sooner) and are dropped as soon as the user
+row is updated or deleted through the ORM in this process. Other uvicorn
+workers only see such changes once their own entries expire.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+
+from config import settings
+import models
+
+_COLUMNS = [c.key for c in models.User.__table__.columns]
+
+
+class UserCache:
+    """Bounded LRU of token -> (expires_at, user column snapshot)"""
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._tokens_by_user: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[models.User]:
+        """Return a detached User for ``token``, or None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._drop(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            snapshot = entry[1]
+
+        user = models.User(**snapshot)
+        make_transient_to_detached(user)
+        return user
+
+    def put(self, token: str, user: models.User, token_exp: Optional[float] = None) -> None:
+        """Remember ``user`` for ``token`` until the TTL or the token's own expiry"""
+        expires_at = time.monotonic() + self.ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, time.monotonic() + (token_exp - time.time()))
+        snapshot = {key: getattr(user, key) for key in _COLUMNS}
+
+        with self._lock:
+            self._drop(token)
+            self._entries[token] = (expires_at, snapshot)
+            self._tokens_by_user.setdefault(snapshot["id"], set()).add(token)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Forget every cached token belonging to ``user_id``"""
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._drop(token)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _drop(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        user_id = entry[1]["id"]
+        tokens = self._tokens_by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user_id]
+
+
+user_cache = UserCache(settings.USER_CACHE_MAX_SIZE, settings.USER_CACHE_TTL_SECONDS)
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    user_cache.invalidate_user(target.id)
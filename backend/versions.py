@@ -0,0 +1,106 @@
+"""
+Per-user resource version counters
+
+A resource_versions row holds a monotonically increasing counter for one
+(user, resource) pair. Writers bump it inside their own transaction; the
+upsert takes a row lock that is held until commit, so concurrent writers for
+the same user are serialized and versions become visible in commit order.
+
+ORM writes to the models in TRACKED bump their resource once per flush
+(calendar events are handled by calendar_sync.py, which also stamps them);
+bulk statements bypass the unit of work and must call ``bump`` themselves.
+
+List endpoints derive a weak ETag from the versions their response depends
+on, so ``conditional_get`` can answer If-None-Match with 304 from one
+indexed lookup, before any rows are loaded.
+"""
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy import event, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+
+_INSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+
+TRACKED = {
+    models.Note: "notes",
+    models.Transaction: "transactions",
+    models.Category: "categories",
+    models.Budget: "budgets",
+    models.SavingsGoal: "savings",
+}
+
+
+def bump(conn: Connection, user_id: int, resource: str) -> int:
+    """Increment and return the version of ``resource`` for ``user_id``.
+
+    Pass ``db.connection()`` so the change commits with the session.
+    """
+    V = models.ResourceVersion
+    stmt = _INSERTS[conn.dialect.name](V).values(user_id=user_id, resource=resource, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[V.user_id, V.resource],
+        set_={"version": V.version + 1},
+    ).returning(V.version)
+    return conn.execute(stmt).scalar_one()
+
+
+def version_query(user_id: int, resource: str):
+    """SELECT of the current version; execute with a sync or async session (None means 0)"""
+    V = models.ResourceVersion
+    return select(V.version).where(V.user_id == user_id, V.resource == resource)
+
+
+def current(db, user_id: int, resource: str) -> int:
+    """Current version of ``resource`` for ``user_id`` (0 if never bumped)"""
+    return db.scalar(version_query(user_id, resource)) or 0
+
+
+def current_many(db: Session, user_id: int, resources) -> dict:
+    """{resource: version} for several resources in one query (missing ones are 0)"""
+    V = models.ResourceVersion
+    found = dict(db.execute(select(V.resource, V.version).where(V.user_id == user_id, V.resource.in_(resources))).all())
+    return {resource: found.get(resource, 0) for resource in resources}
+
+
+def list_etag(request: Request, user_id: int, current: dict) -> str:
+    """Weak ETag for a list response: the user, the exact URL and the versions it depends on"""
+    state = ",".join(f"{resource}:{version}" for resource, version in sorted(current.items()))
+    digest = hashlib.sha1(f"{user_id}|{request.url.path}?{request.url.query}|{state}".encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _opaque(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def conditional_get(request: Request, response: Response, db: Session, user_id: int, *resources: str) -> Optional[Response]:
+    """Tag ``response`` with the list ETag, or return a 304 to send instead if the client's copy is current"""
+    tag = list_etag(request, user_id, current_many(db, user_id, resources))
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+    offered = {_opaque(t.strip()) for t in request.headers.get("if-none-match", "").split(",")}
+    if _opaque(tag) in offered or "*" in offered:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+@event.listens_for(Session, "before_flush")
+def _bump_tracked(session: Session, flush_context, instances) -> None:
+    touched = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        resource = TRACKED.get(type(obj))
+        if resource is None:
+            continue
+        if obj in session.dirty and obj not in session.deleted and not session.is_modified(obj, include_collections=False):
+            continue
+        touched.add((obj.user_id, resource))
+    for user_id, resource in sorted(touched):
+        bump(session.connection(), user_id, resource)